@@ -0,0 +1,311 @@
+import asyncio
+import socket
+import errno
+import heapq
+import time
+
+import portscan
+import fingerprint
+from output import ResultWriter
+from targets import Scheduler
+from rtt import RttEstimator
+from stats import Stats
+
+try:
+    import resource
+except ImportError:
+    # Windows: ограничения на число дескрипторов нет
+    resource = None
+
+
+def fd_limit(reserve: int = 64):
+    """Raises soft RLIMIT_NOFILE up to the hard limit and returns how many sockets may be open at once.
+    Returns None if the platform has no such limit."""
+    if resource is None:
+        return None
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != hard:
+        target = hard if hard != resource.RLIM_INFINITY else max(soft, 65536)
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+            soft = target
+        except (ValueError, OSError):
+            pass
+    return max(1, soft - reserve)
+
+
+# connect_ex неблокирующего сокета: соединение начато, ответ придет позже
+IN_PROGRESS = {errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EAGAIN}
+
+
+class Connector:
+    """Non-blocking TCP connects on the selector of the event loop, without a task or wait_for per connect.
+    connect_ex starts the connect and the socket is registered for writing; the callback runs right after
+    select returned, so the connect time is taken when the socket became writable, not when the awaiting
+    coroutine is resumed. Deadlines of all connects are in one heap served by one timer of the loop."""
+
+    def __init__(self, loop):
+        self.loop = loop
+        # fd -> (сокет, future, время начала)
+        self._pending = {}
+        # (срок по loop.time(), fd, future); завершенные раньше срока удаляются, когда до них дойдет очередь
+        self._deadlines = []
+        self._timer = None
+
+    def connect(self, sock, address, timeout: float):
+        """Future of (errno, seconds to the answer); errno is 0 for connected socket, None if there was
+        no answer for timeout seconds"""
+        future = self.loop.create_future()
+        started = time.perf_counter()
+        error = sock.connect_ex(address)
+        if error in IN_PROGRESS:
+            error = self._finished(sock)
+        if error is not None:
+            future.set_result((error, time.perf_counter() - started))
+            return future
+        fd = sock.fileno()
+        self._pending[fd] = (sock, future, started)
+        self.loop.add_writer(fd, self._writable, fd)
+        deadline = self.loop.time() + timeout
+        heapq.heappush(self._deadlines, (deadline, fd, future))
+        if self._timer is None or deadline < self._timer.when():
+            self._schedule()
+        return future
+
+    @staticmethod
+    def _finished(sock):
+        """errno of a connect that the kernel has already finished or None. On loopback and in a local network
+        the answer is often handled before connect_ex returns, then it needs no select at all"""
+        error = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        if error:
+            return error
+        try:
+            sock.getpeername()
+        except OSError:
+            return None
+        return 0
+
+    def abandon(self, sock):
+        """Forgets the connect of the socket before it is closed, when its probe is cancelled"""
+        entry = self._pending.pop(sock.fileno(), None)
+        if entry is not None:
+            self.loop.remove_writer(sock.fileno())
+
+    def _writable(self, fd):
+        answered = time.perf_counter()
+        sock, future, started = self._pending.pop(fd)
+        self.loop.remove_writer(fd)
+        if not future.done():
+            future.set_result((sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR), answered - started))
+
+    def _schedule(self):
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = self.loop.call_at(self._deadlines[0][0], self._expire) if self._deadlines else None
+
+    def _expire(self):
+        now = self.loop.time()
+        due = []
+        while self._deadlines and self._deadlines[0][0] <= now:
+            due.append(heapq.heappop(self._deadlines)[1:])
+        # Ответ мог прийти, пока цикл был занят, и select его еще не видел. Отмеченные сокеты закрываются
+        # через две итерации: к тому времени ответы, которые пришли до срока, уже разобраны в _writable
+        self.loop.call_soon(self.loop.call_soon, self._time_out, due)
+        self._timer = None
+        self._schedule()
+
+    def _time_out(self, due):
+        for fd, future in due:
+            entry = self._pending.get(fd)
+            # fd мог уже достаться новому сокету, сверяем future
+            if entry is not None and entry[1] is future:
+                del self._pending[fd]
+                self.loop.remove_writer(fd)
+                if not future.done():
+                    future.set_result((None, None))
+
+
+class AsyncScanner:
+    """Same scan as Scanner on non-blocking sockets from one thread: a fixed set of concurrency worker
+    coroutines takes probes from the scheduler, TCP connects are driven by Connector."""
+
+    def __init__(self, hosts, start_port: int = 1, end_port: int = 65535, tcp: bool = True,
+                 udp: bool = True, timeout: float = 0.5, concurrency: int = 2000,
+                 writer: ResultWriter = None, host_limit: int = None, min_timeout: float = 0.1,
+                 max_timeout: float = 5, retries: int = 1, max_probes: int = 3, cursors=None,
+                 stats: Stats = None, port_step: int = 1):
+        self.hosts = [hosts] if isinstance(hosts, str) else list(hosts)
+        self.ports = portscan.PortRange(start_port, end_port, tcp, udp, port_step)
+        self.scheduler = Scheduler(self.hosts, self.ports, host_limit, cursors)
+        self.timeout = timeout
+        self.retries = retries
+        self.max_probes = max_probes
+        self.rtt = [RttEstimator(host, timeout, min_timeout, max_timeout) for host in self.hosts]
+        self.writer = writer if writer is not None else ResultWriter()
+        self.stats = stats if stats is not None else Stats()
+
+        limit = fd_limit()
+        self.concurrency = concurrency if limit is None else min(concurrency, limit)
+        self.isWorking = True
+
+        self._loop = None
+        self._released = None
+        self._connector = None
+
+    def start(self):
+        try:
+            asyncio.run(self._run())
+        finally:
+            self._finish()
+
+    def stop(self):
+        self.isWorking = False
+        self.scheduler.close()
+        self._finish()
+
+    def _finish(self):
+        for rtt in self.rtt:
+            self.writer.put(rtt)
+        self.writer.close()
+
+    async def _run(self):
+        self._loop = asyncio.get_running_loop()
+        self._released = asyncio.Event()
+        self._connector = Connector(self._loop)
+        # Задача на каждую пробу и wait_for вокруг нее стоили больше самой пробы: работает постоянный набор
+        await asyncio.gather(*(self._worker() for _ in range(self.concurrency)))
+
+    async def _worker(self):
+        while self.isWorking:
+            item = self.scheduler.take(block=False)
+            if item is None:
+                if self.scheduler.exhausted:
+                    return
+                # Все хосты с портами уперлись в host_limit, ждем завершения какой-нибудь пробы
+                self._released.clear()
+                await self._released.wait()
+                continue
+            await self._probe(*item)
+            # Проба на loopback завершается без ожидания: без этого один воркер не отдал бы цикл остальным
+            await asyncio.sleep(0)
+
+    async def _probe(self, host_index, index):
+        _type, port = self.ports[index]
+        self.stats.probe_started()
+        state = None
+        try:
+            if _type == 't':
+                state = await self._check_tcp(host_index, port)
+            if _type == 'u':
+                state = await self._check_udp(host_index, port)
+        finally:
+            # Отмененная по Ctrl-C проба не считается сделанной и будет повторена при --resume
+            done = state is not None
+            self.stats.probe_done(state if done else 'filtered')
+            self.scheduler.release(host_index, index, done)
+            self._released.set()
+
+    def _answered(self, host_index, started=None, latency=None):
+        if latency is None:
+            latency = time.perf_counter() - started
+        self.rtt[host_index].add(latency)
+        self.stats.latency(latency)
+        return latency
+
+    async def _check_tcp(self, host_index, port):
+        host, rtt = self.hosts[host_index], self.rtt[host_index]
+        for attempt in range(self.retries + 1):
+            sock = socket.socket()
+            sock.setblocking(False)
+            self.stats.packet_sent()
+            try:
+                error, latency = await self._connector.connect(sock, (host, port), rtt.timeout(attempt))
+            except asyncio.CancelledError:
+                self._connector.abandon(sock)
+                sock.close()
+                raise
+            except OSError:
+                sock.close()
+                return 'filtered'
+            if error is None:
+                self.stats.timeout()
+                sock.close()
+                continue
+            if error:
+                sock.close()
+                if error == errno.ECONNREFUSED:
+                    self._answered(host_index, latency=latency)
+                    return 'closed'
+                return 'filtered'
+
+            latency = self._answered(host_index, latency=latency)
+            service, banner = await self._identify(sock, host, port)
+            self.writer.put(portscan.Result(host, 'TCP', port, service, latency=latency, banner=banner))
+            return 'open'
+        return 'filtered'
+
+    async def _identify(self, sock, host, port):
+        """Same as Scanner._identify. Closes sock."""
+        service, banner = '', b''
+        fresh = True
+        try:
+            for probe in fingerprint.DATABASE.probes_for('tcp', port)[:self.max_probes]:
+                if not fresh:
+                    sock.close()
+                    sock = socket.socket()
+                    sock.setblocking(False)
+                    await asyncio.wait_for(self._loop.sock_connect(sock, (host, port)), self.timeout)
+                    fresh = True
+                try:
+                    if probe.payload:
+                        fresh = False
+                        await self._loop.sock_sendall(sock, probe.payload)
+                    data = await asyncio.wait_for(self._loop.sock_recv(sock, 1024), self.timeout)
+                except asyncio.TimeoutError:
+                    continue
+                except OSError:
+                    fresh = False
+                    continue
+
+                fresh = False
+                banner = banner or data
+                service = fingerprint.DATABASE.match(data)
+                if service:
+                    banner = data
+                    break
+        except (OSError, asyncio.TimeoutError):
+            pass
+        finally:
+            sock.close()
+        return service, banner
+
+    async def _check_udp(self, host_index, port):
+        host, rtt = self.hosts[host_index], self.rtt[host_index]
+        # Подключенный UDP сокет: ICMP port unreachable приходит как ConnectionRefusedError
+        payload = fingerprint.DATABASE.probes_for('udp', port)[0].payload
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setblocking(False)
+        try:
+            sock.connect((host, port))
+            for attempt in range(self.retries + 1):
+                self.stats.packet_sent()
+                started = time.perf_counter()
+                try:
+                    await self._loop.sock_sendall(sock, payload)
+                    data = await asyncio.wait_for(self._loop.sock_recv(sock, 1024), rtt.timeout(attempt))
+                except asyncio.TimeoutError:
+                    self.stats.timeout()
+                    continue
+                except ConnectionRefusedError:
+                    self._answered(host_index, started)
+                    return 'closed'
+                latency = self._answered(host_index, started)
+                self.writer.put(portscan.Result(host, 'UDP', port, fingerprint.DATABASE.match(data),
+                                                latency=latency, banner=data))
+                return 'open'
+            self.writer.put(portscan.Result(host, 'UDP', port, state='open|filtered'))
+            return 'open|filtered'
+        except OSError:
+            return 'filtered'
+        finally:
+            sock.close()
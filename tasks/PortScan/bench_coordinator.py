@@ -0,0 +1,108 @@
+"""CPU time burned by the coordinator (main) thread of Scanner.start on a localhost scan.
+
+LegacyScanner reproduces the old design: pre-filled queue.Queue of ports and a
+coordinator spinning on to_print.get(block=False).
+
+    python bench_coordinator.py [END_PORT] [WORKERS]
+"""
+import os
+import sys
+import queue
+import socket
+import time
+
+import portscan
+from output import ResultWriter
+
+
+def make_queue(start_port, end_port, tcp, udp):
+    q = queue.Queue()
+    for i in range(start_port, end_port + 1):
+        if tcp:
+            q.put(('t', i))
+        if udp:
+            q.put(('u', i))
+    return q
+
+
+class LegacyScanner(portscan.Scanner):
+    def __init__(self, host, start_port, end_port, workers, stream):
+        super().__init__(host, start_port, end_port, True, False, workers=workers)
+        self.writer.close()
+        self.queue = make_queue(start_port, end_port, True, False)
+        self.to_print = queue.Queue()
+        self.writer = self
+        self.stream = stream
+
+    def put(self, result):
+        self.to_print.put(result)
+
+    def start(self):
+        for t in self.threads:
+            t.daemon = True
+            t.start()
+        while not self.queue.empty() and self.isWorking:
+            try:
+                print(self.to_print.get(block=False), file=self.stream)
+            except queue.Empty:
+                pass
+
+        for t in self.threads:
+            t.join()
+
+        while not self.to_print.empty():
+            print(self.to_print.get(), file=self.stream)
+
+    def _do_work(self):
+        while self.isWorking:
+            try:
+                _type, port = self.queue.get(block=False)
+            except queue.Empty:
+                break
+            else:
+                self._check_tcp(0, port)
+
+
+def listeners(count, end_port):
+    """Listeners that never answer: probes to them wait for the full timeout, so workers are I/O-bound"""
+    result = []
+    port = end_port
+    while len(result) < count and port > 1024:
+        sock = socket.socket()
+        try:
+            sock.bind(('127.0.0.1', port))
+        except OSError:
+            sock.close()
+        else:
+            sock.listen(100)
+            result.append(sock)
+        port -= 1
+    return result
+
+
+def measure(scanner):
+    cpu, wall = time.thread_time(), time.perf_counter()
+    scanner.start()
+    return time.thread_time() - cpu, time.perf_counter() - wall
+
+
+def main(argv):
+    end_port = int(argv[1]) if len(argv) > 1 else 20000
+    workers = int(argv[2]) if len(argv) > 2 else 20
+    opened = listeners(2 * workers, end_port)
+
+    with open(os.devnull, 'w') as devnull:
+        legacy = measure(LegacyScanner('127.0.0.1', 1, end_port, workers, devnull))
+        current = measure(portscan.Scanner('127.0.0.1', 1, end_port, True, False, workers=workers,
+                                           writer=ResultWriter(devnull)))
+
+    print(f'Ports 1-{end_port}, {workers} workers, {len(opened)} silent listeners')
+    for name, (cpu, wall) in (('busy-spin queue', legacy), ('blocking writer', current)):
+        print(f'{name:>16}: coordinator cpu {cpu:.3f}s, wall {wall:.3f}s')
+
+    for sock in opened:
+        sock.close()
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,71 @@
+"""Match throughput of fingerprint.DATABASE over a corpus of captured banners,
+compared with the old define_proto substring checks.
+
+    python bench_fingerprint.py [ROUNDS]
+"""
+import sys
+import time
+
+import fingerprint
+
+CORPUS = [
+    b'HTTP/1.1 200 OK\r\nServer: nginx/1.18.0 (Ubuntu)\r\nContent-Type: text/html\r\nContent-Length: 612\r\n\r\n',
+    b'HTTP/1.0 400 Bad Request\r\nServer: Apache/2.4.41\r\nConnection: close\r\n\r\n<html></html>',
+    b'SSH-2.0-OpenSSH_8.2p1 Ubuntu-4ubuntu0.5\r\n',
+    b'SSH-2.0-dropbear_2020.81\r\n',
+    b'220 mx.example.com ESMTP Postfix (Ubuntu)\r\n',
+    b'220-smtp.yandex.ru ESMTP ready\r\n220 go ahead\r\n',
+    b'220 (vsFTPd 3.0.3)\r\n',
+    b'220 ProFTPD Server (Debian) [::ffff:10.0.0.1]\r\n',
+    b'+OK Dovecot (Ubuntu) ready.\r\n',
+    b'* OK [CAPABILITY IMAP4rev1 SASL-IR LOGIN-REFERRALS ID ENABLE IDLE LITERAL+ STARTTLS] Dovecot ready.\r\n',
+    b'\x16\x03\x03\x00\x5d\x02\x00\x00\x59\x03\x03' + b'\x11' * 32 + b'\x00\xc0\x2f\x00',
+    b'\x15\x03\x01\x00\x02\x02\x28',
+    fingerprint.DNS_ID + b'\x81\x80\x00\x01\x00\x0d\x00\x00\x00\x00' + b'\x00' * 40,
+    b'\x1c\x02\x03\xe8' + b'\x00' * 20 + fingerprint.random_time + b'\x00' * 16,
+    b'-ERR unknown command\r\n',
+    b'\x00\x00\x00\x00garbage from some custom service' * 4,
+    b'',
+]
+
+
+def define_proto(data):
+    """define_proto from portscan.py before the service database"""
+    if len(data) > 4 and data[:4] == b'HTTP':
+        return ' HTTP'
+    if b'SMTP' in data:
+        return ' SMTP'
+    if b'POP3' in data:
+        return ' POP3'
+    if b'IMAP' in data:
+        return ' IMAP'
+    if len(data) > 11 and data[:2] == fingerprint.udp_to_send[:2] and (data[3] & 1) == 1:
+        return ' DNS'
+    if len(data) > 39:
+        mode = 7 & data[0]
+        version = (data[0] >> 3) & 7
+        if mode == 4 and version == 2 and fingerprint.random_time == data[24:32]:
+            return ' NTP'
+    return ''
+
+
+def measure(function, rounds):
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for banner in CORPUS:
+            function(banner)
+    return rounds * len(CORPUS) / (time.perf_counter() - started)
+
+
+def main(argv):
+    rounds = int(argv[1]) if len(argv) > 1 else 20000
+
+    for banner in CORPUS:
+        print(f'{fingerprint.DATABASE.match(banner) or "-":>5} {define_proto(banner).strip() or "-":>5}  {banner[:50]}')
+    print()
+    print(f'service database: {measure(fingerprint.DATABASE.match, rounds):,.0f} banners/s')
+    print(f'    define_proto: {measure(define_proto, rounds):,.0f} banners/s')
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,90 @@
+"""Throughput of the scan engines on a local port block with known states.
+
+The block starts at START and has OPEN listening ports, FILTERED ports that drop SYN
+(listen backlog is filled and nobody accepts, so connect times out) and closed ports for the rest.
+Every engine runs with every worker / concurrency count, sharded one with 500 workers per process,
+results go to devnull.
+
+    python bench_scan.py [START] [PORTS] [OPEN] [FILTERED]
+
+On one core, 10000 ports: threads -w 500 19300 ports/s, async -c 500 19500, -c 2000 16500, -c 5000 14300
+(async with a task and wait_for per probe did 4500 ports/s with p50 latency 65-575 ms of event loop lag).
+"""
+import os
+import sys
+import socket
+
+import portscan
+import async_scanner
+import sharded
+from output import ResultWriter
+from stats import Stats
+
+HOST = '127.0.0.1'
+WORKERS = [20, 100, 500]
+CONCURRENCY = [500, 2000, 5000]
+PROCESSES = [2, os.cpu_count() or 1]
+
+
+def open_ports(ports):
+    result = []
+    for port in ports:
+        sock = socket.socket()
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((HOST, port))
+        sock.listen(100)
+        result.append(sock)
+    return result
+
+
+def filtered_ports(ports):
+    """Listeners with full accept queue: kernel drops new SYN, probe waits for the timeout"""
+    result = []
+    for port in ports:
+        sock = socket.socket()
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((HOST, port))
+        sock.listen(0)
+        result.append(sock)
+        for _ in range(2):
+            client = socket.socket()
+            client.setblocking(False)
+            client.connect_ex((HOST, port))
+            result.append(client)
+    return result
+
+
+
+def main(argv):
+    start = int(argv[1]) if len(argv) > 1 else 20000
+    count = int(argv[2]) if len(argv) > 2 else 10000
+    opened = int(argv[3]) if len(argv) > 3 else 100
+    filtered = int(argv[4]) if len(argv) > 4 else 20
+    end = start + count - 1
+
+    sockets = open_ports(range(start, start + opened))
+    sockets += filtered_ports(range(start + opened, start + opened + filtered))
+    print(f'Ports {start}-{end}: {opened} open, {filtered} filtered, {count - opened - filtered} closed')
+
+    with open(os.devnull, 'w') as devnull:
+        runs = [(f'threads -w {workers}', lambda stats, w=workers: portscan.Scanner(
+                    HOST, start, end, True, False, workers=w, writer=ResultWriter(devnull), max_probes=1,
+                    stats=stats)) for workers in WORKERS]
+        runs += [(f'async -c {concurrency}', lambda stats, c=concurrency: async_scanner.AsyncScanner(
+                    HOST, start, end, True, False, concurrency=c, writer=ResultWriter(devnull), max_probes=1,
+                    stats=stats)) for concurrency in CONCURRENCY]
+        runs += [(f'threads -P {processes}', lambda stats, p=processes: sharded.ShardedScanner(
+                    HOST, start, end, True, False, processes=p, writer=ResultWriter(devnull), stats=stats,
+                    max_probes=1, workers=WORKERS[-1])) for processes in PROCESSES]
+        for name, make in runs:
+            stats = Stats()
+            make(stats).start()
+            elapsed = stats.elapsed()
+            print(f'{name:>16}: {elapsed:6.2f}s {stats.completed / elapsed:8.0f} ports/s | {stats}')
+
+    for sock in sockets:
+        sock.close()
+
+
+if __name__ == "__main__":
+    main(sys.argv)
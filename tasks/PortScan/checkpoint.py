@@ -0,0 +1,50 @@
+import os
+import json
+import threading
+
+
+def load(path: str) -> dict:
+    with open(path) as f:
+        return json.load(f)
+
+
+class Checkpoint:
+    """Saves scan progress to json file every interval seconds and when the scan stops.
+    Progress is per host index of the first not done probe. Results of all probes before it are
+    flushed by the writer before the file is saved, so after a kill nothing is lost, at most a few
+    probes are repeated. The file also keeps command line and hosts to restart the same scan."""
+
+    def __init__(self, path: str, argv, hosts, scheduler, writer, interval: float = 10):
+        self.path = path
+        self.argv = list(argv)
+        self.hosts = hosts
+        self.scheduler = scheduler
+        self.writer = writer
+        self.interval = interval
+
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        self.save()
+
+    def save(self):
+        cursors = self.scheduler.checkpoint()
+        self.writer.flush()
+        state = {'argv': self.argv, 'hosts': self.hosts, 'cursors': cursors,
+                 'done': all(cursor >= len(self.scheduler.ports) for cursor in cursors)}
+        temp = self.path + '.tmp'
+        with open(temp, 'w') as f:
+            json.dump(state, f)
+        os.replace(temp, self.path)
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.save()
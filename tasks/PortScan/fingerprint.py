@@ -0,0 +1,137 @@
+import re
+import json
+import random
+import struct
+import typing
+
+random_time = random.randint(2 ** 16, 2 ** 64 - 1).to_bytes(8, 'big')
+udp_to_send = b'\x13' + b'\0' * 39 + random_time
+
+DNS_ID = b'\x13\x37'
+# Запрос NS записей корня, рекурсия разрешена
+DNS_QUERY = DNS_ID + b'\x01\x00\x00\x01\x00\x00\x00\x00\x00\x00' + b'\x00\x00\x02\x00\x01'
+
+SNMP_REQUEST_ID = b'\x13\x37\x13\x37'
+# SNMPv1 GetRequest sysDescr.0 с community public
+SNMP_GET = (b'\x30\x29\x02\x01\x00\x04\x06public\xa0\x1c\x02\x04' + SNMP_REQUEST_ID +
+            b'\x02\x01\x00\x02\x01\x00\x30\x0e\x30\x0c\x06\x08\x2b\x06\x01\x02\x01\x01\x01\x00\x05\x00')
+
+
+def _client_hello() -> bytes:
+    ciphers = b'\xc0\x2f\xc0\x30\xc0\x2b\xc0\x2c\x00\x9c\x00\x9d\x00\x2f\x00\x35\x00\xff'
+    body = (b'\x03\x03' + bytes(random.getrandbits(8) for _ in range(32)) + b'\x00' +
+            struct.pack('!H', len(ciphers)) + ciphers + b'\x01\x00')
+    handshake = b'\x01' + len(body).to_bytes(3, 'big') + body
+    return b'\x16\x03\x01' + struct.pack('!H', len(handshake)) + handshake
+
+
+def _ntp_first_bytes() -> bytes:
+    """Character class for the first byte of NTP server answer: any leap indicator and version, mode 4"""
+    return b'[' + b''.join(re.escape(bytes([b])) for b in range(256) if b & 7 == 4) + b']'
+
+
+class Probe(typing.NamedTuple):
+    name: str
+    proto: str
+    # Пустой payload - ничего не отправляем, только ждем приветствие сервера
+    payload: bytes
+    # Порты, для которых проба отправляется первой. Без портов проба используется для всех остальных
+    ports: frozenset = frozenset()
+
+
+class Match(typing.NamedTuple):
+    service: str
+    pattern: bytes
+
+
+DEFAULT_PROBES = [
+    Probe('NULL', 'tcp', b'', frozenset({21, 22, 23, 25, 110, 143, 587, 2525})),
+    Probe('GetRequest', 'tcp', b'GET / HTTP/1.0\r\n\r\n', frozenset({80, 81, 8000, 8008, 8080, 8888})),
+    Probe('TLSClientHello', 'tcp', _client_hello(), frozenset({443, 465, 636, 993, 995, 8443})),
+    Probe('DNSQueryTCP', 'tcp', struct.pack('!H', len(DNS_QUERY)) + DNS_QUERY, frozenset({53})),
+    Probe('DNSQuery', 'udp', DNS_QUERY, frozenset({53, 5353})),
+    Probe('NTPRequest', 'udp', udp_to_send, frozenset({123})),
+    Probe('SNMPv1GetRequest', 'udp', SNMP_GET, frozenset({161})),
+    # Запасные пробы для остальных портов, в порядке отправки
+    Probe('NULL', 'tcp', b''),
+    Probe('GetRequest', 'tcp', b'GET / HTTP/1.0\r\n\r\n'),
+    Probe('TLSClientHello', 'tcp', _client_hello()),
+    Probe('NTPRequest', 'udp', udp_to_send),
+]
+
+DEFAULT_MATCHES = [
+    Match('HTTP', rb'\AHTTP/\d\.\d'),
+    Match('SSH', rb'\ASSH-\d\.\d+-'),
+    Match('FTP', rb'\A220[ -][^\r\n]*(?i:ftp)'),
+    Match('SMTP', rb'\A220[ -][^\r\n]*(?i:smtp|postfix|exim|sendmail|mail)'),
+    Match('POP3', rb'\A\+OK'),
+    Match('IMAP', rb'\A\* (?:OK|PREAUTH|BYE)'),
+    Match('TLS', rb'\A[\x15\x16]\x03[\x00-\x04]'),
+    Match('DNS', rb'\A(?:..)?' + re.escape(DNS_ID) + rb'[\x80-\xff]'),
+    Match('NTP', rb'\A' + _ntp_first_bytes() + rb'.{23}' + re.escape(random_time)),
+    Match('SNMP', rb'\A\x30.{1,4}\x02\x01[\x00\x01].*?\xa2.{1,3}\x02\x04' + re.escape(SNMP_REQUEST_ID)),
+    # Подписи без привязки к началу, как в старом define_proto
+    Match('SMTP', rb'SMTP'),
+    Match('POP3', rb'POP3'),
+    Match('IMAP', rb'IMAP'),
+]
+
+
+class ServiceDatabase:
+    """Probes to send and answer signatures. Signatures are compiled into two regexes with a named
+    group per signature: one for signatures anchored with \\A, that is tried only at the start of the
+    answer, and one for the rest. Anchored signatures win, inside each group earlier signatures win."""
+
+    def __init__(self, probes, matches):
+        self.probes = list(probes)
+        self.matches = list(matches)
+        self._compile()
+
+    def _compile(self):
+        anchored = [(i, m.pattern) for i, m in enumerate(self.matches) if m.pattern.startswith(rb'\A')]
+        floating = [(i, m.pattern) for i, m in enumerate(self.matches) if not m.pattern.startswith(rb'\A')]
+        self._anchored = re.compile(b'|'.join(b'(?P<m%d>%s)' % (i, p[2:]) for i, p in anchored) or b'(?!)',
+                                    re.DOTALL)
+        self._floating = re.compile(b'|'.join(b'(?P<m%d>%s)' % (i, p) for i, p in floating) or b'(?!)',
+                                    re.DOTALL)
+        self._preferred = {}
+        self._fallback = {}
+        self._cache = {}
+        for probe in self.probes:
+            if probe.ports:
+                for port in probe.ports:
+                    self._preferred.setdefault((probe.proto, port), []).append(probe)
+            else:
+                self._fallback.setdefault(probe.proto, []).append(probe)
+
+    def extend(self, path: str):
+        """Adds probes and signatures from json file:
+        {"probes": [{"name": ..., "proto": "tcp", "payload": "...", "ports": [...]}],
+         "matches": [{"service": ..., "pattern": "..."}]}
+        Strings are taken as latin-1, so any byte can be written as \\u00XX. New signatures are checked first."""
+        with open(path) as f:
+            data = json.load(f)
+        for probe in data.get('probes', []):
+            self.probes.append(Probe(probe['name'], probe.get('proto', 'tcp'),
+                                     probe.get('payload', '').encode('latin-1'), frozenset(probe.get('ports', []))))
+        matches = [Match(m['service'], m['pattern'].encode('latin-1')) for m in data.get('matches', [])]
+        self.matches = matches + self.matches
+        self._compile()
+
+    def probes_for(self, proto: str, port: int):
+        """Probes for the port in order of sending: preferred for this port, then fallbacks not sent yet"""
+        key = proto, port
+        if key not in self._cache:
+            preferred = self._preferred.get(key, [])
+            names = {p.name for p in preferred}
+            self._cache[key] = preferred + [p for p in self._fallback.get(proto, []) if p.name not in names]
+        return self._cache[key]
+
+    def match(self, data: bytes) -> str:
+        found = self._anchored.match(data) or self._floating.search(data)
+        if found is None:
+            return ''
+        return self.matches[int(found.lastgroup[1:])].service
+
+
+DATABASE = ServiceDatabase(DEFAULT_PROBES, DEFAULT_MATCHES)
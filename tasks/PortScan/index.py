@@ -1,7 +1,17 @@
 import argparse
+import os
 import sys
 
 import portscan
+import async_scanner
+import syn_scan
+import udp_scan
+import targets
+import fingerprint
+import checkpoint
+import output
+import stats
+import sharded
 
 
 def parse(args):
@@ -15,23 +25,170 @@ def parse(args):
     parser.add_argument('-p', '--ports', action='store', nargs=2, type=int, default=[1, 65535], help='Ports range to '
                                                                                                      'scan. By default '
                                                                                                      'scan all ports.')
-    parser.add_argument('host', action='store', help='Host for scanning')
+    parser.add_argument('-e', '--engine', action='store', choices=['threads', 'async', 'syn', 'udp'],
+                        default='threads',
+                        help='Scan engine. "threads" uses blocking sockets in worker threads, "async" keeps '
+                             'thousands of non-blocking probes in flight from one thread, "syn" sends raw '
+                             'SYN packets without completing handshake (TCP only, requires root), "udp" sends '
+                             'datagrams at fixed rate and reads ICMP port unreachable (UDP only, ICMP requires '
+                             'root).')
+    parser.add_argument('-w', '--workers', action='store', type=int, default=20, help='Worker threads for '
+                                                                                       'threads engine')
+    parser.add_argument('-c', '--concurrency', action='store', type=int, default=2000,
+                        help='Probes in flight for async engine. Limited by max open files.')
+    parser.add_argument('-P', '--processes', action='store', type=int, nargs='?', const=os.cpu_count(),
+                        default=None, help='Split ports between N processes (CPU count if N is omitted), each runs '
+                                           'threads or async engine with its own -w or -c. Results are merged '
+                                           'into one stream ordered by port.')
+    parser.add_argument('--rate', action='store', type=float, default=None,
+                        help='Packets per second for syn (default 5000) and udp (default 1000) engines')
+    parser.add_argument('--timeout', action='store', type=float, default=0.5,
+                        help='Initial probe timeout in seconds. Later it is adapted to measured RTT of the host.')
+    parser.add_argument('--min-rtt-timeout', action='store', type=float, default=0.1,
+                        help='Lower bound of adaptive probe timeout in seconds')
+    parser.add_argument('--max-rtt-timeout', action='store', type=float, default=5,
+                        help='Upper bound of adaptive probe timeout in seconds')
+    parser.add_argument('--retries', action='store', type=int, default=1,
+                        help='Retransmissions for filtered TCP and silent UDP ports')
+    parser.add_argument('--max-probes', action='store', type=int, default=3,
+                        help='How many service probes may be sent to an open TCP port')
+    parser.add_argument('--probes', action='store', default=None,
+                        help='Json file with additional service probes and signatures')
+    parser.add_argument('-o', '--output', action='store', default=None, help='Write results to file instead '
+                                                                               'of stdout')
+    parser.add_argument('-f', '--format', action='store', choices=list(output.WRITERS), default='text',
+                        help='Output format. jsonl and csv have time, state, latency and banner of every port.')
+    parser.add_argument('--checkpoint', action='store', default=None,
+                        help='Save progress to this file periodically, so the scan can be continued with --resume. '
+                             'Only for threads and async engines.')
+    parser.add_argument('--checkpoint-interval', action='store', type=float, default=10,
+                        help='Seconds between checkpoints')
+    parser.add_argument('--resume', action='store', default=None,
+                        help='Continue the scan saved by --checkpoint to this file. Other arguments are taken '
+                             'from the file, output file is appended.')
+    parser.add_argument('--stats-interval', action='store', type=float, default=10,
+                        help='Print scan rate, port states, timeouts and latency percentiles to stderr every '
+                             'N seconds and at the end. 0 prints only the total.')
+    parser.add_argument('--host-limit', action='store', type=int, default=None,
+                        help='Max probes in flight to one host. By default only the global limit '
+                             '(workers or concurrency) is applied.')
+    parser.add_argument('-iL', '--hosts-file', action='store', default=None, help='File with hosts, one per line')
+    parser.add_argument('hosts', action='store', nargs='*', help='Hosts for scanning: names, ips, CIDR blocks '
+                                                                '(10.0.0.0/24), ranges (10.0.0.1-20) or comma '
+                                                                'separated lists of them')
 
     args = parser.parse_args(args)
+    if args.resume:
+        return args
+    if args.engine == 'syn' and args.udp:
+        parser.error('syn engine scans only tcp ports')
+    if args.checkpoint and args.engine not in ('threads', 'async'):
+        parser.error('checkpoints work only with threads and async engines')
+    if args.processes and args.engine not in ('threads', 'async'):
+        parser.error('processes work only with threads and async engines')
+    if args.processes and args.checkpoint:
+        parser.error('checkpoints do not work with processes')
+    if args.engine == 'udp':
+        if args.tcp:
+            parser.error('udp engine scans only udp ports')
+        args.udp = True
     if not args.tcp and not args.udp:
         args.tcp = True
+    if args.hosts_file:
+        args.hosts.extend(targets.read_hosts_file(args.hosts_file))
+    if not args.hosts:
+        parser.error('at least one host is required')
 
     return args
 
 
 def main(args):
-    args = parse(args[1:])
+    argv = args[1:]
+    args = parse(argv)
 
-    scanner = portscan.Scanner(args.host, args.ports[0], args.ports[1], args.tcp, args.udp, workers=20)
+    cursors = None
+    if args.resume:
+        try:
+            state = checkpoint.load(args.resume)
+        except (OSError, ValueError) as e:
+            print(f'Can not read checkpoint: {e}', file=sys.stderr)
+            exit(2)
+        if state['done']:
+            print('Scan from this checkpoint is already finished', file=sys.stderr)
+            return
+        argv = state['argv']
+        args = parse(argv)
+        args.checkpoint = args.checkpoint or args.resume
+        args.resume = True
+        hosts, cursors = state['hosts'], state['cursors']
+    else:
+        try:
+            hosts = targets.parse_hosts(args.hosts)
+        except (ValueError, OSError) as e:
+            print(f'Incorrect host: {e}', file=sys.stderr)
+            exit(2)
+
+    if args.probes:
+        try:
+            fingerprint.DATABASE.extend(args.probes)
+        except (OSError, ValueError, KeyError) as e:
+            print(f'Can not load probes: {e}', file=sys.stderr)
+            exit(2)
+
+    stream = open(args.output, 'a' if args.resume else 'w') if args.output else sys.stdout
+    writer = output.WRITERS[args.format](stream, show_host=len(hosts) > 1)
+    counters = stats.Stats()
+    if args.engine == 'udp':
+        scanner = udp_scan.UdpScanner(hosts, args.ports[0], args.ports[1], rate=args.rate or 1000,
+                                      timeout=args.timeout, retries=args.retries, writer=writer,
+                                      stats=counters)
+    elif args.engine == 'syn':
+        try:
+            scanner = syn_scan.SynScanner(hosts, args.ports[0], args.ports[1], rate=args.rate or 5000,
+                                          timeout=args.timeout, retries=args.retries, writer=writer,
+                                          stats=counters)
+        except PermissionError:
+            writer.close()
+            print('SYN scan requires root user', file=sys.stderr)
+            exit(2)
+    elif args.processes:
+        options = {'workers': args.workers} if args.engine == 'threads' else {'concurrency': args.concurrency}
+        scanner = sharded.ShardedScanner(hosts, args.ports[0], args.ports[1], args.tcp, args.udp,
+                                         processes=args.processes, engine=args.engine, writer=writer,
+                                         stats=counters, probes=args.probes, timeout=args.timeout,
+                                         host_limit=args.host_limit, min_timeout=args.min_rtt_timeout,
+                                         max_timeout=args.max_rtt_timeout, retries=args.retries,
+                                         max_probes=args.max_probes, **options)
+    elif args.engine == 'async':
+        scanner = async_scanner.AsyncScanner(hosts, args.ports[0], args.ports[1], args.tcp, args.udp,
+                                             timeout=args.timeout, concurrency=args.concurrency, writer=writer,
+                                             host_limit=args.host_limit, min_timeout=args.min_rtt_timeout,
+                                             max_timeout=args.max_rtt_timeout, retries=args.retries,
+                                             max_probes=args.max_probes, cursors=cursors, stats=counters)
+    else:
+        scanner = portscan.Scanner(hosts, args.ports[0], args.ports[1], args.tcp, args.udp,
+                                   timeout=args.timeout, workers=args.workers, writer=writer,
+                                   host_limit=args.host_limit, min_timeout=args.min_rtt_timeout,
+                                   max_timeout=args.max_rtt_timeout, retries=args.retries,
+                                   max_probes=args.max_probes, cursors=cursors, stats=counters)
+
+    saver = None
+    if args.checkpoint:
+        saver = checkpoint.Checkpoint(args.checkpoint, argv, hosts, scanner.scheduler, writer,
+                                      args.checkpoint_interval)
+        saver.start()
+    reporter = stats.Reporter(counters, args.stats_interval)
+    reporter.start()
     try:
         scanner.start()
     except KeyboardInterrupt:
         scanner.stop()
+    finally:
+        reporter.stop()
+        if saver:
+            saver.stop()
+        if stream is not sys.stdout:
+            stream.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,115 @@
+import sys
+import csv
+import io
+import json
+import time
+import queue
+import datetime
+import threading
+
+
+def _timestamp(time_: float) -> str:
+    return datetime.datetime.fromtimestamp(time_, datetime.timezone.utc).isoformat(timespec='milliseconds')
+
+
+class ResultWriter:
+    """Writes scan results from its own thread. Workers only put results into the queue,
+    the thread sleeps until something arrives and then writes everything queued in one call."""
+
+    def __init__(self, stream=None, batch_size: int = 1024, show_host: bool = False):
+        self.stream = stream if stream is not None else sys.stdout
+        self.show_host = show_host
+        self.batch_size = batch_size
+
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._write)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def put(self, result):
+        self._queue.put((time.time(), result))
+
+    def flush(self):
+        """Waits until everything put before is written"""
+        if self._thread.is_alive():
+            written = threading.Event()
+            self._queue.put((None, written))
+            written.wait()
+
+    def close(self):
+        if self._thread.is_alive():
+            self._queue.put((None, None))
+            self._thread.join()
+
+    def header(self) -> str:
+        return ''
+
+    def format(self, time_: float, result) -> str:
+        if self.show_host:
+            return f'{result.host} {result}\n'
+        return f'{result}\n'
+
+    def _write_batch(self, batch):
+        self.stream.write(''.join(self.format(t, r) for t, r in batch))
+        self.stream.flush()
+
+    def _write(self):
+        header = self.header()
+        # При --resume файл дописывается, заголовок уже есть
+        if header and not (self.stream.seekable() and self.stream.tell() > 0):
+            self.stream.write(header)
+
+        while True:
+            batch = [self._queue.get()]
+            try:
+                while len(batch) < self.batch_size:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+
+            self._write_batch([(t, r) for t, r in batch if t is not None])
+            for t, r in batch:
+                if t is None and r is not None:
+                    r.set()
+            if (None, None) in batch:
+                return
+
+
+class JsonlWriter(ResultWriter):
+    """One json object per line. Banner bytes are written as latin-1 string, so they can be restored exactly"""
+
+    def format(self, time_: float, result) -> str:
+        if hasattr(result, 'as_dict'):
+            record = {'type': 'rtt', 'time': _timestamp(time_), **result.as_dict()}
+        else:
+            record = {'type': 'port', 'time': _timestamp(time_), 'host': result.host, 'proto': result.proto,
+                      'port': result.port, 'state': result.state, 'service': result.service,
+                      'latency_ms': None if result.latency is None else round(result.latency * 1000, 3),
+                      'banner': result.banner.decode('latin-1')}
+        return json.dumps(record, ensure_ascii=False) + '\n'
+
+
+class CsvWriter(ResultWriter):
+    """Only port results, RTT statistics does not fit in the columns.
+    Banner is written with backslash escapes, so binary answers do not break the file"""
+
+    COLUMNS = ['time', 'host', 'proto', 'port', 'state', 'service', 'latency_ms', 'banner']
+
+    def header(self) -> str:
+        return ','.join(self.COLUMNS) + '\r\n'
+
+    def format(self, time_: float, result) -> str:
+        if hasattr(result, 'as_dict'):
+            return ''
+        line = io.StringIO()
+        csv.writer(line).writerow([_timestamp(time_), result.host, result.proto, result.port, result.state,
+                                   result.service, '' if result.latency is None else round(result.latency * 1000, 3),
+                                   result.banner.decode('latin-1').encode('unicode_escape').decode('ascii')])
+        return line.getvalue()
+
+
+WRITERS = {
+    'text': ResultWriter,
+    'jsonl': JsonlWriter,
+    'csv': CsvWriter,
+}
@@ -1,58 +1,70 @@
 import socket
 import threading
-import queue
-import random
+import typing
+import time
 
-random_time = random.randint(2 ** 16, 2 ** 64 - 1).to_bytes(8, 'big')
-udp_to_send = b'\x13' + b'\0' * 39 + random_time
+import fingerprint
 
+from output import ResultWriter
+from targets import Scheduler
+from rtt import RttEstimator
+from stats import Stats
 
-def define_proto(data):
-    if len(data) > 4 and data[:4] == b'HTTP':
-        return ' HTTP'
 
-    if b'SMTP' in data:
-        return ' SMTP'
+class PortRange:
+    """Ports from start_port to end_port inclusive, every port is taken as ('t', port) and/or ('u', port).
+    Items are computed by index, so nothing is stored in memory.
+    With step only every step-th port from start_port is taken: shard of the range for one process."""
 
-    if b'POP3' in data:
-        return ' POP3'
+    def __init__(self, start_port: int, end_port: int, tcp: bool, udp: bool, step: int = 1):
+        self.start_port = start_port
+        self.end_port = end_port
+        self.step = step
+        self.types = ('t',) * tcp + ('u',) * udp
 
-    if b'IMAP' in data:
-        return ' IMAP'
+    def __len__(self):
+        if self.end_port < self.start_port:
+            return 0
+        return ((self.end_port - self.start_port) // self.step + 1) * len(self.types)
 
-    if len(data) > 11 and data[:2] == udp_to_send[:2] and (data[3] & 1) == 1:
-        return ' DNS'
+    def __getitem__(self, index):
+        if index < 0 or index >= len(self):
+            raise IndexError(index)
+        port, type_index = divmod(index, len(self.types))
+        return self.types[type_index], self.start_port + port * self.step
 
-    if len(data) > 39:
-        mode = 7 & data[0]
-        version = (data[0] >> 3) & 7
 
-        if mode == 4 and version == 2 and random_time == data[24:32]:
-            return ' NTP'
+class Result(typing.NamedTuple):
+    host: str
+    proto: str
+    port: int
+    service: str = ''
+    state: str = 'open'
+    # Время подключения или ответа на пробу в секундах, если измерялось
+    latency: float = None
+    banner: bytes = b''
 
-    return ''
-
-
-def make_queue(start_port, end_port, tcp, udp):
-    """Максимальное число записей равно 130`000, поэтому решил не заморачиваться"""
-    q = queue.Queue()
-    for i in range(start_port, end_port + 1):
-        if tcp:
-            q.put(('t', i))
-        if udp:
-            q.put(('u', i))
-
-    return q
+    def __str__(self):
+        return f'{self.proto} {self.port}{" " + self.service if self.service else ""}'
 
 
 class Scanner:
-    def __init__(self, host: str, start_port: int = 1, end_port: int = 65535, tcp: bool = True,
-                 udp: bool = True, timeout: int = 0.5, workers: int = 20):
-        self.host = host
-        self.ports = make_queue(start_port, end_port, tcp, udp)
-        socket.setdefaulttimeout(timeout)
-
-        self.to_print = queue.Queue()
+    def __init__(self, hosts, start_port: int = 1, end_port: int = 65535, tcp: bool = True,
+                 udp: bool = True, timeout: int = 0.5, workers: int = 20, writer: ResultWriter = None,
+                 host_limit: int = None, min_timeout: float = 0.1, max_timeout: float = 5, retries: int = 1,
+                 max_probes: int = 3, cursors=None, stats: Stats = None, port_step: int = 1):
+        self.hosts = [hosts] if isinstance(hosts, str) else list(hosts)
+        self.ports = PortRange(start_port, end_port, tcp, udp, port_step)
+        self.scheduler = Scheduler(self.hosts, self.ports, host_limit, cursors)
+        # timeout - начальный дедлайн пробы, дальше он подстраивается под RTT хоста.
+        # Ответ сервера после подключения всегда ждем timeout: он зависит от сервера, а не от сети
+        self.timeout = timeout
+        self.retries = retries
+        self.max_probes = max_probes
+        self.rtt = [RttEstimator(host, timeout, min_timeout, max_timeout) for host in self.hosts]
+
+        self.writer = writer if writer is not None else ResultWriter()
+        self.stats = stats if stats is not None else Stats()
         self.isWorking = True
 
         self.threads = [threading.Thread(target=self._do_work) for _ in range(workers)]
@@ -61,63 +73,137 @@ class Scanner:
         for t in self.threads:
             t.setDaemon(True)
             t.start()
-        while not self.ports.empty() and self.isWorking:
-            try:
-                print(self.to_print.get(block=False))
-            except queue.Empty:
-                pass
 
         for t in self.threads:
             t.join()
-
-        while not self.to_print.empty():
-            print(self.to_print.get())
+        self._finish()
 
     def stop(self):
         self.isWorking = False
+        self.scheduler.close()
         for t in self.threads:
             t.join()
+        self._finish()
+
+    def _finish(self):
+        for rtt in self.rtt:
+            self.writer.put(rtt)
+        self.writer.close()
 
     def _do_work(self):
         while self.isWorking:
-            try:
-                _type, port = self.ports.get(block=False)
-            except queue.Empty:
+            item = self.scheduler.take()
+            if item is None:
                 break
-            else:
+            host_index, index = item
+            _type, port = self.ports[index]
+            self.stats.probe_started()
+            state = 'filtered'
+            try:
                 if _type == 't':
-                    self._check_tcp(port)
+                    state = self._check_tcp(host_index, port)
                 if _type == 'u':
-                    self._check_udp(port)
-
-    def _check_tcp(self, port):
-        sock = socket.socket()
+                    state = self._check_udp(host_index, port)
+            finally:
+                self.stats.probe_done(state)
+                self.scheduler.release(host_index, index)
+
+    def _answered(self, host_index, started):
+        latency = time.perf_counter() - started
+        self.rtt[host_index].add(latency)
+        self.stats.latency(latency)
+        return latency
+
+    def _check_tcp(self, host_index, port):
+        """Returns state of the port: open, closed or filtered"""
+        host, rtt = self.hosts[host_index], self.rtt[host_index]
+        for attempt in range(self.retries + 1):
+            sock = socket.socket()
+            sock.settimeout(rtt.timeout(attempt))
+            self.stats.packet_sent()
+            started = time.perf_counter()
+            try:
+                sock.connect((host, port))
+            except socket.timeout:
+                # Порт фильтруется или SYN потерялся: повторяем с удвоенным дедлайном
+                self.stats.timeout()
+                sock.close()
+                continue
+            except ConnectionRefusedError:
+                self._answered(host_index, started)
+                sock.close()
+                return 'closed'
+            except socket.error:
+                sock.close()
+                return 'filtered'
+
+            latency = self._answered(host_index, started)
+            service, banner = self._identify(sock, host, port)
+            self.writer.put(Result(host, 'TCP', port, service, latency=latency, banner=banner))
+            return 'open'
+        return 'filtered'
+
+    def _identify(self, sock, host, port):
+        """Sends probes for the port until the answer is recognized. Server-first protocols are recognized
+        by NULL probe without sending anything. After any exchange the next probe goes through a new
+        connection. Closes sock. Returns service name and the first answer of the server."""
+        service, banner = '', b''
+        fresh = True
         try:
-            sock.connect((self.host, port))
+            for probe in fingerprint.DATABASE.probes_for('tcp', port)[:self.max_probes]:
+                if not fresh:
+                    sock.close()
+                    sock = socket.create_connection((host, port), self.timeout)
+                    fresh = True
+                try:
+                    sock.settimeout(self.timeout)
+                    if probe.payload:
+                        fresh = False
+                        sock.sendall(probe.payload)
+                    data = sock.recv(1024)
+                except socket.timeout:
+                    continue
+                except socket.error:
+                    fresh = False
+                    continue
+
+                fresh = False
+                banner = banner or data
+                service = fingerprint.DATABASE.match(data)
+                if service:
+                    banner = data
+                    break
         except socket.error:
             pass
-        except ConnectionResetError:
-            pass
-        else:
-            sock.send(b'a'*250 + b'\r\n\r\n')
-            try:
-                data = sock.recv(1024)
-                self.to_print.put(f'TCP {port}{define_proto(data)}')
-            except socket.timeout:
-                self.to_print.put(f'TCP {port}')
         finally:
             sock.close()
+        return service, banner
 
-    def _check_udp(self, port):
+    def _check_udp(self, host_index, port):
+        """Returns state of the port: open, closed or open|filtered"""
+        host, rtt = self.hosts[host_index], self.rtt[host_index]
+        payload = fingerprint.DATABASE.probes_for('udp', port)[0].payload
         sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         try:
-            sender.sendto(udp_to_send, (self.host, port))
-            data, host = sender.recvfrom(1024)
-        except ConnectionResetError:
-            pass
-        except socket.timeout:
-            self.to_print.put(f'UDP {port}')
-        else:
-            self.to_print.put(f'UDP {port}{define_proto(data)}')
+            for attempt in range(self.retries + 1):
+                sender.settimeout(rtt.timeout(attempt))
+                self.stats.packet_sent()
+                started = time.perf_counter()
+                try:
+                    sender.sendto(payload, (host, port))
+                    data, host_ = sender.recvfrom(1024)
+                except (ConnectionResetError, ConnectionRefusedError):
+                    self._answered(host_index, started)
+                    return 'closed'
+                except socket.timeout:
+                    self.stats.timeout()
+                    continue
+                else:
+                    latency = self._answered(host_index, started)
+                    self.writer.put(Result(host, 'UDP', port, fingerprint.DATABASE.match(data), latency=latency,
+                                           banner=data))
+                    return 'open'
+            self.writer.put(Result(host, 'UDP', port, state='open|filtered'))
+            return 'open|filtered'
         finally:
             sender.close()
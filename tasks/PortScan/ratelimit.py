@@ -0,0 +1,25 @@
+import time
+import threading
+
+
+class TokenBucket:
+    """Allows rate events per second on average and at most burst events at once.
+    consume() sleeps until a token is available."""
+
+    def __init__(self, rate: float, burst: int = None):
+        self.rate = rate
+        self.burst = burst if burst else max(1, int(rate / 100))
+        self._tokens = self.burst
+        self._last = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def consume(self, tokens: int = 1):
+        with self._lock:
+            while True:
+                now = time.perf_counter()
+                self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                time.sleep((tokens - self._tokens) / self.rate)
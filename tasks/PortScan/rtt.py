@@ -0,0 +1,61 @@
+import threading
+
+
+class RttEstimator:
+    """Round trip time of one host, estimated like TCP retransmission timeout (RFC 6298).
+    Every answered probe (connect, RST, ICMP or UDP reply) is a sample; the probe deadline is
+    SRTT + 4 * RTTVAR clamped to [min_timeout, max_timeout] and doubled for every retransmission."""
+
+    ALPHA = 1 / 8
+    BETA = 1 / 4
+    K = 4
+
+    def __init__(self, host: str, initial: float = 1, min_timeout: float = 0.1, max_timeout: float = 5):
+        self.host = host
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.srtt = None
+        self.rttvar = None
+        self.samples = 0
+        self.rto = self._clamp(initial)
+
+        self._lock = threading.Lock()
+
+    def _clamp(self, value):
+        return min(self.max_timeout, max(self.min_timeout, value))
+
+    def add(self, rtt: float):
+        with self._lock:
+            if self.srtt is None:
+                self.srtt = rtt
+                self.rttvar = rtt / 2
+            else:
+                self.rttvar = (1 - self.BETA) * self.rttvar + self.BETA * abs(self.srtt - rtt)
+                self.srtt = (1 - self.ALPHA) * self.srtt + self.ALPHA * rtt
+            self.samples += 1
+            self.rto = self._clamp(self.srtt + self.K * self.rttvar)
+
+    def timeout(self, attempt: int = 0) -> float:
+        return min(self.max_timeout, self.rto * 2 ** attempt)
+
+    def __getstate__(self):
+        # Оценка передается из процесса-шарда в родительский без блокировки
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def as_dict(self):
+        def ms(value):
+            return None if value is None else round(value * 1000, 3)
+        return {'host': self.host, 'srtt_ms': ms(self.srtt), 'rttvar_ms': ms(self.rttvar),
+                'timeout_ms': ms(self.rto), 'samples': self.samples}
+
+    def __str__(self):
+        if self.srtt is None:
+            return f'RTT no samples timeout={self.rto * 1000:.1f}ms'
+        return (f'RTT srtt={self.srtt * 1000:.2f}ms rttvar={self.rttvar * 1000:.2f}ms '
+                f'timeout={self.rto * 1000:.1f}ms samples={self.samples}')
@@ -0,0 +1,171 @@
+import os
+import sys
+import heapq
+import signal
+import queue
+import threading
+import multiprocessing
+
+import portscan
+import async_scanner
+import fingerprint
+from output import ResultWriter
+from stats import Stats
+
+ENGINES = {
+    'threads': portscan.Scanner,
+    'async': async_scanner.AsyncScanner,
+}
+
+
+class ShardWriter(ResultWriter):
+    """Writer of a shard process: batches of results go to the queue of the parent process"""
+
+    def __init__(self, results, shard: int, batch_size: int = 1024):
+        self.results = results
+        self.shard = shard
+        super().__init__(batch_size=batch_size)
+
+    def header(self) -> str:
+        return ''
+
+    def _write_batch(self, batch):
+        if batch:
+            self.results.put(('results', self.shard, [r for t, r in batch], None))
+
+
+def _run_shard(shard, shards, hosts, start_port, end_port, tcp, udp, engine, options, probes, results,
+               stopping, interval):
+    """Body of a shard process: scans every shards-th port from start_port + shard"""
+    # Ctrl-C получает вся группа процессов, останавливает шарды родитель через stopping
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if probes:
+        # Процесс запущен через spawn, база сигнатур собрана заново
+        fingerprint.DATABASE.extend(probes)
+
+    writer = ShardWriter(results, shard)
+    stats = Stats()
+    scanner = ENGINES[engine](hosts, start_port + shard, end_port, tcp, udp, writer=writer, stats=stats,
+                              port_step=shards, **options)
+
+    def done_below():
+        """All ports of the shard below the returned one are scanned and their results are sent"""
+        first = min(scanner.scheduler.checkpoint(), default=len(scanner.ports))
+        writer.flush()
+        return scanner.ports[first][1] if first < len(scanner.ports) else None
+
+    finished = threading.Event()
+
+    def report():
+        while not finished.wait(interval):
+            if stopping.is_set() or not multiprocessing.parent_process().is_alive():
+                # Новые пробы не выдаются, начатые доделываются. Без родителя шард тоже не нужен
+                scanner.isWorking = False
+                scanner.scheduler.close()
+            results.put(('progress', shard, done_below(), stats.snapshot()))
+
+    reporter = threading.Thread(target=report)
+    reporter.daemon = True
+    reporter.start()
+    scanner.start()
+    finished.set()
+    reporter.join()
+    results.put(('done', shard, None, stats.snapshot()))
+
+
+class ShardedScanner:
+    """Splits the port range between processes: shard i of n scans ports start_port + i, start_port + i + n, ...
+    of every host with its own threads or async engine, so result formatting and signature matching are not
+    limited by one interpreter. Shards send results, progress and stats through one queue. Results are merged
+    into a single stream ordered by port: a result is written when every shard has passed its port."""
+
+    def __init__(self, hosts, start_port: int = 1, end_port: int = 65535, tcp: bool = True, udp: bool = True,
+                 processes: int = None, engine: str = 'threads', writer: ResultWriter = None, stats: Stats = None,
+                 probes: str = None, interval: float = 0.5, **options):
+        self.hosts = [hosts] if isinstance(hosts, str) else list(hosts)
+        self.processes = max(1, min(processes or os.cpu_count() or 1, end_port - start_port + 1))
+        self.writer = writer if writer is not None else ResultWriter()
+        self.stats = stats if stats is not None else Stats()
+        self.isWorking = True
+
+        context = multiprocessing.get_context('spawn')
+        self._results = context.Queue()
+        self._stopping = context.Event()
+        self._workers = [context.Process(target=_run_shard,
+                                         args=(shard, self.processes, self.hosts, start_port, end_port, tcp, udp,
+                                               engine, options, probes, self._results, self._stopping, interval))
+                         for shard in range(self.processes)]
+        for worker in self._workers:
+            worker.daemon = True
+
+        self._host_indices = {host: i for i, host in enumerate(self.hosts)}
+        # Для каждого шарда: порт, ниже которого все результаты получены (None - шард закончил)
+        self._done_below = [start_port] * self.processes
+        self._finished = [False] * self.processes
+        self._snapshots = [None] * self.processes
+        self._pending = []
+        self._rtt = {}
+        self._sequence = 0
+
+    def start(self):
+        for worker in self._workers:
+            worker.start()
+        self._merge()
+        self._finish()
+
+    def stop(self):
+        """Lets shards finish probes in flight and writes everything they have found"""
+        self.isWorking = False
+        self._stopping.set()
+        self._merge()
+        self._finish()
+
+    def _finish(self):
+        self._stopping.set()
+        self._release(None)
+        for host in self.hosts:
+            if host in self._rtt:
+                self.writer.put(self._rtt.pop(host))
+        self.writer.close()
+        for worker in self._workers:
+            worker.join(1)
+
+    def _merge(self):
+        while not all(self._finished):
+            try:
+                kind, shard, payload, snapshot = self._results.get(timeout=0.5)
+            except queue.Empty:
+                for shard, worker in enumerate(self._workers):
+                    if not self._finished[shard] and worker.exitcode is not None:
+                        print(f'Shard {shard} exited with code {worker.exitcode}', file=sys.stderr)
+                        self._finished[shard] = True
+                        self._done_below[shard] = None
+                continue
+
+            if kind == 'results':
+                for result in payload:
+                    self._add(result)
+                continue
+
+            self.stats.merge(snapshot, self._snapshots[shard])
+            self._snapshots[shard] = snapshot
+            self._done_below[shard] = payload
+            if kind == 'done':
+                self._finished[shard] = True
+            self._release(min((port for port in self._done_below if port is not None), default=None))
+
+    def _add(self, result):
+        if hasattr(result, 'as_dict'):
+            # Каждый шард оценивает RTT хоста сам, печатаем оценку по большему числу замеров
+            known = self._rtt.get(result.host)
+            if known is None or result.samples > known.samples:
+                self._rtt[result.host] = result
+            return
+        self._sequence += 1
+        heapq.heappush(self._pending, (result.port, result.proto, self._host_indices.get(result.host, 0),
+                                       self._sequence, result))
+
+    def _release(self, below):
+        """Writes results for ports below the given one, all of them if it is None"""
+        while self._pending and (below is None or self._pending[0][0] < below):
+            self.writer.put(heapq.heappop(self._pending)[-1])
@@ -0,0 +1,128 @@
+import sys
+import math
+import time
+import threading
+
+MIN_LATENCY = 1e-5
+BUCKET_RATIO = 1.1
+BUCKETS = 250
+
+
+class Stats:
+    """Scan counters, updated by engines from any thread.
+    Latencies go to a log-scale histogram (10% wide buckets), so percentiles cost no memory per probe."""
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.sent = 0
+        self.completed = 0
+        self.timeouts = 0
+        self.states = {'open': 0, 'closed': 0, 'filtered': 0, 'open|filtered': 0}
+        self.in_flight = 0
+
+        self._histogram = [0] * BUCKETS
+        self._samples = 0
+        self._lock = threading.Lock()
+
+    def probe_started(self):
+        with self._lock:
+            self.in_flight += 1
+
+    def packet_sent(self, count: int = 1):
+        with self._lock:
+            self.sent += count
+
+    def timeout(self):
+        with self._lock:
+            self.timeouts += 1
+
+    def latency(self, latency: float):
+        bucket = 0 if latency <= MIN_LATENCY else int(math.log(latency / MIN_LATENCY, BUCKET_RATIO))
+        with self._lock:
+            self._histogram[min(bucket, BUCKETS - 1)] += 1
+            self._samples += 1
+
+    def probe_done(self, state: str, started: bool = True, count: int = 1):
+        """started=False for engines without probe_started (syn, udp): they have no in-flight probes"""
+        with self._lock:
+            self.completed += count
+            self.states[state] += count
+            if started:
+                self.in_flight -= count
+
+    def percentile(self, percent: float):
+        with self._lock:
+            if not self._samples:
+                return None
+            rank = self._samples * percent / 100
+            total = 0
+            for bucket, count in enumerate(self._histogram):
+                total += count
+                if total >= rank:
+                    return MIN_LATENCY * BUCKET_RATIO ** (bucket + 1)
+
+    def snapshot(self) -> dict:
+        """Counters as plain dict, so they can be sent to another process"""
+        with self._lock:
+            return {'sent': self.sent, 'completed': self.completed, 'timeouts': self.timeouts,
+                    'in_flight': self.in_flight, 'states': dict(self.states),
+                    'histogram': list(self._histogram), 'samples': self._samples}
+
+    def merge(self, snapshot: dict, previous: dict = None):
+        """Adds counters of a snapshot. Previous snapshot of the same source is subtracted,
+        so growing snapshots of one source may be merged again and again"""
+        def delta(key):
+            return snapshot[key] - (previous[key] if previous else 0)
+
+        with self._lock:
+            self.sent += delta('sent')
+            self.completed += delta('completed')
+            self.timeouts += delta('timeouts')
+            self.in_flight += delta('in_flight')
+            self._samples += delta('samples')
+            for state, count in snapshot['states'].items():
+                self.states[state] += count - (previous['states'][state] if previous else 0)
+            for bucket, count in enumerate(snapshot['histogram']):
+                self._histogram[bucket] += count - (previous['histogram'][bucket] if previous else 0)
+
+    def elapsed(self):
+        return time.perf_counter() - self.started_at
+
+    def __str__(self):
+        elapsed = self.elapsed()
+
+        def ms(value):
+            return '-' if value is None else f'{value * 1000:.2f}ms'
+
+        states = ' '.join(f'{name} {count}' for name, count in self.states.items() if count)
+        return (f'{elapsed:.1f}s | sent {self.sent} ({self.sent / elapsed:.0f}/s) | '
+                f'done {self.completed} ({self.completed / elapsed:.0f}/s) | {states or "no ports"} | '
+                f'timeouts {self.timeouts} | in flight {self.in_flight} | '
+                f'p50 {ms(self.percentile(50))} p99 {ms(self.percentile(99))}')
+
+
+class Reporter:
+    """Prints stats to stderr every interval seconds and once more when stopped"""
+
+    def __init__(self, stats: Stats, interval: float = 10, stream=None):
+        self.stats = stats
+        self.interval = interval
+        self.stream = stream if stream is not None else sys.stderr
+
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+
+    def start(self):
+        if self.interval > 0:
+            self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        print(f'Total: {self.stats}', file=self.stream)
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            print(self.stats, file=self.stream)
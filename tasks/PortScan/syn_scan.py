@@ -0,0 +1,157 @@
+import random
+import socket
+import struct
+import threading
+import time
+
+import portscan
+from output import ResultWriter
+from stats import Stats
+from ratelimit import TokenBucket
+
+SYN = 0x02
+RST = 0x04
+ACK = 0x10
+
+
+def checksum(data: bytes, checksum_offset: int):
+    """Internet checksum, same as in TracertWhois/traceroute.py, written into data at checksum_offset"""
+    if len(data) % 2:
+        data += b'\0'
+    words = [int.from_bytes(data[_:_ + 2], "big") for _ in range(0, len(data), 2)]
+    checksum_ = sum(words)
+    while checksum_ > 0xffff:
+        checksum_ = (checksum_ & 0xffff) + (checksum_ >> 16)
+
+    return data[:checksum_offset] + int.to_bytes(0xffff - checksum_, 2, 'big') + data[checksum_offset + 2:]
+
+
+def source_address(dest_ip: str) -> str:
+    """Ip of the interface, that kernel uses to reach dest_ip. Nothing is sent."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        sock.connect((dest_ip, 9))
+        return sock.getsockname()[0]
+    finally:
+        sock.close()
+
+
+def tcp_syn(src_ip: str, dest_ip: str, src_port: int, dest_port: int, seq: int) -> bytes:
+    header = struct.pack('!HHIIBBHHH', src_port, dest_port, seq, 0, 5 << 4, SYN, 1024, 0, 0)
+    pseudo_header = (socket.inet_aton(src_ip) + socket.inet_aton(dest_ip) +
+                     struct.pack('!BBH', 0, socket.IPPROTO_TCP, len(header)))
+    return checksum(pseudo_header + header, len(pseudo_header) + 16)[len(pseudo_header):]
+
+
+def parse_tcp(data: bytes):
+    """Takes ip packet, returns (source ip, source port, dest port, ack, flags) or None for not TCP"""
+    if len(data) < 20 or data[0] >> 4 != 4 or data[9] != socket.IPPROTO_TCP:
+        return None
+    header_length = (data[0] & 0x0f) * 4
+    if len(data) < header_length + 14:
+        return None
+    src_port, dest_port, _, ack, _, flags = struct.unpack_from('!HHIIBB', data, header_length)
+    return socket.inet_ntoa(data[12:16]), src_port, dest_port, ack, flags
+
+
+class SynScanner:
+    """Half-open TCP scan. One thread sends SYN packets from a raw socket at a fixed packet rate,
+    another one reads every incoming TCP packet: SYN-ACK means open port, RST - closed,
+    no answer after all retries - filtered. Kernel itself resets connections after SYN-ACK.
+    Requires root (CAP_NET_RAW) and works only where raw TCP sockets may send (Linux, BSD)."""
+
+    def __init__(self, hosts, start_port: int = 1, end_port: int = 65535, rate: float = 5000,
+                 timeout: float = 1, retries: int = 1, writer: ResultWriter = None,
+                 stats: Stats = None):
+        self.hosts = [hosts] if isinstance(hosts, str) else list(hosts)
+        self.ports = range(start_port, end_port + 1)
+        self.timeout = timeout
+        self.retries = retries
+        self.writer = writer if writer is not None else ResultWriter()
+        self.stats = stats if stats is not None else Stats()
+        self.bucket = TokenBucket(rate)
+        self.isWorking = True
+
+        self.src_port = random.randint(32768, 60999)
+        self.seq = random.randint(0, 2 ** 32 - 1)
+        self._host_indices = {host: i for i, host in enumerate(self.hosts)}
+        self._sources = [source_address(host) for host in self.hosts]
+        self._answered = set()
+
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_TCP)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+        self._sock.settimeout(0.2)
+        self._receiver = threading.Thread(target=self._receive)
+        self._receiver.daemon = True
+
+    def start(self):
+        self._receiver.start()
+        try:
+            for attempt in range(self.retries + 1):
+                sent = self._send_all()
+                if not sent or not self.isWorking:
+                    break
+                time.sleep(self.timeout * 2 ** attempt)
+            if self.isWorking:
+                self.stats.probe_done('filtered', False, len(self.ports) * len(self.hosts) - len(self._answered))
+        finally:
+            self._finish()
+
+    def stop(self):
+        self.isWorking = False
+        self._finish()
+
+    def _finish(self):
+        self.isWorking = False
+        if self._receiver.is_alive():
+            self._receiver.join()
+        self._sock.close()
+        self.writer.close()
+
+    def _send_all(self):
+        """Sends SYN to every not answered port, hosts are interleaved. Returns number of sent packets"""
+        sent = 0
+        for port in self.ports:
+            for host_index, host in enumerate(self.hosts):
+                if not self.isWorking:
+                    return sent
+                if (host_index, port) in self._answered:
+                    continue
+                self.bucket.consume()
+                packet = tcp_syn(self._sources[host_index], host, self.src_port, port, self.seq)
+                try:
+                    self._sock.sendto(packet, (host, 0))
+                except OSError:
+                    # ENOBUFS при слишком большой скорости: пакет будет отправлен при повторе
+                    continue
+                sent += 1
+                self.stats.packet_sent()
+        return sent
+
+    def _receive(self):
+        expected_ack = (self.seq + 1) & 0xffffffff
+        while self.isWorking:
+            try:
+                data = self._sock.recv(65535)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+
+            packet = parse_tcp(data)
+            if packet is None:
+                continue
+            host, port, dest_port, ack, flags = packet
+            host_index = self._host_indices.get(host)
+            if dest_port != self.src_port or host_index is None or port not in self.ports:
+                continue
+            if (host_index, port) in self._answered:
+                continue
+
+            if flags & SYN and flags & ACK and ack == expected_ack:
+                self._answered.add((host_index, port))
+                self.stats.probe_done('open', False)
+                self.writer.put(portscan.Result(host, 'TCP', port))
+            elif flags & RST:
+                self._answered.add((host_index, port))
+                self.stats.probe_done('closed', False)
@@ -0,0 +1,122 @@
+import socket
+import threading
+import ipaddress
+import collections
+
+
+def _ipv4(text: str):
+    try:
+        return ipaddress.IPv4Address(text)
+    except ValueError:
+        return None
+
+
+def _expand(spec: str):
+    if ':' in spec:
+        # Сканеры работают только с IPv4, gethostbyname дал бы непонятную gaierror
+        raise ValueError(f'IPv6 addresses are not supported: {spec}')
+
+    if '/' in spec:
+        network = ipaddress.ip_network(spec, strict=False)
+        if network.num_addresses == 1:
+            return [str(network.network_address)]
+        return [str(ip) for ip in network.hosts()]
+
+    first, _, last = spec.partition('-')
+    first = _ipv4(first) if last else None
+    # Диапазон, только если до дефиса адрес: my-host.example.com - имя хоста
+    if first is not None:
+        if '.' not in last:
+            # 10.0.0.1-20: меняется только последний октет
+            last = first.exploded.rsplit('.', 1)[0] + '.' + last
+        last = ipaddress.IPv4Address(last)
+        if last < first:
+            raise ValueError(f'Empty range {spec}')
+        return [str(first + i) for i in range(int(last) - int(first) + 1)]
+
+    return [socket.gethostbyname(spec)]
+
+
+def parse_hosts(specs):
+    """Expands host specs into ip list without duplicates. Every spec may be a host name, ip,
+    CIDR block (10.0.0.0/24), range (10.0.0.1-10.0.0.20 or 10.0.0.1-20) or comma separated list of them."""
+    result = {}
+    for spec in specs:
+        for part in filter(None, spec.split(',')):
+            for ip in _expand(part.strip()):
+                result[ip] = None
+    return list(result)
+
+
+def read_hosts_file(path):
+    with open(path) as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith('#')]
+
+
+class Scheduler:
+    """Hands out (host, port item) pairs round-robin over hosts, so every host advances at the same pace.
+    A host with host_limit probes in flight is skipped until one of them is released, so a slow or filtered
+    host can not take all workers. Global in-flight limit is the number of workers of the engine."""
+
+    def __init__(self, hosts, ports, host_limit: int = None, cursors=None):
+        self.hosts = hosts
+        self.ports = ports
+        self.host_limit = host_limit if host_limit else len(ports)
+
+        self._cursors = list(cursors) if cursors else [0] * len(hosts)
+        self._in_flight = [0] * len(hosts)
+        # Индексы выданных, но еще не сделанных проб, нужны для checkpoint
+        self._pending = [set() for _ in hosts]
+        self._active = collections.deque(i for i in range(len(hosts)) if self._cursors[i] < len(ports))
+        self._condition = threading.Condition()
+
+    @property
+    def exhausted(self):
+        return not self._active
+
+    def take(self, block: bool = True):
+        """Returns (host index, index in ports) or None. Without block None also means that all active hosts
+        are saturated now, check exhausted to tell it apart."""
+        with self._condition:
+            while True:
+                item = self._next()
+                if item is not None or not block or not self._active:
+                    return item
+                self._condition.wait()
+
+    def release(self, host_index: int, index: int, done: bool = True):
+        """Frees the slot of the host. Not done probe stays pending, so checkpoint will not pass it"""
+        with self._condition:
+            self._in_flight[host_index] -= 1
+            if done:
+                self._pending[host_index].discard(index)
+            self._condition.notify()
+
+    def checkpoint(self):
+        """For every host index of the first not done probe: all probes before it are done"""
+        with self._condition:
+            return [min(pending) if pending else cursor for pending, cursor in zip(self._pending, self._cursors)]
+
+    def close(self):
+        with self._condition:
+            self._active.clear()
+            self._condition.notify_all()
+
+    def _next(self):
+        for _ in range(len(self._active)):
+            host_index = self._active[0]
+            self._active.rotate(-1)
+            if self._in_flight[host_index] >= self.host_limit:
+                continue
+
+            cursor = self._cursors[host_index]
+            self._cursors[host_index] = cursor + 1
+            self._in_flight[host_index] += 1
+            self._pending[host_index].add(cursor)
+            if cursor + 1 == len(self.ports):
+                # после rotate хост стоит последним
+                self._active.pop()
+                if not self._active:
+                    self._condition.notify_all()
+            return host_index, cursor
+        return None
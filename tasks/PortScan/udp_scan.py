@@ -0,0 +1,188 @@
+import socket
+import threading
+import selectors
+import time
+import sys
+
+import portscan
+import fingerprint
+from output import ResultWriter
+from ratelimit import TokenBucket
+from stats import Stats
+from syn_scan import source_address
+
+ICMP_DEST_UNREACHABLE = 3
+ICMP_PORT_UNREACHABLE = 3
+
+
+def icmp_sniffer(dest_ip: str):
+    """Raw socket that receives all incoming ICMP packets with ip header. Requires root user"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP)
+    if hasattr(socket, 'SIO_RCVALL'):
+        # Windows отдает пакеты только сокету, привязанному к интерфейсу, как в traceroute.icmp_sniffer
+        sock.bind((source_address(dest_ip), 0))
+        sock.ioctl(socket.SIO_RCVALL, socket.RCVALL_ON)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+    return sock
+
+
+def parse_unreachable(data: bytes):
+    """Takes ip packet with ICMP destination unreachable about UDP datagram.
+    Returns (code, dest ip, source port, dest port) of the original datagram or None"""
+    if len(data) < 20 or data[0] >> 4 != 4 or data[9] != socket.IPPROTO_ICMP:
+        return None
+    icmp = (data[0] & 0x0f) * 4
+    if len(data) < icmp + 8 + 20 or data[icmp] != ICMP_DEST_UNREACHABLE:
+        return None
+    inner = icmp + 8
+    if data[inner + 9] != socket.IPPROTO_UDP:
+        return None
+    udp = inner + (data[inner] & 0x0f) * 4
+    if len(data) < udp + 4:
+        return None
+    return (data[icmp + 1], socket.inet_ntoa(data[inner + 16:inner + 20]),
+            int.from_bytes(data[udp:udp + 2], 'big'), int.from_bytes(data[udp + 2:udp + 4], 'big'))
+
+
+class UdpScanner:
+    """UDP scan without a socket and a timeout per port. Datagrams with protocol payload for the port
+    (DNS query, NTP request, SNMP get, ...) are sent from a small pool of sockets at a fixed packet rate.
+    One thread reads answers from the pool (open port) and ICMP port unreachable from a raw socket
+    (closed port), so closed ports are known at once instead of after a timeout. Ports without any
+    answer after all retries are reported as open|filtered, as before.
+    Without root user ICMP is not available and every silent port is open|filtered."""
+
+    def __init__(self, hosts, start_port: int = 1, end_port: int = 65535, rate: float = 1000,
+                 timeout: float = 1, retries: int = 1, sockets: int = 8, writer: ResultWriter = None,
+                 stats: Stats = None):
+        self.hosts = [hosts] if isinstance(hosts, str) else list(hosts)
+        self.ports = range(start_port, end_port + 1)
+        self.timeout = timeout
+        self.retries = retries
+        self.writer = writer if writer is not None else ResultWriter()
+        self.stats = stats if stats is not None else Stats()
+        self.bucket = TokenBucket(rate)
+        self.isWorking = True
+
+        self._host_indices = {host: i for i, host in enumerate(self.hosts)}
+        self._answered = set()
+
+        self._pool = []
+        for _ in range(sockets):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.bind(('', 0))
+            sock.setblocking(False)
+            self._pool.append(sock)
+        self._pool_ports = {sock.getsockname()[1] for sock in self._pool}
+
+        self._selector = selectors.DefaultSelector()
+        for sock in self._pool:
+            self._selector.register(sock, selectors.EVENT_READ, self._read_answer)
+        self._icmp = None
+        try:
+            self._icmp = icmp_sniffer(self.hosts[0] if self.hosts else '127.0.0.1')
+            self._icmp.setblocking(False)
+            self._selector.register(self._icmp, selectors.EVENT_READ, self._read_icmp)
+        except PermissionError:
+            print('ICMP is not available without root user: closed UDP ports are shown as open|filtered',
+                  file=sys.stderr)
+
+        self._receiver = threading.Thread(target=self._receive)
+        self._receiver.daemon = True
+
+    def start(self):
+        self._receiver.start()
+        try:
+            for attempt in range(self.retries + 1):
+                sent = self._send_all()
+                if not sent or not self.isWorking:
+                    break
+                time.sleep(self.timeout * 2 ** attempt)
+            if self.isWorking:
+                self._report_silent()
+        finally:
+            self._finish()
+
+    def stop(self):
+        self.isWorking = False
+        self._finish()
+
+    def _finish(self):
+        self.isWorking = False
+        if self._receiver.is_alive():
+            self._receiver.join()
+        for sock in self._pool:
+            sock.close()
+        if self._icmp:
+            self._icmp.close()
+        self.writer.close()
+
+    def _send_all(self):
+        sent = 0
+        for port in self.ports:
+            payload = fingerprint.DATABASE.probes_for('udp', port)[0].payload
+            for host_index, host in enumerate(self.hosts):
+                if not self.isWorking:
+                    return sent
+                if (host_index, port) in self._answered:
+                    continue
+                self.bucket.consume()
+                try:
+                    self._pool[sent % len(self._pool)].sendto(payload, (host, port))
+                except OSError:
+                    # ENOBUFS или ICMP ошибка от прошлого датаграмма: отправим при повторе
+                    continue
+                sent += 1
+                self.stats.packet_sent()
+        return sent
+
+    def _report_silent(self):
+        for port in self.ports:
+            for host_index, host in enumerate(self.hosts):
+                if (host_index, port) not in self._answered:
+                    self.stats.probe_done('open|filtered', False)
+                    self.writer.put(portscan.Result(host, 'UDP', port, state='open|filtered'))
+
+    def _receive(self):
+        while self.isWorking:
+            for key, _ in self._selector.select(0.2):
+                key.data(key.fileobj)
+
+    def _read_answer(self, sock):
+        while True:
+            try:
+                data, (host, port) = sock.recvfrom(65535)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                # На Windows ICMP ошибка приходит в сокет как ConnectionResetError
+                continue
+            host_index = self._host_indices.get(host)
+            if host_index is None:
+                continue
+            if port in self._pool_ports and data == fingerprint.DATABASE.probes_for('udp', port)[0].payload:
+                # При сканировании своей машины проба пришла в сокет пула: проверяемый порт - наш собственный
+                self._answered.add((host_index, sock.getsockname()[1]))
+                continue
+            if (host_index, port) in self._answered:
+                continue
+            self._answered.add((host_index, port))
+            self.stats.probe_done('open', False)
+            self.writer.put(portscan.Result(host, 'UDP', port, fingerprint.DATABASE.match(data), banner=data))
+
+    def _read_icmp(self, sock):
+        while True:
+            try:
+                data = sock.recv(65535)
+            except (BlockingIOError, InterruptedError):
+                return
+            packet = parse_unreachable(data)
+            if packet is None:
+                continue
+            code, host, src_port, port = packet
+            host_index = self._host_indices.get(host)
+            if host_index is None or src_port not in self._pool_ports or (host_index, port) in self._answered:
+                continue
+            # Port unreachable - порт закрыт, остальные коды - фильтруется. В обоих случаях не печатаем
+            self._answered.add((host_index, port))
+            self.stats.probe_done('closed' if code == ICMP_PORT_UNREACHABLE else 'filtered', False)
@@ -0,0 +1,82 @@
+"""Throughput of m_base64 compared with binascii (C) and with the old implementation that built
+a binary string for every 3 bytes and searched the alphabet for every character.
+
+    python bench_base64.py [SIZE ...]     sizes in bytes with optional K or M suffix, 1K..100M by default
+"""
+import os
+import sys
+import time
+import binascii
+
+import m_base64
+
+SIZES = ['1K', '64K', '1M', '10M', '100M']
+# Старая реализация слишком медленная для больших данных
+LEGACY_LIMIT = 1024 * 1024
+
+
+def legacy_encode(data: bytes):
+    result = bytearray()
+    for i in range(0, len(data), 3):
+        delta = min(3, len(data) - i)
+        number = bin(int.from_bytes(data[i:i + 3], 'big'))[2:].zfill(8 * delta).ljust(6 * (delta + 1), '0')
+        for j in range(0, len(number), 6):
+            result.append(m_base64.BASE64_LINE[int(number[j:j+6], 2)])
+        result.extend(b'=' * (3 - delta))
+    return bytes(result)
+
+
+def legacy_decode(data: bytes):
+    result = bytearray()
+    for i in range(0, len(data), 4):
+        eq_count = (data[i + 3] == m_base64.EQ_ORD) + (data[i + 2] == m_base64.EQ_ORD)
+        temp = ''.join(map(lambda x: bin(m_base64.BASE64_LINE.find(x))[2:].zfill(6), data[i:i + 4].rstrip(b'=')))
+        for j in range(0, 8 * (3 - eq_count), 8):
+            result.append(int(temp[j:j+8], 2))
+    return bytes(result)
+
+
+def parse_size(text: str) -> int:
+    multiplier = {'K': 1024, 'M': 1024 ** 2}.get(text[-1].upper(), 1)
+    return int(text.rstrip('kKmM')) * multiplier
+
+
+def measure(function, data) -> float:
+    """Best of several runs in seconds, the number of runs depends on the size"""
+    runs = max(1, min(100, 10 ** 7 // max(1, len(data))))
+    best = None
+    for _ in range(runs):
+        started = time.perf_counter()
+        function(data)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main(argv):
+    sizes = [parse_size(size) for size in argv[1:] or SIZES]
+    for size in sizes:
+        data = os.urandom(size)
+        encoded = m_base64.encode(data)
+        lines = m_base64.encode_lines(data)
+        assert encoded == binascii.b2a_base64(data, newline=False)
+        assert m_base64.decode(lines) == data
+
+        cases = [
+            ('encode', 'binascii', lambda d: binascii.b2a_base64(d, newline=False), data),
+            ('encode', 'm_base64', m_base64.encode, data),
+            ('encode', 'm_base64 MIME lines', m_base64.encode_lines, data),
+            ('decode', 'binascii', binascii.a2b_base64, lines),
+            ('decode', 'm_base64', m_base64.decode, lines),
+        ]
+        if size <= LEGACY_LIMIT:
+            cases.insert(3, ('encode', 'legacy', legacy_encode, data))
+            cases.append(('decode', 'legacy', legacy_decode, encoded))
+        print(f'{size} bytes:')
+        for kind, name, function, argument in sorted(cases, key=lambda case: case[0], reverse=True):
+            elapsed = measure(function, argument)
+            print(f'    {kind} {name:>20}: {size / elapsed / 1024 ** 2:9.2f} MB/s')
+
+
+if __name__ == "__main__":
+    main(sys.argv)
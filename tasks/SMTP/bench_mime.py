@@ -0,0 +1,120 @@
+"""Peak memory and time of building and sending the message with images from a directory:
+the old data_packer (the whole message in memory, joined from 76 byte pieces), the streaming mime.Message
+and the binary one in BDAT chunks, as it goes to a server with CHUNKING and BINARYMIME.
+The message is written to a local socket whose other end is drained by a thread.
+
+Without -d a temporary directory with SIZE megabytes of random .jpg files is created.
+
+    python bench_mime.py [-d DIRECTORY] [--size MB] [--file-size MB] [--modes legacy streaming binary]
+"""
+import os
+import sys
+import time
+import socket
+import shutil
+import argparse
+import resource
+import tempfile
+import threading
+import multiprocessing
+
+import m_base64
+import mime
+import delivery
+
+FILE_SIZE = 8
+
+
+def legacy_message(directory):
+    """data_packer before streaming: every file is read whole, encoded and cut into lines, then joined"""
+    boundary = str(time.time()).encode('utf8')
+    result = [b'Content-Type: multipart/mixed; boundary="' + boundary + b'"\r\n\r\n']
+    for attachment in mime.find_images(directory):
+        name = attachment.name.encode('utf8')
+        result.extend([b'--', boundary, b'\r\n', b'Content-Disposition: attachment; filename="', name,
+                       b'"\r\nContent-Transfer-Encoding: base64\r\nContent-Type: ', attachment.content_type,
+                       b'; name="', name, b'"\r\n\r\n'])
+        with open(attachment.path, 'rb') as f:
+            data = m_base64.encode(f.read())
+            for i in range(0, len(data), 76):
+                result.extend([data[i: i + 76], b'\n'])
+    result.extend([b'--', boundary, b'--'])
+    return [b''.join(result)]
+
+
+def streaming_message(directory):
+    return mime.Message(mime.find_images(directory))
+
+
+def binary_message(directory):
+    return delivery.bdat_commands(mime.Message(mime.find_images(directory)).as_binary())
+
+
+def drain(sock, received):
+    while True:
+        data = sock.recv(1 << 20)
+        if not data:
+            break
+        received.append(len(data))
+
+
+def run(mode, directory, results):
+    sending, receiving = socket.socketpair()
+    received = []
+    reader = threading.Thread(target=drain, args=(receiving, received))
+    reader.start()
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    build = {'legacy': legacy_message, 'streaming': streaming_message, 'binary': binary_message}[mode]
+    for chunk in mime.coalesce(build(directory)):
+        sending.sendall(chunk)
+    sending.close()
+    reader.join()
+    elapsed = time.perf_counter() - started
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results.put((mode, elapsed, sum(received), baseline, peak))
+
+
+def create_images(directory, size_mb: int, file_size_mb: int):
+    block = os.urandom(1024 * 1024)
+    for number in range((size_mb + file_size_mb - 1) // file_size_mb):
+        with open(os.path.join(directory, f'{number}.jpg'), 'wb') as f:
+            for _ in range(min(file_size_mb, size_mb - number * file_size_mb)):
+                f.write(block)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Memory of building and sending the message with images')
+    parser.add_argument('-d', '--directory', action='store', default=None)
+    parser.add_argument('--size', action='store', type=int, default=1024, help='Megabytes of generated images')
+    parser.add_argument('--file-size', action='store', type=int, default=FILE_SIZE,
+                        help='Megabytes in one generated image')
+    parser.add_argument('--modes', nargs='+', choices=['legacy', 'streaming', 'binary'],
+                        default=['legacy', 'streaming', 'binary'])
+    args = parser.parse_args(argv[1:])
+
+    directory = args.directory or tempfile.mkdtemp()
+    try:
+        if args.directory is None:
+            create_images(directory, args.size, args.file_size)
+        total = sum(attachment.size for attachment in mime.find_images(directory))
+        print(f'{total / 1024 ** 2:.0f} MB of images')
+        results = multiprocessing.Queue()
+        for mode in args.modes:
+            # Каждый режим в своем процессе, иначе пик памяти первого достанется второму
+            process = multiprocessing.Process(target=run, args=(mode, directory, results))
+            process.start()
+            process.join()
+            if process.exitcode:
+                print(f'{mode:>10}: failed with exit code {process.exitcode}')
+                continue
+            mode, elapsed, sent, baseline, peak = results.get()
+            print(f'{mode:>10}: {sent / 1024 ** 2:.0f} MB sent in {elapsed:.2f}s, '
+                  f'peak RSS {peak / 1024:.0f} MB (+{(peak - baseline) / 1024:.0f} MB)')
+    finally:
+        if args.directory is None:
+            shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main(sys.argv)
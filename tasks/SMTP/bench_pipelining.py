@@ -0,0 +1,103 @@
+"""Messages per second over one connection to a local sink.py that answers every command after
+an artificial latency, as a distant server does:
+    legacy     - Server._mail before: pipelined commands, then reading until the socket timeout twice per message
+    sequential - one round trip per command, every answer checked (a server without PIPELINING)
+    pipelined  - MAIL, RCPT and DATA in one write, exactly three answers read back
+    envelope   - as pipelined, with --per-envelope recipients in every transaction
+
+    python bench_pipelining.py [--latency SECONDS] [-n MESSAGES] [--per-envelope N] [--legacy-timeout SECONDS]
+                               [--legacy-messages N] [--modes legacy sequential pipelined envelope]
+"""
+import sys
+import time
+import socket
+import argparse
+import subprocess
+
+import delivery
+import mime
+
+PORT = 2526
+HEADER = mime.header('bench@localhost', 'sink@localhost', 'Pipelining')
+BODY = [b'Content-Type: text/plain; charset=utf-8\r\n\r\nHello from the pipelining benchmark\r\n']
+
+
+def legacy(address, messages: int, timeout: float):
+    """Transactions as Server._mail sent them with PIPELINING before answers were counted"""
+    sock = socket.create_connection(address)
+    sock.settimeout(timeout)
+
+    def drain():
+        while True:
+            try:
+                if not sock.recv(65536):
+                    return
+            except socket.timeout:
+                return
+
+    sock.recv(65536)
+    sock.sendall(b'EHLO localhost\r\n')
+    drain()
+    for _ in range(messages):
+        sock.sendall(b'MAIL FROM: <bench@localhost>\r\nRCPT TO: <sink@localhost>\r\nDATA\r\n')
+        drain()
+        sock.sendall(HEADER + b'\r\n' + b''.join(BODY) + b'\r\n.\r\n')
+        drain()
+    sock.close()
+    return messages, messages
+
+
+def session_mode(address, messages: int, pipelining: bool, recipients: int):
+    session = delivery.Session(address).open()
+    if not pipelining:
+        session.extensions.pop('PIPELINING', None)
+    delivered = 0
+    for number in range(messages):
+        envelope = [f'user{number}.{i}@localhost' for i in range(recipients)]
+        statuses = session.send_mail('bench@localhost', envelope, HEADER, BODY)
+        delivered += sum(200 <= reply.code < 300 for reply in statuses.values())
+    session.close()
+    return messages, delivered
+
+
+def run(mode, args, address):
+    if mode == 'legacy':
+        return legacy(address, args.legacy_messages, args.legacy_timeout)
+    recipients = args.per_envelope if mode == 'envelope' else 1
+    return session_mode(address, args.messages, mode != 'sequential', recipients)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Messages per second with and without pipelining')
+    parser.add_argument('--latency', action='store', type=float, default=0.05,
+                        help='Seconds before every answer of the sink')
+    parser.add_argument('-n', '--messages', action='store', type=int, default=50)
+    parser.add_argument('--per-envelope', action='store', type=int, default=10,
+                        help='Recipients in one transaction of the envelope mode')
+    parser.add_argument('--legacy-timeout', action='store', type=float, default=2,
+                        help='Socket timeout of the legacy mode, 2 seconds in Server')
+    parser.add_argument('--legacy-messages', action='store', type=int, default=3)
+    parser.add_argument('--modes', nargs='+', choices=['legacy', 'sequential', 'pipelined', 'envelope'],
+                        default=['legacy', 'sequential', 'pipelined', 'envelope'])
+    args = parser.parse_args(argv[1:])
+
+    address = ('127.0.0.1', PORT)
+    sink = subprocess.Popen([sys.executable, 'sink.py', '-p', str(PORT), '--latency', str(args.latency)],
+                            stdout=subprocess.PIPE)
+    try:
+        # Ждем, пока sink начнет слушать
+        sink.stdout.readline()
+        print(f'Latency {args.latency * 1000:.0f} ms')
+        for mode in args.modes:
+            started = time.monotonic()
+            messages, recipients = run(mode, args, address)
+            elapsed = time.monotonic() - started
+            print(f'{mode:>10}: {messages} messages to {recipients} recipients in {elapsed:.2f}s, '
+                  f'{messages / elapsed:.1f} messages/s, {recipients / elapsed:.1f} recipients/s')
+    finally:
+        sink.terminate()
+        sink.wait()
+
+
+if __name__ == "__main__":
+    main(sys.argv)
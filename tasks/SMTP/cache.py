@@ -0,0 +1,176 @@
+"""On-disk cache of attachments encoded to base64 MIME lines, keyed by SHA-256 of the file content.
+An index remembers size, mtime and hash of every path, so an unchanged file is found without reading it;
+a changed one is hashed and found by its content if it was encoded before, else it is encoded. Files that
+are not in the cache are encoded in a pool of processes, while the connection is opened (Pending). The least
+recently used entries are removed when the cache grows over its size limit."""
+import os
+import json
+import hashlib
+import contextlib
+import collections.abc
+import concurrent.futures
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: запуски не блокируют друг друга, индекс все равно не бывает записан наполовину
+    fcntl = None
+
+import m_base64
+import mime
+
+SUFFIX = '.b64'
+INDEX = 'index.json'
+LOCK = 'index.lock'
+DEFAULT_SIZE = 1024 * 1024 * 1024
+
+
+def file_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(mime.READ_SIZE)
+            if not block:
+                break
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def encode_file(path: str, target: str):
+    """Writes base64 lines of the file through a temporary file, so a reader never sees half of it"""
+    temporary = f'{target}.{os.getpid()}.tmp'
+    encoder = m_base64.Encoder()
+    with open(path, 'rb') as source, open(temporary, 'wb') as f:
+        while True:
+            block = source.read(mime.READ_SIZE)
+            if not block:
+                break
+            f.write(encoder.update(block))
+        f.write(encoder.finish())
+    os.replace(temporary, target)
+
+
+def _prepare(path: str, directory: str):
+    """Runs in a worker process. Returns the hash of the file and whether it was encoded"""
+    digest = file_hash(path)
+    target = os.path.join(directory, digest + SUFFIX)
+    if os.path.exists(target):
+        return digest, False
+    encode_file(path, target)
+    return digest, True
+
+
+class Cache:
+    """Entries are DIGEST.b64 files in directory, index.json maps a path to [size, mtime_ns, digest].
+    max_size is kept by removing other entries; the entries of the message being sent are never removed,
+    so a message larger than the limit leaves the cache over it until the next run.
+    Runs sharing the directory merge their changes into the index under a lock (fcntl, not on Windows)."""
+
+    def __init__(self, directory: str, max_size: int = DEFAULT_SIZE, workers: int = None):
+        self.directory = directory
+        self.max_size = max_size
+        self.workers = workers
+        self.hits = 0
+        self.encoded = 0
+        os.makedirs(directory, exist_ok=True)
+        self._index = self._load_index()
+
+    def entry(self, digest: str) -> str:
+        return os.path.join(self.directory, digest + SUFFIX)
+
+    def prepare(self, attachments) -> dict:
+        """Encodes attachments that are not in the cache. Returns path of the attachment -> path of its
+        base64 lines"""
+        encoded, missing, changed = {}, [], {}
+        for attachment in attachments:
+            path = os.path.abspath(attachment.path)
+            stat = os.stat(path)
+            known = self._index.get(path)
+            # Размер и время изменения совпали: файл тот же, хеш берем из индекса, не читая файл
+            if known and known[:2] == [stat.st_size, stat.st_mtime_ns] and os.path.exists(self.entry(known[2])):
+                encoded[attachment.path] = self.entry(known[2])
+                self.hits += 1
+            else:
+                missing.append((attachment, path, stat))
+
+        if missing:
+            with concurrent.futures.ProcessPoolExecutor(self.workers) as executor:
+                futures = [executor.submit(_prepare, path, self.directory) for _, path, _ in missing]
+                for (attachment, path, stat), future in zip(missing, futures):
+                    digest, was_encoded = future.result()
+                    changed[path] = [stat.st_size, stat.st_mtime_ns, digest]
+                    encoded[attachment.path] = self.entry(digest)
+                    self.encoded += was_encoded
+                    self.hits += not was_encoded
+
+        # Время изменения записи - время последнего использования, по нему вытесняются старые
+        for entry in set(encoded.values()):
+            os.utime(entry)
+        with self._lock():
+            # Пока кодировали, другой запуск мог сохранить свой индекс: берем его и добавляем свои пути
+            self._index = self._load_index()
+            self._index.update(changed)
+            self._evict(set(encoded.values()))
+            self._save_index()
+        return encoded
+
+    def start(self, attachments) -> 'Pending':
+        """prepare in the background, see Pending"""
+        return Pending(self, attachments)
+
+    @contextlib.contextmanager
+    def _lock(self):
+        with open(os.path.join(self.directory, LOCK), 'a') as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            yield
+
+    def _evict(self, keep: set):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(SUFFIX):
+                stat = os.stat(os.path.join(self.directory, name))
+                entries.append((stat.st_mtime_ns, stat.st_size, os.path.join(self.directory, name)))
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in sorted(entries):
+            if total <= self.max_size:
+                break
+            if entry in keep:
+                continue
+            os.unlink(entry)
+            total -= size
+        # Индекс не должен указывать на удаленные записи
+        self._index = {path: known for path, known in self._index.items() if os.path.exists(self.entry(known[2]))}
+
+    def _load_index(self) -> dict:
+        try:
+            with open(os.path.join(self.directory, INDEX), encoding='utf8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_index(self):
+        path = os.path.join(self.directory, INDEX)
+        temporary = f'{path}.{os.getpid()}.tmp'
+        with open(temporary, 'w', encoding='utf8') as f:
+            json.dump(self._index, f)
+        os.replace(temporary, path)
+
+
+class Pending(collections.abc.Mapping):
+    """Result of Cache.prepare that runs in a thread, so pictures are encoded while the connection is opened
+    and the handshake goes on. Looking up a path waits for the encoding, errors of it are raised there."""
+
+    def __init__(self, cache: Cache, attachments):
+        executor = concurrent.futures.ThreadPoolExecutor(1)
+        self._future = executor.submit(cache.prepare, attachments)
+        executor.shutdown(wait=False)
+
+    def __getitem__(self, path: str) -> str:
+        return self._future.result()[path]
+
+    def __iter__(self):
+        return iter(self._future.result())
+
+    def __len__(self):
+        return len(self._future.result())
@@ -0,0 +1,399 @@
+"""Bulk delivery of one message to many recipients: recipients are grouped by destination host,
+every host gets at most per_host connections, all hosts together at most connections. A connection is
+opened, secured and authenticated once and then reused for the following messages (RSET between them);
+recipients rejected with a transient 4xx answer or lost with the connection are retried with backoff.
+With PIPELINING the commands of a transaction go in one write and exactly as many answers are read back,
+so a transaction costs two round trips for any number of recipients. A server with CHUNKING and BINARYMIME
+gets the attachments of mime.Message as they are, in BDAT chunks without base64 and dot stuffing."""
+import ssl
+import time
+import socket
+import typing
+import itertools
+import threading
+import collections
+import concurrent.futures
+
+import m_base64
+import mime
+import mx
+
+SMTP_PORT = 25
+SMTPS_PORT = 465
+MAX_LINE = 8192
+
+context = ssl.create_default_context()
+
+
+def helo_name(sock) -> str:
+    """Name for EHLO: fully qualified host name, or the address literal of the local end of the connection"""
+    name = socket.getfqdn()
+    return name if '.' in name else f'[{sock.getsockname()[0]}]'
+
+
+def parse_server(spec: str, default_port: int = SMTP_PORT):
+    host, _, port = spec.partition(':')
+    return host, int(port) if port else default_port
+
+
+class Reply(typing.NamedTuple):
+    code: int
+    lines: list
+
+    @property
+    def text(self) -> str:
+        return ' '.join(line.decode('utf8', 'replace') for line in self.lines)
+
+
+class SmtpError(Exception):
+    def __init__(self, reply: Reply):
+        super().__init__(f'{reply.code} {reply.text}')
+        self.reply = reply
+
+
+def read_reply(file, verbose: bool = False) -> Reply:
+    """Reads one answer from a binary file of the socket, multiline answers (250-...) included"""
+    lines = []
+    while True:
+        line = file.readline(MAX_LINE)
+        if not line:
+            raise ConnectionError('Connection closed by server')
+        if verbose:
+            print(f'S: {line.decode("utf8", "replace").rstrip()}')
+        if not line[:3].isdigit():
+            raise SmtpError(Reply(0, [line.rstrip()]))
+        lines.append(line[4:].rstrip())
+        if line[3:4] != b'-':
+            return Reply(int(line[:3]), lines)
+
+
+def parse_extensions(reply: Reply) -> dict:
+    """EHLO answer to keyword -> parameters, the first line is the greeting"""
+    extensions = {}
+    for line in reply.lines[1:]:
+        keyword, _, parameters = line.decode('utf8', 'replace').partition(' ')
+        extensions[keyword.upper()] = parameters
+    return extensions
+
+
+def accepted(reply: Reply) -> bool:
+    return reply.code in (250, 251)
+
+
+def bdat_commands(chunks, size: int = mime.WRITE_SIZE):
+    """BDAT commands (RFC 3030) with their data for the chunks of a message, the last one is BDAT n LAST"""
+    previous = None
+    for chunk in mime.coalesce(chunks, size):
+        if previous is not None:
+            yield b'BDAT %d\r\n' % len(previous) + previous
+        previous = chunk
+    previous = previous or b''
+    yield b'BDAT %d LAST\r\n' % len(previous) + previous
+
+
+class Session:
+    """One connection to a server. open connects, greets it, starts TLS and authenticates;
+    send_mail sends a message in one transaction, reset prepares the connection for the next one."""
+
+    def __init__(self, address, secure: bool = False, credentials=None, timeout: float = 30, verbose: bool = False):
+        self.address = address
+        self.secure = secure
+        self.credentials = credentials
+        self.timeout = timeout
+        self.verbose = verbose
+        self.extensions = {}
+        self.sent = 0
+        self._sock = None
+        self._file = None
+
+    def open(self):
+        sock = socket.create_connection(self.address, self.timeout)
+        if self.address[1] == SMTPS_PORT:
+            sock = context.wrap_socket(sock, server_hostname=self.address[0])
+        self._attach(sock)
+        self._expect(self.reply(), 220)
+        self.ehlo()
+        if self.secure and 'STARTTLS' in self.extensions and not isinstance(sock, ssl.SSLSocket):
+            self._expect(self.command('STARTTLS'), 220)
+            self._attach(context.wrap_socket(sock, server_hostname=self.address[0]))
+            self.ehlo()
+        if self.credentials and 'AUTH' in self.extensions:
+            login, password = self.credentials
+            self._expect(self.command(b'AUTH PLAIN ' + m_base64.encode(f'\0{login}\0{password}'), False), 235)
+        return self
+
+    def _attach(self, sock):
+        self._sock = sock
+        self._file = sock.makefile('rb')
+
+    def ehlo(self):
+        self.extensions = parse_extensions(self._expect(self.command(f'EHLO {helo_name(self._sock)}'), 250))
+
+    @property
+    def binary(self) -> bool:
+        return 'CHUNKING' in self.extensions and 'BINARYMIME' in self.extensions
+
+    def command(self, line, verbose: bool = True) -> Reply:
+        if isinstance(line, str):
+            line = line.encode('utf8')
+        if self.verbose and verbose:
+            print(f'C: {line.decode("utf8", "replace")}')
+        self._sock.sendall(line + b'\r\n')
+        return self.reply()
+
+    def reply(self) -> Reply:
+        return read_reply(self._file, self.verbose)
+
+    def commands(self, lines) -> list:
+        """Sends the commands in one write and reads one answer for each of them. Without PIPELINING
+        the commands are sent one by one"""
+        lines = [line.encode('utf8') if isinstance(line, str) else line for line in lines]
+        if 'PIPELINING' not in self.extensions:
+            return [self.command(line) for line in lines]
+        if self.verbose:
+            for line in lines:
+                print(f'C: {line.decode("utf8", "replace")}')
+        self._sock.sendall(b''.join(line + b'\r\n' for line in lines))
+        return [self.reply() for _ in lines]
+
+    @staticmethod
+    def _expect(reply: Reply, *codes) -> Reply:
+        if reply.code not in codes:
+            raise SmtpError(reply)
+        return reply
+
+    def send_mail(self, sender: str, recipients, header: bytes, body) -> dict:
+        """Sends the message to all recipients in one transaction, body is an iterable of chunks as mime.Message.
+        Returns recipient -> answer: the answer to its RCPT if it was rejected, else the answer to the data.
+        Raises SmtpError if the whole transaction failed"""
+        if isinstance(recipients, str):
+            recipients = [recipients]
+        binary = self.binary and isinstance(body, mime.Message)
+        if binary:
+            body = body.as_binary()
+        mail = f'MAIL FROM:<{sender.strip("<>")}>' + (' BODY=BINARYMIME' if binary else '')
+        rcpts = [f'RCPT TO:<{recipient}>' for recipient in recipients]
+        if 'PIPELINING' in self.extensions:
+            # RFC 2920: DATA идет в той же пачке, ответы приходят по порядку команд
+            replies = self.commands([mail] + rcpts + ([] if binary else ['DATA']))
+            mail_reply, rcpt_replies = replies[0], replies[1:len(recipients) + 1]
+            data_reply = None if binary else replies[-1]
+        else:
+            mail_reply = self.command(mail)
+            rcpt_replies = self.commands(rcpts) if accepted(mail_reply) else []
+            data_reply = self.command('DATA') if not binary and any(map(accepted, rcpt_replies)) else None
+
+        statuses = dict(zip(recipients, rcpt_replies))
+        if data_reply is not None and data_reply.code == 354 and not any(map(accepted, rcpt_replies)):
+            # Сервер согласился на данные без получателей: завершаем их пустыми
+            self._sock.sendall(b'.\r\n')
+            self.reply()
+        self._expect(mail_reply, 250)
+        if not any(map(accepted, rcpt_replies)):
+            return statuses
+
+        message = itertools.chain([header, b'\r\n'], body)
+        if binary:
+            reply = self._send_chunks(message)
+        else:
+            self._expect(data_reply, 354)
+            for chunk in mime.coalesce(itertools.chain(message, [b'\r\n.\r\n'])):
+                self._sock.sendall(chunk)
+            reply = self._expect(self.reply(), 250)
+        self.sent += 1
+        for recipient, rcpt_reply in statuses.items():
+            if accepted(rcpt_reply):
+                statuses[recipient] = reply
+        return statuses
+
+    def _send_chunks(self, message) -> Reply:
+        """Sends the message by BDAT. With PIPELINING chunks go one after another and their answers
+        are read after the last one, else every chunk waits for its answer"""
+        pipelining = 'PIPELINING' in self.extensions
+        reply, pending = None, 0
+        for command in bdat_commands(message):
+            if self.verbose:
+                line = command[:command.index(b'\r\n')]
+                print(f'C: {line.decode("utf8")}')
+            self._sock.sendall(command)
+            if pipelining:
+                pending += 1
+            else:
+                reply = self._expect(self.reply(), 250)
+        for reply in [self.reply() for _ in range(pending)]:
+            self._expect(reply, 250)
+        return reply
+
+    def reset(self):
+        """RSET before the next message, it also checks that the connection is still alive"""
+        self._expect(self.command('RSET'), 250)
+
+    def close(self, quit: bool = True):
+        """quit is False for a broken connection: there is no one to say goodbye to"""
+        if self._sock is None:
+            return
+        try:
+            if quit:
+                self.command('QUIT')
+        except (OSError, SmtpError):
+            pass
+        self._file.close()
+        self._sock.close()
+        self._sock = None
+
+
+class Pool:
+    """Idle open sessions by destination address. acquire returns an idle session checked with RSET
+    or opens a new one, release returns it for the next message"""
+
+    def __init__(self, factory):
+        self.factory = factory
+        self.opened = 0
+        self._idle = collections.defaultdict(list)
+        self._lock = threading.Lock()
+
+    def acquire(self, address) -> Session:
+        while True:
+            with self._lock:
+                session = self._idle[address].pop() if self._idle[address] else None
+                if session is None:
+                    self.opened += 1
+            if session is None:
+                session = self.factory(address)
+                try:
+                    return session.open()
+                except (OSError, SmtpError):
+                    self.discard(session, False)
+                    raise
+            try:
+                session.reset()
+                return session
+            except (OSError, SmtpError):
+                # Сервер закрыл простаивающее соединение
+                self.discard(session, False)
+
+    def release(self, session: Session):
+        with self._lock:
+            self._idle[session.address].append(session)
+
+    @staticmethod
+    def discard(session: Session, quit: bool = True):
+        try:
+            session.close(quit)
+        except OSError:
+            pass
+
+    def close(self):
+        with self._lock:
+            sessions = [session for idle in self._idle.values() for session in idle]
+            self._idle.clear()
+        for session in sessions:
+            self.discard(session)
+
+
+class Delivery(typing.NamedTuple):
+    recipient: str
+    address: tuple
+    code: int
+    text: str
+    attempts: int
+
+    @property
+    def delivered(self) -> bool:
+        return 200 <= self.code < 300
+
+    @property
+    def transient(self) -> bool:
+        return 400 <= self.code < 500
+
+
+class Engine:
+    """Sends the message in transactions of up to per_envelope recipients of one host. Destination of
+    a recipient is relay if it is given, else routes[domain] or the best MX of the domain on port 25.
+    A domain without MX records, or when DNS can not be asked, is its own implicit MX (RFC 5321 §5.1)."""
+
+    def __init__(self, sender: str, message, headers, relay=None, routes=None, connections: int = 8,
+                 per_host: int = 2, retries: int = 3, backoff: float = 1, secure: bool = False, credentials=None,
+                 timeout: float = 30, verbose: bool = False, per_envelope: int = 1):
+        self.sender = sender
+        self.message = message
+        # Заголовок у каждой транзакции свой (To:), headers(recipients) -> bytes
+        self.headers = headers
+        self.per_envelope = per_envelope
+        self.relay = parse_server(relay) if isinstance(relay, str) else relay
+        self.routes = {domain.lower(): parse_server(route) if isinstance(route, str) else route
+                       for domain, route in (routes or {}).items()}
+        self.connections = connections
+        self.per_host = per_host
+        self.retries = retries
+        self.backoff = backoff
+        self.pool = Pool(lambda address: Session(address, secure, credentials, timeout, verbose))
+
+    def route(self, recipient: str):
+        if self.relay:
+            return self.relay
+        domain = recipient.rpartition('@')[2].lower()
+        if domain not in self.routes:
+            self.routes[domain] = (self.exchange(domain), SMTP_PORT)
+        return self.routes[domain]
+
+    @staticmethod
+    def exchange(domain: str) -> str:
+        try:
+            hosts = mx.lookup(domain)
+        except OSError as e:
+            print(f'{domain}: MX lookup failed ({e}), sending to the domain itself')
+            hosts = []
+        # Остальные MX не пробуются: недоставленное повторяется на тот же сервер
+        return hosts[0] if hosts else domain
+
+    def deliver(self, recipients) -> list:
+        """Returns Delivery for every recipient"""
+        groups = collections.defaultdict(list)
+        for recipient in recipients:
+            groups[self.route(recipient)].append(recipient)
+
+        # Получатели хоста делятся между per_host потоками, у каждого одно соединение за раз
+        shards = [(address, group[i::self.per_host])
+                  for address, group in groups.items() for i in range(min(self.per_host, len(group)))]
+        try:
+            with concurrent.futures.ThreadPoolExecutor(self.connections) as executor:
+                futures = [executor.submit(self._deliver_shard, address, shard) for address, shard in shards]
+                return [delivery for future in futures for delivery in future.result()]
+        finally:
+            self.pool.close()
+
+    def _deliver_shard(self, address, recipients) -> list:
+        results = []
+        for attempt in range(1, self.retries + 2):
+            failed = []
+            for start in range(0, len(recipients), self.per_envelope):
+                for result in self._deliver_envelope(address, recipients[start:start + self.per_envelope], attempt):
+                    if not result.transient or attempt > self.retries:
+                        results.append(result)
+                    else:
+                        failed.append(result.recipient)
+            if not failed:
+                break
+            time.sleep(self.backoff * 2 ** (attempt - 1))
+            recipients = failed
+        return results
+
+    def _deliver_envelope(self, address, recipients, attempt) -> list:
+        session = None
+        try:
+            session = self.pool.acquire(address)
+            statuses = session.send_mail(self.sender, recipients, self.headers(recipients), self.message)
+        except SmtpError as e:
+            if session is not None:
+                self.pool.release(session)
+            return [Delivery(recipient, address, e.reply.code, e.reply.text, attempt) for recipient in recipients]
+        except OSError as e:
+            # Соединение потеряно или не открылось: это временная ошибка, соединение не переиспользуем
+            if session is not None:
+                self.pool.discard(session, False)
+            text = str(e) or type(e).__name__
+            return [Delivery(recipient, address, 421, text, attempt) for recipient in recipients]
+        self.pool.release(session)
+        return [Delivery(recipient, address, statuses[recipient].code, statuses[recipient].text, attempt)
+                for recipient in recipients]
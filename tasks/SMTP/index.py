@@ -1,27 +1,21 @@
 import random
+import itertools
 import sys
 import os
 import argparse
 import getpass
-import time
 
 import socket
 import ssl
-import urllib.request
+import time
 
 import m_base64
+import mime
+import delivery
+import cache
 
-ip = urllib.request.urlopen('https://api.ipify.org').read().decode('utf8')
 context = ssl.create_default_context()
 
-FILE_TYPES = {
-    '.jpg': b'image/jpeg',
-    '.jpeg': b'image/jpeg',
-    '.png': b'image/png',
-    '.gif': b'image/gif',
-    '.tiff': b'image/tiff'
-}
-
 
 def auth():
     login = input('Enter login: ')
@@ -34,48 +28,66 @@ def parse(args):
     parser = argparse.ArgumentParser(description="SMTP Client that send images from directory to mail")
 
     parser.add_argument('--ssl', action='store_true', help='Enable ssl connection, if server allows it')
-    parser.add_argument('-s', '--server', action='store', required=True, help='Mail server in format '
-                                                                              'server_host[:port]')
-    parser.add_argument('-t', '--to', action='store', dest='receiver', required=True, help='Receiver email')
+    parser.add_argument('-s', '--server', action='store', help='Mail server in format server_host[:port]. '
+                                                                'Required unless --direct is given')
+    parser.add_argument('-t', '--to', action='append', dest='receivers', default=[],
+                        help='Receiver email, may be given several times')
+    parser.add_argument('--recipients', action='store', default=None, metavar='FILE',
+                        help='File with receiver emails, one per line')
     parser.add_argument('-f', '--from', action='store', dest='sender', default='<>',
                         help='Sender email. By default is <>')
     parser.add_argument('--subject', action='store', default='', help='Set email subject')
     parser.add_argument('--auth', action='store_true', help='Require authorithation')
     parser.add_argument('-v', '--verbose', action='store_true', help='Show log')
     parser.add_argument('-d', '--directory', action='store', default='.', help='Directory with pictures to send')
-
-    return parser.parse_args(args)
-
-
-def data_packer(dir_to_images) -> bytes:
-    """Takes following files from dir: .jp(e)g, .png, .git, .tiff"""
-    boundary = str(time.time())
-    result = [f'Content-Type: multipart/mixed; boundary="{boundary}"\r\n\r\n'.encode('utf8')]
+    parser.add_argument('--cache', action='store', default=None, metavar='DIRECTORY',
+                        help='Encode pictures in parallel while connecting and keep them in this directory for '
+                             'the next sends of the same files. Without it pictures are encoded while sending')
+    parser.add_argument('--cache-size', action='store', type=int, default=cache.DEFAULT_SIZE // 1024 ** 2,
+                        metavar='MB', help='Least recently used pictures are removed from a larger cache')
+    parser.add_argument('-j', '--jobs', action='store', type=int, default=None,
+                        help='Processes encoding pictures, by default one per CPU')
+    parser.add_argument('-c', '--connections', action='store', type=int, default=8,
+                        help='Connections at once when there are several receivers')
+    parser.add_argument('--per-host', action='store', type=int, default=2,
+                        help='Connections at once to one server when there are several receivers')
+    parser.add_argument('--per-envelope', action='store', type=int, default=1,
+                        help='Receivers of one server in one transaction (RCPT TO each), they are hidden '
+                             'from each other by To: undisclosed-recipients')
+    parser.add_argument('--retries', action='store', type=int, default=3,
+                        help='Retries of receivers rejected with a temporary (4xx) error')
+    parser.add_argument('--backoff', action='store', type=float, default=1,
+                        help='Seconds before the first retry, doubled for every next one')
+    parser.add_argument('--direct', action='store_true',
+                        help='Send to the best MX of every receiver domain (the domain itself if it has none) '
+                             'instead of --server')
+
+    args = parser.parse_args(args)
+    if args.recipients:
+        with open(args.recipients, encoding='utf8') as f:
+            args.receivers.extend(line.strip() for line in f if line.strip())
+    if not args.receivers:
+        parser.error('no receivers, use -t or --recipients')
+    if not args.server and not args.direct:
+        parser.error('the following arguments are required: -s/--server')
+
+    return args
+
+
+def data_packer(dir_to_images, encoded_cache: cache.Cache = None) -> mime.Message:
+    """Takes following files from dir: .jp(e)g, .png, .git, .tiff. With encoded_cache files are encoded
+    in parallel in the background (or taken from the cache) while the connection is opened, else they are
+    read and encoded only while the message is sent"""
     if not os.path.exists(dir_to_images) or not os.path.isdir(dir_to_images):
         print('Directory is not exists')
         exit(2)
 
-    images = next(os.walk(dir_to_images))[2]
-    boundary = boundary.encode('utf8')
-    counter = 0
-    for image in images:
-        ext = os.path.splitext(image)[1]
-        encode_img = image.encode('utf8')
-        if ext in FILE_TYPES:
-            counter += 1
-            result.extend([b'--', boundary, b'\r\n', b'Content-Disposition: attachment; filename="',
-                           encode_img, b'"\r\nContent-Transfer-Encoding: base64\r\nContent-Type: ',
-                           FILE_TYPES[ext], b'; name="', encode_img, b'"\r\n\r\n'])
-            with open(os.path.join(dir_to_images, image), 'rb') as f:
-                data = m_base64.encode(f.read())
-                for i in range(0, len(data), 76):
-                    result.extend([data[i: i + 76], b'\n'])
-
-    result.extend([b'--', boundary, b'--'])
+    images = mime.find_images(dir_to_images)
+    print(f'Read {len(images)} images')
+    if encoded_cache is None:
+        return mime.Message(images)
 
-    print(f'Read {counter} images')
-
-    return b''.join(result)
+    return mime.Message(images, encoded=encoded_cache.start(images))
 
 
 class Server:
@@ -89,18 +101,19 @@ class Server:
         self.parse_auth = False
         self.verbose = verbose
         self.ssl = secure
-        self.message = [message_body]
-        self.subject = f'=?UTF-8?B?{m_base64.encode(subject.encode("utf8")).decode("utf8")}?='
+        self.message = message_body
+        self.subject = mime.encode_word(subject)
 
         self.pipelining = False
+        self.chunking = False
         self.size = -1
 
         socket.setdefaulttimeout(timeout)
         self._sock = None
+        self._file = None
         self._additional = None
 
-        self.header = (f"From: {self.sender}\r\nTo: {self.receiver}\r\nSubject: {self.subject}\r\n"
-                       "MIME-Version: 1.0".encode('utf8'))
+        self.header = mime.header(self.sender, self.receiver, self.subject)
 
     def _connect(self):
         try:
@@ -116,15 +129,17 @@ class Server:
             except ssl.SSLError:
                 print('Can not establish secure connection using SSL Wrapper.')
                 self._sock = socket.create_connection((self.host, self.port))
+        self._file = self._sock.makefile('rb')
 
     def _start_tls(self):
         self._send('STARTTLS')
-        if b'220' in self._receive():
+        if self._receive().code == 220:
             try:
                 self._sock = context.wrap_socket(self._sock, server_hostname=self.host)
             except ssl.SSLError:
                 print('Can not establish secure connection using START TLS. Exit')
                 exit(0)
+            self._file = self._sock.makefile('rb')
 
     def start(self):
         self._connect()
@@ -132,7 +147,7 @@ class Server:
         self._receive()
 
         # Привет серверу и парсинг прищедших настроек
-        self._send(f'EHLO {ip}')
+        self._send(f'EHLO {delivery.helo_name(self._sock)}')
         self._parse_abilities(self._receive())
 
         # Если подключение было не к порту SMTPS, и сервер поддеривает STARTTLS то подключаем его
@@ -140,34 +155,30 @@ class Server:
             self._start_tls()
 
         # Здесь по-новой приветствуем сервер
-        self._send(f'EHLO {ip}')
+        self._send(f'EHLO {delivery.helo_name(self._sock)}')
         self._parse_abilities(self._receive())
 
         # Если требуется аутентификация и ее поддерживает сервер, просим пользователя логин и пароль
         if self.parse_auth:
             self._auth()
 
-        self._split_message()
-        for mess in self.message:
+        # Вложения уходят как есть: без base64 письмо на треть короче. message/partial бывает только 7bit,
+        # поэтому двоичное письмо отправляется, только если помещается в SIZE целиком
+        if self.chunking and (self.size == -1 or len(self.message.as_binary()) + len(self.header) < self.size):
+            self.message = self.message.as_binary()
+
+        for mess in self._split_message():
             self._mail(mess)
         print('Message has been sent')
 
-    def _receive(self, use_try=True):
-        if use_try:
-            try:
-                data = self._sock.recv(65536)
-            except socket.error:
-                print('Connection closed by server')
-                self.close()
-                exit(0)
-            else:
-                if self.verbose:
-                    print(f'S: {data.decode("utf8")}')
-                return data
-        data = self._sock.recv(65536)
-        if self.verbose:
-            print(f'S: {data.decode("utf8")}')
-        return data
+    def _receive(self) -> delivery.Reply:
+        """Reads one whole answer, however it is split into packets"""
+        try:
+            return delivery.read_reply(self._file, self.verbose)
+        except (socket.error, delivery.SmtpError):
+            print('Connection closed by server')
+            self.close()
+            exit(0)
 
     def _send(self, data, add_verbose=True):
         if isinstance(data, str):
@@ -175,22 +186,27 @@ class Server:
         if data[len(data) - 3:] != b'\r\n':
             data += b'\r\n'
         try:
-            self._sock.send(data)
+            self._sock.sendall(data)
         except ConnectionAbortedError:
             print('Connection reset by server')
         if self.verbose and add_verbose:
             print('C:', data.decode('utf8', errors='ignore'))
 
-    def _parse_abilities(self, data):
-        self.parse_auth = self.auth and (b'AUTH' in data)
-        self.ssl = self.ssl and (b'STARTTLS' in data)
-        self.pipelining = b'PIPELINING' in data
-        splitted = data.split(b'\r\n')
+    def _send_body(self, chunks):
+        """Sends the message body and its end in large writes"""
+        for chunk in mime.coalesce(itertools.chain(chunks, [b'\r\n.\r\n'])):
+            self._sock.sendall(chunk)
+
+    def _parse_abilities(self, reply):
+        extensions = delivery.parse_extensions(reply)
+        self.parse_auth = self.auth and 'AUTH' in extensions
+        self.ssl = self.ssl and 'STARTTLS' in extensions
+        self.pipelining = 'PIPELINING' in extensions
+        self.chunking = 'CHUNKING' in extensions and 'BINARYMIME' in extensions
         if self.parse_auth:
-            auth = list(filter(lambda x: b'AUTH' in x, splitted))[0]
-            self.auth_types = auth.split()[1:]
-        if b'SIZE' in data:
-            self.size = int(next(filter(lambda x: b'SIZE' in x, splitted)).split()[-1])
+            self.auth_types = extensions['AUTH'].split()
+        if extensions.get('SIZE', '').isdigit() and int(extensions['SIZE']):
+            self.size = int(extensions['SIZE'])
 
     def _auth(self):
         method = lambda log, pas: b'AUTH PLAIN ' + m_base64.encode(f'\0{log}\0{pas}')
@@ -198,75 +214,139 @@ class Server:
         while True:
             login, password = auth()
             self._send(method(login, password), add_verbose=False)
-            data = self._receive()
-            if b'235' in data:
+            if self._receive().code == 235:
                 break
 
     def _mail(self, data):
+        binary = isinstance(data, mime.Message) and data.binary
+        commands = [f'MAIL FROM:<{self.sender.strip("<>")}>' + (' BODY=BINARYMIME' if binary else ''),
+                    f'RCPT TO:<{self.receiver}>']
+        if not binary:
+            commands.append('DATA')
         if self.pipelining:
-            self._send(f'MAIL FROM: <{self.sender}>\r\nRCPT TO: <{self.receiver}>\r\nDATA')
-            while True:
-                try:
-                    self._receive(False)
-                except socket.timeout:
+            # Ответов ровно столько, сколько команд в пачке, и приходят они по порядку: читаем их все
+            # за один круг до сервера, не дожидаясь таймаута
+            self._send('\r\n'.join(commands))
+            replies = [self._receive() for _ in commands]
+        else:
+            replies = []
+            for command in commands:
+                self._send(command)
+                replies.append(self._receive())
+                if replies[-1].code >= 400:
                     break
+
+        failed = next((reply for reply in replies if not delivery.accepted(reply) and reply.code != 354), None)
+        if failed is not None:
+            if replies[-1].code == 354:
+                # Сервер уже ждет данные, завершаем их пустыми
+                self._send('.')
+                self._receive()
+            self._fail(failed)
+        if binary:
+            reply = self._send_chunks(itertools.chain([self.header, b'\r\n'], data))
+        else:
             self._send(self.header, False)
-            self._send(data, False)
-            self._send('.', False)
-            while True:
-                try:
-                    self._receive(False)
-                except socket.timeout:
-                    return
-
-        self._send(f'MAIL FROM: {self.sender}')
-        data_ = self._receive()
-        if not data_.startswith(b'2'):
-            print(f"Can not sent message. Last message:\n{data_.decode('utf8')}")
-            self.close()
-            exit(0)
-        self._send(f'RCPT TO: <{self.receiver}>')
-        self._receive()
-        self._send('DATA')
-        self._receive()
-        self._send(f'From: {self.sender}\r\nTo: {self.receiver}\r\nSubject: {self.subject}', False)
-        self._send(data, False)
-        self._send('\r\n.\r\n', False)
-        self._receive()
+            self._send_body(data)
+            reply = self._receive()
+        if reply.code != 250:
+            self._fail(reply)
+
+    def _send_chunks(self, chunks):
+        """Sends the message by BDAT without dot stuffing. With PIPELINING answers to the chunks are read
+        after the last one, else every chunk waits for its answer. Returns the first failed or the last answer"""
+        pending = 0
+        for command in delivery.bdat_commands(chunks):
+            if self.verbose:
+                line = command[:command.index(b'\r\n')]
+                print(f'C: {line.decode("utf8")}')
+            self._sock.sendall(command)
+            pending += 1
+            if not self.pipelining:
+                reply = self._receive()
+                pending = 0
+                if reply.code != 250:
+                    return reply
+        replies = [self._receive() for _ in range(pending)]
+        return next((reply for reply in replies if reply.code != 250), replies[-1] if replies else reply)
+
+    def _fail(self, reply):
+        print(f"Can not sent message. Last message:\n{reply.code} {reply.text}")
+        self.close()
+        exit(0)
 
     def _split_message(self):
-        if self.size == -1 or len(self.message[0]) + len(self.header) < self.size:
+        """Yields bodies of messages to send as iterables of chunks. If the message is larger than SIZE
+        of the server, it is cut into message/partial parts while it is read, without building it"""
+        total = len(self.message)
+        if self.size == -1 or total + len(self.header) < self.size:
+            yield self.message
             return
 
-        mess = self.message[0]
-        self.message = []
         size = self.size - len(self.header) - 100
-        message_count = len(mess) // size
-        if len(mess) % self.size > 0:
-            message_count += 1
+        message_count = (total + size - 1) // size
         id = random.randint(0, 2 ** 16)
-        for i in range(0, len(mess), size):
-            temp_mess = [b'Content-Type: message/partial; ',
-                         f'id="{id}"; number={i // self.size + 1}; total={message_count}\r\n\r\n'.encode('utf8'),
-                         mess[i:i + self.size]]
-            self.message.append(b''.join(temp_mess))
+        splitter = mime.Splitter(self.message)
+        for number in range(1, message_count + 1):
+            header = (f'Content-Type: message/partial; id="{id}"; number={number}; total={message_count}'
+                      f'\r\n\r\n'.encode('utf8'))
+            yield itertools.chain([header], splitter.take(size))
 
     def close(self):
+        if self._file:
+            self._file.close()
         if self._sock:
             self._sock.close()
         if self._additional:
             self._additional.close()
 
 
+def bulk(args, data):
+    """Sends the message in transactions of up to --per-envelope receivers over a pool of reused connections"""
+    credentials = auth() if args.auth else None
+    subject = mime.encode_word(args.subject)
+
+    def headers(receivers):
+        to = receivers[0] if len(receivers) == 1 else 'undisclosed-recipients:;'
+        return mime.header(args.sender, to, subject)
+
+    engine = delivery.Engine(args.sender, data, headers, relay=None if args.direct else args.server,
+                             connections=args.connections, per_host=args.per_host, retries=args.retries,
+                             backoff=args.backoff, secure=args.ssl, credentials=credentials, verbose=args.verbose,
+                             per_envelope=args.per_envelope)
+    started = time.monotonic()
+    results = engine.deliver(args.receivers)
+    elapsed = time.monotonic() - started
+
+    failed = [result for result in results if not result.delivered]
+    for result in failed:
+        print(f'{result.recipient}: {result.code} {result.text} (attempts: {result.attempts})')
+    print(f'Delivered to {len(results) - len(failed)} of {len(results)} receivers in {elapsed:.2f}s '
+          f'over {engine.pool.opened} connections')
+
+
 def main(args):
     args = parse(args[1:])
-    data = data_packer(args.directory)
+    encoded_cache = args.cache and cache.Cache(args.cache, args.cache_size * 1024 ** 2, args.jobs)
+    data = data_packer(args.directory, encoded_cache)
+    send(args, data)
+    if encoded_cache:
+        # len ждет конца кодирования, даже если оно не понадобилось (BINARYMIME)
+        encoded = len(data.encoded)
+        print(f'Encoded {encoded_cache.encoded} of {encoded} images, {encoded_cache.hits} taken from the cache')
+
+
+def send(args, data):
+    if len(args.receivers) > 1 or args.direct:
+        bulk(args, data)
+        return
+
     port = 25
     if ':' in args.server:
         port = args.server.split(':')[1]
         args.server = args.server.split(':')[0]
-    server = Server(args.server, port, args.sender, args.receiver, data, args.subject, secure=args.ssl, auth=args.auth,
-                    verbose=args.verbose)
+    server = Server(args.server, port, args.sender, args.receivers[0], data, args.subject, secure=args.ssl,
+                    auth=args.auth, verbose=args.verbose)
     try:
         server.start()
     finally:
@@ -1,29 +1,153 @@
+"""Base64 (RFC 4648) without a Python loop per byte: data is processed in blocks, every output byte stream
+of a block is made with one bytes.translate through a lookup table, and bit fields of neighbouring bytes
+are combined with one OR of big integers. Encoder and Decoder work incrementally, Encoder wraps the output
+into MIME lines of 76 characters."""
 BASE64_LINE = b'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/'
 EQ_ORD = ord('=')
+LINE_LENGTH = 76
+# Кодируем и декодируем блоками: память не растет с размером данных, а цикл Python идет по блокам
+BLOCK = 57 * 1024
 
 
-def encode(data: (bytes, str)):
+def _table(function) -> bytes:
+    return bytes(function(i) & 0xff for i in range(256))
+
+
+# Байты группы a, b, c дают символы a >> 2, (a & 3) << 4 | b >> 4, (b & 15) << 2 | c >> 6, c & 63
+_ALPHABET = _table(lambda i: BASE64_LINE[i & 63])
+_A_HIGH = _table(lambda a: BASE64_LINE[a >> 2])
+_A_LOW = _table(lambda a: (a & 3) << 4)
+_B_HIGH = _table(lambda b: b >> 4)
+_B_LOW = _table(lambda b: (b & 15) << 2)
+_C_HIGH = _table(lambda c: c >> 6)
+_C_LOW = _table(lambda c: BASE64_LINE[c & 63])
+
+# Символ -> 6 бит. Все, что не из алфавита (переводы строк, '='), выбрасывается при декодировании
+_VALUES = _table(lambda char: max(0, BASE64_LINE.find(char)))
+_IGNORED = bytes(char for char in range(256) if char not in BASE64_LINE)
+_V0 = _table(lambda v: v << 2)
+_V1_HIGH = _table(lambda v: v >> 4)
+_V1_LOW = _table(lambda v: v << 4)
+_V2_HIGH = _table(lambda v: v >> 2)
+_V2_LOW = _table(lambda v: v << 6)
+
+
+def _or(first: bytes, second: bytes) -> bytes:
+    return (int.from_bytes(first, 'big') | int.from_bytes(second, 'big')).to_bytes(len(first), 'big')
+
+
+def _encode_groups(data: bytes) -> bytearray:
+    """len(data) is a multiple of 3"""
+    a, b, c = data[0::3], data[1::3], data[2::3]
+    result = bytearray(len(a) * 4)
+    result[0::4] = a.translate(_A_HIGH)
+    result[1::4] = _or(a.translate(_A_LOW), b.translate(_B_HIGH)).translate(_ALPHABET)
+    result[2::4] = _or(b.translate(_B_LOW), c.translate(_C_HIGH)).translate(_ALPHABET)
+    result[3::4] = c.translate(_C_LOW)
+    return result
+
+
+def _decode_groups(values: bytes) -> bytearray:
+    """values are 6 bit numbers of characters, len(values) is a multiple of 4"""
+    v0, v1, v2, v3 = values[0::4], values[1::4], values[2::4], values[3::4]
+    result = bytearray(len(v0) * 3)
+    result[0::3] = _or(v0.translate(_V0), v1.translate(_V1_HIGH))
+    result[1::3] = _or(v1.translate(_V1_LOW), v2.translate(_V2_HIGH))
+    result[2::3] = _or(v2.translate(_V2_LOW), v3)
+    return result
+
+
+def _wrap(encoded: bytearray, line_length: int, line_ending: bytes) -> bytearray:
+    """len(encoded) is a multiple of line_length"""
+    lines = len(encoded) // line_length
+    width = line_length + len(line_ending)
+    result = bytearray(lines * width)
+    # Столбец за столбцом: line_length срезов вместо цикла по строкам
+    for column in range(line_length):
+        result[column::width] = encoded[column::line_length]
+    for column, char in enumerate(line_ending, line_length):
+        result[column::width] = bytes([char]) * lines
+    return result
+
+
+class Encoder:
+    """Incremental encoder. update returns the encoded data given so far in whole lines of line_length
+    characters with line_ending (one line without breaks if line_length is 0), finish returns the rest"""
+
+    def __init__(self, line_length: int = LINE_LENGTH, line_ending: bytes = b'\r\n'):
+        if line_length % 4:
+            raise ValueError('line_length must be a multiple of 4')
+        self.line_length = line_length
+        self.line_ending = line_ending
+        # Сколько входных байт дают одну строку
+        self._unit = line_length // 4 * 3 if line_length else 3
+        self._block = BLOCK // self._unit * self._unit
+        self._pending = b''
+
+    def update(self, data) -> bytes:
+        if self._pending:
+            data = self._pending + data
+        size = len(data) - len(data) % self._unit
+        self._pending = bytes(data[size:])
+        return b''.join(self._encode(data, size))
+
+    def finish(self) -> bytes:
+        data, self._pending = self._pending, b''
+        if not data:
+            return b''
+        tail = len(data) % 3
+        result = _encode_groups(bytes(data) + bytes(-len(data) % 3))
+        if tail:
+            result[len(result) - 3 + tail:] = b'=' * (3 - tail)
+        return bytes(result + self.line_ending) if self.line_length else bytes(result)
+
+    def _encode(self, data, size):
+        for start in range(0, size, self._block):
+            block = data[start:min(size, start + self._block)]
+            if isinstance(block, memoryview):
+                block = block.tobytes()
+            encoded = _encode_groups(block)
+            yield _wrap(encoded, self.line_length, self.line_ending) if self.line_length else encoded
+
+
+class Decoder:
+    """Incremental decoder. Characters out of the alphabet (line breaks, padding) are skipped"""
+
+    def __init__(self):
+        self._pending = b''
+
+    def update(self, data) -> bytes:
+        if isinstance(data, str):
+            data = data.encode('ascii', 'ignore')
+        values = self._pending + bytes(data).translate(_VALUES, _IGNORED)
+        size = len(values) - len(values) % 4
+        self._pending = values[size:]
+        return b''.join(_decode_groups(values[start:min(size, start + BLOCK)]) for start in range(0, size, BLOCK))
+
+    def finish(self) -> bytes:
+        values, self._pending = self._pending, b''
+        # Один лишний символ не несет целого байта, его отбрасываем
+        if len(values) < 2:
+            return b''
+        return bytes(_decode_groups(values + bytes(4 - len(values))))[:len(values) - 1]
+
+
+def encode(data: (bytes, str)) -> bytes:
     if isinstance(data, str):
         data = data.encode('utf8')
-    result = bytearray()
-    for i in range(0, len(data), 3):
-        delta = min(3, len(data) - i)
-        number = bin(int.from_bytes(data[i:i + 3], 'big'))[2:].zfill(8 * delta).ljust(6 * (delta + 1), '0')
-        for j in range(0, len(number), 6):
-            result.append(BASE64_LINE[int(number[j:j+6], 2)])
-        result.extend(b'=' * (3 - delta))
-
-    return bytes(result)
-
-
-def decode(data: bytes):
-    result = bytearray()
-    for i in range(0, len(data), 4):
-        eq_count = (data[i + 3] == EQ_ORD) + (data[i + 2] == EQ_ORD)
-        temp = ''.join(map(lambda x: bin(BASE64_LINE.find(x))[2:].zfill(6), data[i:i + 4].rstrip(b'=')))
-        for j in range(0, 8 * (3 - eq_count), 8):
-            result.append(int(temp[j:j+8], 2))
-    return list(result)
+    encoder = Encoder(0)
+    return encoder.update(data) + encoder.finish()
+
+
+def encode_lines(data: bytes, line_length: int = LINE_LENGTH, line_ending: bytes = b'\r\n') -> bytes:
+    """Body of a base64 MIME part: lines of line_length characters, every one ends with line_ending"""
+    encoder = Encoder(line_length, line_ending)
+    return encoder.update(data) + encoder.finish()
+
+
+def decode(data: (bytes, str)) -> bytes:
+    decoder = Decoder()
+    return decoder.update(data) + decoder.finish()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,157 @@
+"""Multipart message with images as base64 attachments, built as a stream of chunks:
+files are read and encoded block by block while the message is sent, and its size is computed
+from file sizes without encoding them. A binary message carries the files as they are, for servers
+with BINARYMIME that take it by BDAT. Attachments encoded beforehand (cache.Cache) are read ready."""
+import os
+import time
+import typing
+
+import m_base64
+
+FILE_TYPES = {
+    '.jpg': b'image/jpeg',
+    '.jpeg': b'image/jpeg',
+    '.png': b'image/png',
+    '.gif': b'image/gif',
+    '.tiff': b'image/tiff'
+}
+# Кратно 57 байтам строки base64, чтобы кодировщику не приходилось склеивать остатки
+READ_SIZE = m_base64.BLOCK * 4
+# Тело письма уходит в сокет кусками не меньше этого размера
+WRITE_SIZE = 256 * 1024
+
+
+class Attachment(typing.NamedTuple):
+    path: str
+    name: str
+    content_type: bytes
+    size: int
+
+
+def find_images(directory: str) -> list:
+    """Files of FILE_TYPES in the directory, subdirectories are not visited"""
+    attachments = []
+    for name in sorted(next(os.walk(directory))[2]):
+        ext = os.path.splitext(name)[1]
+        if ext in FILE_TYPES:
+            path = os.path.join(directory, name)
+            attachments.append(Attachment(path, name, FILE_TYPES[ext], os.path.getsize(path)))
+    return attachments
+
+
+def encode_word(text: str) -> str:
+    """Non-ASCII header text as an encoded word (RFC 2047)"""
+    return f'=?UTF-8?B?{m_base64.encode(text.encode("utf8")).decode("utf8")}?='
+
+
+def header(sender: str, receiver: str, subject: str) -> bytes:
+    """Header of the message without the final line break, subject is already encoded"""
+    return (f"From: {sender}\r\nTo: {receiver}\r\nSubject: {subject}\r\n"
+            "MIME-Version: 1.0".encode('utf8'))
+
+
+def encoded_size(size: int, line_length: int = m_base64.LINE_LENGTH) -> int:
+    """Length of m_base64.encode_lines of size bytes"""
+    chars = (size + 2) // 3 * 4
+    return chars + 2 * ((chars + line_length - 1) // line_length)
+
+
+class Message:
+    """Body of the message: iterating it yields chunks of bytes, len is the size of all of them.
+    Nothing is read until iteration, and at most one block of one file is kept in memory."""
+
+    def __init__(self, attachments, boundary: str = None, binary: bool = False, encoded=None):
+        self.attachments = list(attachments)
+        self.boundary = (boundary or str(time.time())).encode('utf8')
+        self.binary = binary
+        # Путь вложения -> путь файла с его строками base64 (dict или cache.Pending, который ждет кодирования)
+        self.encoded = encoded if encoded is not None else {}
+
+    def as_binary(self) -> 'Message':
+        """The same message with attachments in Content-Transfer-Encoding: binary"""
+        return Message(self.attachments, self.boundary.decode('utf8'), True)
+
+    def header(self) -> bytes:
+        return b'Content-Type: multipart/mixed; boundary="' + self.boundary + b'"\r\n\r\n'
+
+    def part_header(self, attachment: Attachment) -> bytes:
+        name = attachment.name.encode('utf8')
+        return b''.join([b'--', self.boundary, b'\r\n', b'Content-Disposition: attachment; filename="', name,
+                         b'"\r\nContent-Transfer-Encoding: ', b'binary' if self.binary else b'base64',
+                         b'\r\nContent-Type: ', attachment.content_type,
+                         b'; name="', name, b'"\r\n\r\n'])
+
+    def closing(self) -> bytes:
+        return b'--' + self.boundary + b'--'
+
+    def __len__(self):
+        return (len(self.header()) + len(self.closing())
+                + sum(len(self.part_header(attachment))
+                      + (attachment.size + 2 if self.binary else encoded_size(attachment.size))
+                      for attachment in self.attachments))
+
+    def __iter__(self):
+        yield self.header()
+        for attachment in self.attachments:
+            yield self.part_header(attachment)
+            yield from self.encode(attachment)
+        yield self.closing()
+
+    def encode(self, attachment: Attachment):
+        if self.binary:
+            yield from self.read(attachment)
+            # Граница части начинается с новой строки, в base64 ее дает последняя строка
+            yield b'\r\n'
+            return
+        if attachment.path in self.encoded:
+            yield from self.read(attachment._replace(path=self.encoded[attachment.path]))
+            return
+        encoder = m_base64.Encoder()
+        for block in self.read(attachment):
+            yield encoder.update(block)
+        tail = encoder.finish()
+        if tail:
+            yield tail
+
+    @staticmethod
+    def read(attachment: Attachment):
+        with open(attachment.path, 'rb') as f:
+            while True:
+                block = f.read(READ_SIZE)
+                if not block:
+                    break
+                yield block
+
+
+def coalesce(chunks, size: int = WRITE_SIZE):
+    """Joins small chunks, so the socket gets few large writes instead of many small ones"""
+    buffered, buffered_size = [], 0
+    for chunk in chunks:
+        buffered.append(chunk)
+        buffered_size += len(chunk)
+        if buffered_size >= size:
+            yield b''.join(buffered)
+            buffered, buffered_size = [], 0
+    if buffered:
+        yield b''.join(buffered)
+
+
+class Splitter:
+    """Cuts a stream of chunks into consecutive pieces of given sizes without copying the chunks"""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._rest = memoryview(b'')
+
+    def take(self, limit: int):
+        """Yields the next limit bytes of the stream (less at its end)"""
+        while limit > 0:
+            if not self._rest:
+                chunk = next(self._chunks, None)
+                if chunk is None:
+                    return
+                self._rest = memoryview(chunk)
+                continue
+            piece, self._rest = self._rest[:limit], self._rest[limit:]
+            limit -= len(piece)
+            yield piece
@@ -0,0 +1,98 @@
+"""MX lookup for direct delivery (RFC 5321 §5.1): one DNS query over UDP to the first nameserver of
+/etc/resolv.conf. Mail exchangers are returned best first; a domain without MX records is its own
+implicit MX, so the caller then connects to the domain itself (its A record)."""
+import random
+import socket
+import struct
+
+DNS_PORT = 53
+TYPE_MX = 15
+CLASS_IN = 1
+RCODE_NXDOMAIN = 3
+RESOLV_CONF = '/etc/resolv.conf'
+
+HEADER = struct.Struct('!HHHHHH')
+QUESTION = struct.Struct('!HH')
+RECORD = struct.Struct('!HHIH')
+PREFERENCE = struct.Struct('!H')
+
+
+def nameserver(path: str = RESOLV_CONF):
+    """First nameserver of resolv.conf, None where there is none (Windows)"""
+    try:
+        with open(path, encoding='utf8') as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) >= 2 and fields[0] == 'nameserver':
+                    return fields[1]
+    except OSError:
+        pass
+    return None
+
+
+def query(domain: str, ident: int) -> bytes:
+    labels = b''.join(bytes([len(label)]) + label for label in domain.encode('idna').split(b'.') if label)
+    # Флаг RD: рекурсию делает сервер
+    return HEADER.pack(ident, 0x0100, 1, 0, 0, 0) + labels + b'\0' + QUESTION.pack(TYPE_MX, CLASS_IN)
+
+
+def read_name(data: bytes, offset: int):
+    """Returns the name and the offset after it. Compressed names are pointers into the message"""
+    labels, end = [], None
+    for _ in range(128):
+        length = data[offset]
+        if length >= 0xC0:
+            if end is None:
+                end = offset + 2
+            offset = struct.unpack_from('!H', data, offset)[0] & 0x3FFF
+        elif length:
+            labels.append(data[offset + 1:offset + 1 + length].decode('ascii', 'replace'))
+            offset += 1 + length
+        else:
+            return '.'.join(labels), offset + 1 if end is None else end
+    raise ValueError('DNS name has too many labels')
+
+
+def parse(data: bytes, ident: int) -> list:
+    """Returns [(preference, host)] of the MX records of the answer"""
+    answer_ident, flags, questions, answers, _, _ = HEADER.unpack_from(data)
+    if answer_ident != ident:
+        raise ValueError('DNS answer to another query')
+    if flags & 0xF == RCODE_NXDOMAIN:
+        return []
+    if flags & 0xF:
+        raise OSError(f'DNS server error {flags & 0xF}')
+    offset = HEADER.size
+    for _ in range(questions):
+        offset = read_name(data, offset)[1] + QUESTION.size
+    records = []
+    for _ in range(answers):
+        offset = read_name(data, offset)[1]
+        kind, _, _, length = RECORD.unpack_from(data, offset)
+        offset += RECORD.size
+        if kind == TYPE_MX:
+            records.append((PREFERENCE.unpack_from(data, offset)[0], read_name(data, offset + PREFERENCE.size)[0]))
+        offset += length
+    return records
+
+
+def lookup(domain: str, server: str = None, timeout: float = 2) -> list:
+    """Hosts of the MX records of domain, best first, empty if there are none. A null MX (host ".", RFC 7505)
+    is skipped, so such a domain looks like one without MX. Raises OSError if the nameserver is not known
+    or does not answer"""
+    server = server or nameserver()
+    if server is None:
+        raise OSError('No nameserver to resolve MX records')
+    ident = random.getrandbits(16)
+    with socket.socket(socket.AF_INET6 if ':' in server else socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect((server, DNS_PORT))
+        sock.send(query(domain, ident))
+        while True:
+            try:
+                records = parse(sock.recv(4096), ident)
+                break
+            except (ValueError, struct.error, IndexError):
+                # Чужой или битый ответ: ждем нужный до таймаута
+                continue
+    return [host for _, host in sorted(records) if host]
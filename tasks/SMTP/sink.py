@@ -0,0 +1,199 @@
+"""Local stand-in SMTP server for tests and benchmarks: accepts everything and keeps nothing
+(or saves messages to --save DIRECTORY). It can answer with artificial latency, like a distant server,
+and reject a share of recipients with a transient 451 error. Messages come by DATA or by BDAT chunks.
+
+    python sink.py [--host HOST] [-p PORT] [--latency SECONDS] [--fail-rate SHARE] [--size BYTES]
+                   [--no-pipelining] [--no-chunking] [--save DIRECTORY] [-v]
+"""
+import os
+import sys
+import random
+import signal
+import asyncio
+import argparse
+
+
+class Sink:
+    """Every connection is served by one coroutine that reads commands in order. Answers are not awaited:
+    every one is scheduled latency seconds after its command was read, so pipelined commands get their
+    answers after one latency, and sequential ones pay it for every command."""
+
+    def __init__(self, latency: float = 0, fail_rate: float = 0, size: int = 0, pipelining: bool = True,
+                 directory: str = None, verbose: bool = False, chunking: bool = True):
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.size = size
+        self.pipelining = pipelining
+        self.chunking = chunking
+        self.directory = directory
+        self.verbose = verbose
+
+        self.connections = 0
+        self.messages = 0
+        self.recipients = 0
+        self.rejected = 0
+        self.resets = 0
+        self.chunks = 0
+
+    def extensions(self) -> list:
+        extensions = ['8BITMIME', 'AUTH PLAIN']
+        if self.pipelining:
+            extensions.append('PIPELINING')
+        if self.chunking:
+            extensions += ['CHUNKING', 'BINARYMIME']
+        if self.size:
+            extensions.append(f'SIZE {self.size}')
+        return extensions
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        loop = asyncio.get_running_loop()
+        last = [0.0]
+
+        def answer(text: str, close: bool = False):
+            # Строго возрастающее время сохраняет порядок ответов
+            when = max(loop.time() + self.latency, last[0] + 1e-6)
+            last[0] = when
+            loop.call_at(when, send, (text + '\r\n').encode('utf8'), close)
+
+        def send(data, close):
+            if writer.is_closing():
+                return
+            writer.write(data)
+            if close:
+                writer.close()
+
+        answer('220 sink ESMTP')
+        sender, recipients, chunks = None, [], []
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                command = line.decode('utf8', 'replace').strip()
+                verb = command.split(' ', 1)[0].upper()
+                if self.verbose:
+                    print(f'C: {command}')
+
+                if verb in ('EHLO', 'HELO'):
+                    lines = ['sink'] + self.extensions() if verb == 'EHLO' else ['sink']
+                    answer('\r\n'.join(f'250{" " if i == len(lines) - 1 else "-"}{text}'
+                                       for i, text in enumerate(lines)))
+                elif verb == 'AUTH':
+                    answer('235 2.7.0 Authentication successful')
+                elif verb == 'MAIL':
+                    sender, recipients, chunks = command[10:].strip().split(' ')[0], [], []
+                    answer('250 2.1.0 Ok')
+                elif verb == 'RCPT':
+                    if sender is None:
+                        answer('503 5.5.1 Need MAIL command')
+                    elif self.fail_rate and random.random() < self.fail_rate:
+                        self.rejected += 1
+                        answer('451 4.3.0 Try again later')
+                    else:
+                        recipients.append(command[8:].strip())
+                        answer('250 2.1.5 Ok')
+                elif verb == 'DATA':
+                    if not recipients:
+                        answer('554 5.5.1 No valid recipients')
+                        continue
+                    answer('354 End data with <CR><LF>.<CR><LF>')
+                    message = await self._read_data(reader)
+                    if message is None:
+                        break
+                    self._received(sender, recipients, message)
+                    answer('250 2.0.0 Ok: queued')
+                    sender, recipients = None, []
+                elif verb == 'BDAT' and self.chunking:
+                    # Данные чанка читаются всегда, даже если команда отклонена, иначе они примутся за команды
+                    parts = command.split()
+                    size = int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else 0
+                    chunks.append(await reader.readexactly(size))
+                    self.chunks += 1
+                    if not recipients:
+                        chunks = []
+                        answer('503 5.5.1 No valid recipients')
+                    elif parts[-1].upper() != 'LAST':
+                        answer(f'250 2.0.0 {size} octets received')
+                    else:
+                        self._received(sender, recipients, b''.join(chunks))
+                        answer('250 2.0.0 Ok: queued')
+                        sender, recipients, chunks = None, [], []
+                elif verb == 'RSET':
+                    self.resets += 1
+                    sender, recipients, chunks = None, [], []
+                    answer('250 2.0.0 Ok')
+                elif verb == 'NOOP':
+                    answer('250 2.0.0 Ok')
+                elif verb == 'QUIT':
+                    answer('221 2.0.0 Bye', close=True)
+                    return
+                else:
+                    answer('502 5.5.2 Command not recognized')
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        writer.close()
+
+    @staticmethod
+    async def _read_data(reader):
+        """Message until the line with a single dot, dot stuffing removed. None if the connection is closed"""
+        lines = []
+        while True:
+            line = await reader.readline()
+            if not line:
+                return None
+            if line == b'.\r\n':
+                return b''.join(lines)
+            lines.append(line[1:] if line.startswith(b'.') else line)
+
+    def _received(self, sender, recipients, message: bytes):
+        self.messages += 1
+        self.recipients += len(recipients)
+        if self.verbose:
+            print(f'Message #{self.messages} from {sender} to {", ".join(recipients)}: {len(message)} bytes')
+        if self.directory:
+            with open(os.path.join(self.directory, f'{self.messages}.eml'), 'wb') as f:
+                f.write(message)
+
+    def __str__(self):
+        return (f'connections: {self.connections}, messages: {self.messages}, recipients: {self.recipients}, '
+                f'rejected: {self.rejected}, resets: {self.resets}, chunks: {self.chunks}')
+
+
+async def serve(sink: Sink, host: str, port: int):
+    server = await asyncio.start_server(sink.handle, host, port)
+    async with server:
+        await server.serve_forever()
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Local SMTP server that accepts all messages')
+    parser.add_argument('--host', action='store', default='127.0.0.1')
+    parser.add_argument('-p', '--port', action='store', type=int, default=2525)
+    parser.add_argument('--latency', action='store', type=float, default=0,
+                        help='Seconds before every answer, as a round trip to a distant server')
+    parser.add_argument('--fail-rate', action='store', type=float, default=0,
+                        help='Share of recipients rejected with transient 451')
+    parser.add_argument('--size', action='store', type=int, default=0, help='Advertised SIZE limit')
+    parser.add_argument('--no-pipelining', action='store_true', help='Do not advertise PIPELINING')
+    parser.add_argument('--no-chunking', action='store_true', help='Do not advertise CHUNKING and BINARYMIME')
+    parser.add_argument('--save', action='store', default=None, metavar='DIRECTORY',
+                        help='Save received messages to the directory')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Print commands and messages')
+    args = parser.parse_args(argv[1:])
+
+    sink = Sink(args.latency, args.fail_rate, args.size, not args.no_pipelining, args.save, args.verbose,
+                not args.no_chunking)
+    print(f'Sink listens on {args.host}:{args.port}', flush=True)
+    # kill тоже печатает счетчики
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        asyncio.run(serve(sink, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(sink)
+
+
+if __name__ == "__main__":
+    main(sys.argv)
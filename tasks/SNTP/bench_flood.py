@@ -0,0 +1,127 @@
+"""Latency of a legitimate client while another client floods the server.
+
+FLOODERS processes send FLOOD_RATE requests per second in total from 127.0.0.2 (as fast as they can with 0)
+without reading answers, meanwhile one client on 127.0.0.3 sends a request every INTERVAL seconds and waits
+for the answer. A local server (index.py) is started on --port without the rate limit and then with it,
+the client latency and loss and the server counters are printed for both.
+
+    python bench_flood.py [--port PORT] [-t SECONDS] [-f FLOODERS] [-r FLOOD_RATE] [--interval SECONDS]
+                          [--rate-limit RATE] [--kod]
+"""
+import os
+import sys
+import time
+import socket
+import signal
+import argparse
+import subprocess
+import multiprocessing
+
+from bench_server import percentile
+from client import REQUEST_HEADER
+
+FLOOD_ADDRESS = '127.0.0.2'
+CLIENT_ADDRESS = '127.0.0.3'
+
+
+def flood(address, seconds: float, rate: float):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind((FLOOD_ADDRESS, 0))
+    sock.connect(address)
+    request = REQUEST_HEADER + bytes(8)
+    started = time.monotonic()
+    sent = 0
+    while time.monotonic() < started + seconds:
+        for _ in range(100):
+            try:
+                sock.send(request)
+            except OSError:
+                pass
+        sent += 100
+        if rate:
+            time.sleep(max(0.0, started + sent / rate - time.monotonic()))
+    sock.close()
+    return sent
+
+
+def probe(address, seconds: float, interval: float, timeout: float = 0.5):
+    """Returns (sorted latencies in seconds, lost requests, Kiss-o'-Death answers)"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind((CLIENT_ADDRESS, 0))
+    sock.connect(address)
+    latencies, lost, kisses = [], 0, 0
+    deadline = time.monotonic() + seconds
+    number = 0
+    while time.monotonic() < deadline:
+        number += 1
+        key = number.to_bytes(8, 'big')
+        sent_at = time.perf_counter()
+        sock.send(REQUEST_HEADER + key)
+        while True:
+            left = timeout - (time.perf_counter() - sent_at)
+            if left <= 0:
+                lost += 1
+                break
+            sock.settimeout(left)
+            try:
+                data = sock.recv(1024)
+            except socket.timeout:
+                continue
+            if data[24:32] == key:
+                latencies.append(time.perf_counter() - sent_at)
+                # Kiss-o'-Death: stratum 0 и reference id RATE
+                kisses += data[1] == 0 and data[12:16] == b'RATE'
+                break
+        time.sleep(max(0.0, interval - (time.perf_counter() - sent_at)))
+    sock.close()
+    return sorted(latencies), lost, kisses
+
+
+def measure(name, args, server_args):
+    server = subprocess.Popen([sys.executable, os.path.join(os.path.dirname(__file__) or '.', 'index.py'),
+                               '-p', str(args.port), '--stats-interval', '0', *server_args],
+                              stdout=subprocess.PIPE, text=True)
+    time.sleep(1)
+    address = ('127.0.0.1', args.port)
+    try:
+        with multiprocessing.Pool(args.flooders) as pool:
+            flooded = pool.starmap_async(flood, [(address, args.seconds, args.flood_rate / args.flooders)]
+                                         * args.flooders)
+            time.sleep(0.2)
+            latencies, lost, kisses = probe(address, args.seconds - 0.4, args.interval)
+            sent = sum(flooded.get())
+    finally:
+        server.send_signal(signal.SIGINT)
+        output, _ = server.communicate()
+    counters = output.strip().splitlines()[-1] if output.strip() else ''
+
+    def ms(value):
+        return '-' if value is None else f'{value * 1000:.3f}ms'
+
+    print(f'{name}: flood of {sent / args.seconds:.0f} requests/s')
+    print(f'  client: {len(latencies)} answers ({kisses} KoD), {lost} lost, latency p50 '
+          f'{ms(percentile(latencies, 50))} p90 {ms(percentile(latencies, 90))} '
+          f'p99 {ms(percentile(latencies, 99))} max {ms(latencies[-1] if latencies else None)}')
+    print(f'  server: {counters}')
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Legitimate client latency under a local flood')
+    parser.add_argument('--port', action='store', type=int, default=12300)
+    parser.add_argument('-t', '--seconds', action='store', type=float, default=5)
+    parser.add_argument('-f', '--flooders', action='store', type=int, default=2)
+    parser.add_argument('-r', '--flood-rate', action='store', type=float, default=80000,
+                        help='Flood requests per second of all flooders, 0 - as fast as they can')
+    parser.add_argument('--interval', action='store', type=float, default=0.02,
+                        help='Seconds between requests of the legitimate client')
+    parser.add_argument('--rate-limit', action='store', type=float, default=100)
+    parser.add_argument('--kod', action='store_true')
+    args = parser.parse_args(argv[1:])
+
+    measure('no limit', args, [])
+    measure(f'limit {args.rate_limit:g}/s{" with KoD" if args.kod else ""}', args,
+            ['--rate-limit', str(args.rate_limit)] + (['--kod'] if args.kod else []))
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,92 @@
+"""Offset error of the SNTP server under load: how far the offset computed by a client
+is from the true one, with kernel (SO_TIMESTAMPNS) and user receive timestamps.
+
+Server runs locally with -d OFFSET, so the true offset is known exactly. Load senders keep the server busy,
+a probe sends PROBES requests and computes offset ((T2 - T1) + (T3 - T4)) / 2 from every answer.
+
+    python bench_jitter.py [--port PORT] [--probes N] [--offset SECONDS] [-s SENDERS] [-w WINDOW]
+"""
+import os
+import sys
+import time
+import socket
+import argparse
+import statistics
+import subprocess
+import multiprocessing
+
+import clock
+from client import REQUEST_HEADER
+from bench_server import run, percentile
+
+
+def probe(address, count: int, interval: float):
+    """Returns list of (offset, delay) in nanoseconds"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.settimeout(1)
+    samples = []
+    for _ in range(count):
+        t1 = clock.ntp_time(time.time_ns())
+        sock.sendto(REQUEST_HEADER + t1.to_bytes(8, 'big'), address)
+        try:
+            while True:
+                data = sock.recv(1024)
+                t4 = time.time_ns()
+                # Опоздавший ответ на прошлую пробу пропускаем
+                if int.from_bytes(data[24:32], 'big') == t1:
+                    break
+        except socket.timeout:
+            continue
+        t1 = clock.from_ntp_time(t1)
+        t2 = clock.from_ntp_time(int.from_bytes(data[32:40], 'big'))
+        t3 = clock.from_ntp_time(int.from_bytes(data[40:48], 'big'))
+        samples.append((((t2 - t1) + (t3 - t4)) // 2, (t4 - t1) - (t3 - t2)))
+        time.sleep(interval)
+    sock.close()
+    return samples
+
+
+def measure(port, offset, probes, senders, window, user_timestamps):
+    command = [sys.executable, os.path.join(os.path.dirname(__file__) or '.', 'index.py'), '-p', str(port),
+               '-d', str(offset), '--stats-interval', '0']
+    if user_timestamps:
+        command.append('--user-timestamps')
+    server = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+    time.sleep(1)
+    load = [multiprocessing.Process(target=run, args=(('127.0.0.1', port), 10 ** 9, window))
+            for _ in range(senders)]
+    try:
+        for sender in load:
+            sender.start()
+        time.sleep(0.5)
+        return probe(('127.0.0.1', port), probes, 0.005)
+    finally:
+        for sender in load:
+            sender.terminate()
+        server.terminate()
+        server.wait()
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Offset error of SNTP server under load')
+    parser.add_argument('--port', action='store', type=int, default=12300)
+    parser.add_argument('--probes', action='store', type=int, default=500)
+    parser.add_argument('--offset', action='store', type=int, default=3600, help='-d of the server')
+    parser.add_argument('-s', '--senders', action='store', type=int, default=2, help='Load sender processes')
+    parser.add_argument('-w', '--window', action='store', type=int, default=64, help='Requests in flight '
+                                                                                      'per load sender')
+    args = parser.parse_args(argv[1:])
+
+    print(f'{args.probes} probes, {args.senders} load senders with window {args.window}, true offset {args.offset}s')
+    for name, user_timestamps in (('kernel', False), ('user', True)):
+        samples = measure(args.port, args.offset, args.probes, args.senders, args.window, user_timestamps)
+        errors = [(offset - args.offset * clock.NS) / 1000 for offset, _ in samples]
+        delays = sorted(delay / 1000 for _, delay in samples)
+        absolute = sorted(abs(error) for error in errors)
+        print(f'{name:>6} timestamps: {len(samples)} answers, offset error mean {statistics.mean(errors):.1f}us '
+              f'jitter {statistics.pstdev(errors):.1f}us p99 |error| {percentile(absolute, 99):.1f}us, '
+              f'delay p50 {percentile(delays, 50):.1f}us')
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,89 @@
+"""Encode/decode operations per second of the SNTP packet code,
+compared with the old dict-based SNTP class that parsed the struct format on every pack.
+
+    python bench_packet.py [COUNT]
+"""
+import sys
+import time
+import struct
+import timeit
+
+from sntp import SNTP, Response, TIME_DIFFERENCE, format_time
+
+REQUEST = bytes([0x1b]) + bytes(39) + (0xe3a1b2c3d4e5f607).to_bytes(8, 'big')
+
+
+class LegacySNTP:
+    def __init__(self, version: int = 3, mode: int = 3, transmit: int = 0, raw: bytes = b'',
+                 time_offset: int = 0, **kwargs):
+        self.raw = raw
+        self.time_offset = time_offset
+        self.leap_indicator = 0
+        self.version = version
+        self.mode = mode
+        self.stratum = 0
+        self.poll = 0
+        self.precision = 0
+        self.root_delay = 0
+        self.root_dispersion = 0
+        self.ref_id = 0
+        self.ref_time = 0
+        self.originate_time = 0
+        self.receive_time = 0
+        self.transmit_time = transmit
+
+        for key, value in kwargs.items():
+            setattr(self, key, value)
+
+    @classmethod
+    def request_from_bytes(cls, data: bytes):
+        if len(data) < 48:
+            return LegacySNTP(correct=False)
+        version = (data[0] & 56) >> 3
+        mode = data[0] & 7
+        transmit = int.from_bytes(data[40:48], 'big')
+        if mode != 3:
+            return None
+        return LegacySNTP(version, 4, originate_time=transmit, receive_time=time.time() + TIME_DIFFERENCE)
+
+    def __bytes__(self):
+        first = (self.leap_indicator << 6) | (self.version << 3) | self.mode
+        receive_time = format_time(self.receive_time + self.time_offset)
+        transmit_time = format_time(time.time() + TIME_DIFFERENCE + self.time_offset)
+        return struct.pack('>3Bb5I3Q', first, self.stratum, self.poll, self.precision, 0, 0, 0, 0, 0,
+                           self.originate_time, receive_time, transmit_time)
+
+
+def main(argv):
+    count = int(argv[1]) if len(argv) > 1 else 200000
+    receive_time = time.time() + TIME_DIFFERENCE
+    legacy = LegacySNTP.request_from_bytes(REQUEST)
+    packet = SNTP.request_from_bytes(REQUEST, receive_time)
+    response = Response()
+    answer = response.buffer()
+
+    def template():
+        Response.pack_into(answer, REQUEST, format_time(receive_time),
+                           format_time(time.time() + TIME_DIFFERENCE))
+
+    assert bytes(legacy)[:32] == bytes(packet)[:32]
+    template()
+    assert answer[:40] == bytes(packet)[:40]
+
+    cases = [
+        ('decode', 'legacy request_from_bytes', lambda: LegacySNTP.request_from_bytes(REQUEST)),
+        ('decode', 'slots request_from_bytes', lambda: SNTP.request_from_bytes(REQUEST, receive_time)),
+        ('decode', 'Response.is_request', lambda: Response.is_request(REQUEST)),
+        ('encode', 'legacy bytes()', lambda: bytes(legacy)),
+        ('encode', 'slots bytes()', lambda: bytes(packet)),
+        ('encode', 'template pack_into', template),
+        ('answer', 'legacy decode + encode', lambda: bytes(LegacySNTP.request_from_bytes(REQUEST))),
+        ('answer', 'template', lambda: Response.is_request(REQUEST) and template()),
+    ]
+    for kind, name, function in cases:
+        elapsed = min(timeit.repeat(function, number=count, repeat=3))
+        print(f'{kind:>6} {name:>26}: {count / elapsed:10.0f} ops/s')
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,109 @@
+"""Load generator for the SNTP server: every of SENDERS processes keeps WINDOW requests in flight
+from its own socket, replies per second and reply latency percentiles are printed.
+
+Without --host a local server (index.py) is started on --port for every count of --processes in turn,
+so a single process server can be compared with SO_REUSEPORT workers.
+
+    python bench_server.py [--host HOST] [--port PORT] [-n REQUESTS] [-w WINDOW] [-s SENDERS] [-P N [N ...]]
+"""
+import os
+import sys
+import time
+import argparse
+import multiprocessing
+import subprocess
+
+from client import Client
+
+LOST_AFTER = 1
+
+
+def percentile(sorted_values, percent):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * percent / 100))]
+
+
+def run(address, requests: int, window: int):
+    """Returns (elapsed seconds, sorted latencies in seconds, lost requests)"""
+    client = Client()
+    in_flight = client.pending
+    latencies = []
+    lost = 0
+    sent = 0
+    started = time.perf_counter()
+    while sent < requests or in_flight:
+        while sent < requests and len(in_flight) < window:
+            failed = client.failed
+            if client.send(address):
+                sent += 1
+            elif client.failed > failed:
+                # Запрос не ушел: считаем его потерянным, иначе цикл ждал бы его вечно
+                sent += 1
+                lost += 1
+            else:
+                break
+
+        if client.wait(0.1):
+            latencies.extend((reply.received_ns - reply.sent_ns) / 1e9 for reply in client.receive())
+        lost += len(client.expire(LOST_AFTER))
+
+    elapsed = time.perf_counter() - started
+    client.close()
+    return elapsed, sorted(latencies), lost
+
+
+def load(address, requests: int, window: int, senders: int):
+    """Runs senders in parallel processes. Returns (elapsed seconds, sorted latencies, lost requests)"""
+    if senders == 1:
+        return run(address, requests, window)
+    started = time.perf_counter()
+    with multiprocessing.Pool(senders) as pool:
+        results = pool.starmap(run, [(address, requests // senders, window)] * senders)
+    elapsed = time.perf_counter() - started
+    return elapsed, sorted(l for _, latencies, _ in results for l in latencies), sum(lost for _, _, lost in results)
+
+
+def report(name, elapsed, latencies, lost):
+    def ms(value):
+        return '-' if value is None else f'{value * 1000:.3f}ms'
+
+    print(f'{name}: {len(latencies)} replies, {lost} lost in {elapsed:.2f}s: '
+          f'{len(latencies) / elapsed:.0f} replies/s')
+    print(f'{" " * len(name)}  latency p50 {ms(percentile(latencies, 50))} p90 {ms(percentile(latencies, 90))} '
+          f'p99 {ms(percentile(latencies, 99))} max {ms(latencies[-1] if latencies else None)}')
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Load generator for SNTP server')
+    parser.add_argument('--host', action='store', default=None, help='Server host. Local server is started '
+                                                                      'if it is absent')
+    parser.add_argument('--port', action='store', type=int, default=12300)
+    parser.add_argument('-n', '--requests', action='store', type=int, default=50000)
+    parser.add_argument('-w', '--window', action='store', type=int, default=64, help='Requests in flight '
+                                                                                      'per sender')
+    parser.add_argument('-s', '--senders', action='store', type=int, default=1,
+                        help='Sender processes, each with its own socket')
+    parser.add_argument('-P', '--processes', action='store', type=int, nargs='+', default=[1],
+                        help='Worker processes of the local server, every count is measured in turn')
+    args = parser.parse_args(argv[1:])
+
+    if args.host is not None:
+        report(args.host, *load((args.host, args.port), args.requests, args.window, args.senders))
+        return
+
+    for processes in args.processes:
+        server = subprocess.Popen([sys.executable, os.path.join(os.path.dirname(__file__) or '.', 'index.py'),
+                                   '-p', str(args.port), '-P', str(processes), '--stats-interval', '0'],
+                                  stdout=subprocess.DEVNULL)
+        time.sleep(1)
+        try:
+            result = load(('127.0.0.1', args.port), args.requests, args.window, args.senders)
+        finally:
+            server.terminate()
+            server.wait()
+        report(f'{processes} process{"es" if processes > 1 else ""}', *result)
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,246 @@
+"""SNTP client: asks many servers at once from one non-blocking socket and prints
+offset and delay statistics (RFC 4330) over several rounds.
+
+    python client.py [-n ROUNDS] [-i INTERVAL] [-t TIMEOUT] [-d] HOST[:PORT] [HOST[:PORT] ...]
+"""
+import sys
+import time
+import socket
+import typing
+import argparse
+import selectors
+import statistics
+
+import clock
+from sntp import HEADER, MODE_SERVER, PACKET_SIZE
+
+NTP_PORT = 123
+MAX_STRATUM = 16
+LEAP_ALARM = 3
+# Минимальная ошибка одного обмена, RFC 5905 MINDISP: без нее близкие серверы с дрожанием не пересекаются
+MIN_DISPERSION = 10 ** 7
+REQUEST_HEADER = bytes([0x23]) + bytes(39)  # LI 0, версия 4, режим 3 (клиент)
+
+
+def parse_server(spec: str):
+    host, _, port = spec.partition(':')
+    return host, int(port) if port else NTP_PORT
+
+
+def from_short_time(value: int) -> int:
+    return (value * clock.NS) >> 16
+
+
+class Sample(typing.NamedTuple):
+    """One exchange with a server, times in nanoseconds"""
+    address: str
+    offset: int
+    delay: int
+    stratum: int
+    root_delay: int
+    root_dispersion: int
+
+    @property
+    def distance(self):
+        """Max error of the server time, as root distance of RFC 5905"""
+        return (self.root_delay + self.delay) // 2 + self.root_dispersion + MIN_DISPERSION
+
+
+class Reply(typing.NamedTuple):
+    """Answer matched with its request. Times are local clock nanoseconds of sending and receiving"""
+    address: tuple
+    sent_ns: int
+    received_ns: int
+    data: bytes
+
+    def sample(self):
+        """Sample of the exchange or None if the server is not synchronized or it is Kiss-o'-Death"""
+        first, stratum, _, _, root_delay, root_dispersion, _, _, originate, receive, transmit = \
+            HEADER.unpack_from(self.data)
+        if first >> 6 == LEAP_ALARM or first & 7 != MODE_SERVER or not 0 < stratum < MAX_STRATUM or not transmit:
+            return None
+        # Originate time - наша метка отправки, остальные времена по часам сервера
+        t1 = clock.from_ntp_time(originate)
+        t2 = clock.from_ntp_time(receive)
+        t3 = clock.from_ntp_time(transmit)
+        t4 = t1 + (self.received_ns - self.sent_ns)
+        return Sample(self.address[0], ((t2 - t1) + (t3 - t4)) // 2, max(0, (t4 - t1) - (t3 - t2)), stratum,
+                      from_short_time(root_delay), from_short_time(root_dispersion))
+
+
+class Summary(typing.NamedTuple):
+    """Statistics of the samples of one server over rounds, nanoseconds"""
+    count: int
+    offset: int
+    median_offset: int
+    min_delay: int
+    median_delay: int
+    jitter: int
+    stratum: int
+
+
+def summarize(samples) -> Summary:
+    """Offset of the exchange with the least delay (it is the least distorted by queues),
+    median offset and delay, jitter as standard deviation of offsets"""
+    best = min(samples, key=lambda sample: sample.delay)
+    return Summary(len(samples), best.offset, int(statistics.median(s.offset for s in samples)), best.delay,
+                   int(statistics.median(s.delay for s in samples)),
+                   int(statistics.pstdev(s.offset for s in samples)), best.stratum)
+
+
+class Client:
+    """Keeps any number of requests in flight from one non-blocking UDP socket. Transmit time of the request
+    is its key: the server copies it into originate time, so answers are matched with requests without
+    connected sockets per server; an answer from another address or to an unknown request is dropped."""
+
+    def __init__(self, local_clock: clock.Clock = None):
+        self.clock = local_clock or clock.Clock()
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setblocking(False)
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.sock, selectors.EVENT_READ)
+        # transmit time запроса -> (адрес, время отправки)
+        self.pending = {}
+        # Запросы, которые не ушли из-за ошибки сети (нет маршрута, запрещено, ICMP от прошлого запроса)
+        self.failed = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def send(self, address) -> bool:
+        """Sends a request to the resolved (ip, port) address. Returns False if the socket buffer is full
+        or the request could not be sent (counted in failed), the server is then just not answering"""
+        sent_ns = self.clock.local_ns()
+        key = clock.ntp_time(sent_ns)
+        while key in self.pending:
+            key += 1
+        try:
+            self.sock.sendto(REQUEST_HEADER + key.to_bytes(8, 'big'), address)
+        except BlockingIOError:
+            return False
+        except OSError:
+            self.failed += 1
+            return False
+        self.pending[key] = (address, sent_ns)
+        return True
+
+    def wait(self, timeout: float) -> bool:
+        return bool(self.selector.select(timeout))
+
+    def receive(self) -> list:
+        """Reads all answers that came, returns them as Reply"""
+        replies = []
+        while True:
+            try:
+                data, address = self.sock.recvfrom(1024)
+            except (BlockingIOError, InterruptedError):
+                break
+            except socket.error:
+                # На Windows ICMP ошибка от прошлого запроса приходит как ConnectionResetError
+                continue
+            received_ns = self.clock.local_ns()
+            if len(data) < PACKET_SIZE:
+                continue
+            key = int.from_bytes(data[24:32], 'big')
+            request = self.pending.get(key)
+            if request is None or request[0] != address:
+                continue
+            del self.pending[key]
+            replies.append(Reply(address, request[1], received_ns, data))
+        return replies
+
+    def expire(self, timeout: float) -> list:
+        """Forgets requests sent more than timeout seconds ago, returns their addresses"""
+        deadline = self.clock.local_ns() - int(timeout * clock.NS)
+        expired = [key for key, (_, sent_ns) in self.pending.items() if sent_ns < deadline]
+        return [self.pending.pop(key)[0] for key in expired]
+
+    def query(self, addresses, timeout: float = 1) -> list:
+        """Asks all servers at once. Returns Reply or None for every address"""
+        replies = {}
+        for address in addresses:
+            self.send(address)
+        deadline = time.monotonic() + timeout
+        while self.pending:
+            left = deadline - time.monotonic()
+            if left <= 0:
+                break
+            if self.wait(left):
+                for reply in self.receive():
+                    replies[reply.address] = reply
+        self.pending.clear()
+        return [replies.get(address) for address in addresses]
+
+    def rounds(self, addresses, count: int, interval: float = 0, timeout: float = 1) -> list:
+        """count rounds of query. Returns list of valid samples for every address"""
+        samples = [[] for _ in addresses]
+        for number in range(count):
+            if number and interval:
+                time.sleep(interval)
+            for server, reply in zip(samples, self.query(addresses, timeout)):
+                sample = reply.sample() if reply is not None else None
+                if sample is not None:
+                    server.append(sample)
+        return samples
+
+    def close(self):
+        self.selector.close()
+        self.sock.close()
+
+
+def resolve(servers) -> list:
+    """HOST[:PORT] specs or (host, port) to (ip, port), None for names that are not resolved"""
+    addresses = []
+    for server in servers:
+        host, port = parse_server(server) if isinstance(server, str) else server
+        try:
+            addresses.append((socket.gethostbyname(host), port))
+        except socket.error:
+            addresses.append(None)
+    return addresses
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='SNTP client. Asks all servers at once every round and prints '
+                                                 'offset and delay statistics')
+    parser.add_argument('servers', nargs='+', metavar='HOST[:PORT]')
+    parser.add_argument('-n', '--rounds', action='store', type=int, default=4)
+    parser.add_argument('-i', '--interval', action='store', type=float, default=1,
+                        help='Seconds between rounds')
+    parser.add_argument('-t', '--timeout', action='store', type=float, default=1,
+                        help='Seconds to wait for answers in every round')
+    parser.add_argument('-d', '--details', action='store_true', help='Print every sample')
+    args = parser.parse_args(argv[1:])
+
+    addresses = resolve(args.servers)
+    with Client() as client:
+        samples = client.rounds([address for address in addresses if address], args.rounds, args.interval,
+                                args.timeout)
+
+    def seconds(ns, sign=''):
+        return f'{ns / clock.NS:{sign}.6f}s'
+
+    samples = iter(samples)
+    for server, address in zip(args.servers, addresses):
+        if address is None:
+            print(f'{server}: can not resolve')
+            continue
+        server_samples = next(samples)
+        if not server_samples:
+            print(f'{server}: no answers')
+            continue
+        summary = summarize(server_samples)
+        print(f'{server}: {summary.count}/{args.rounds} answers, stratum {summary.stratum}, '
+              f'offset {seconds(summary.offset, "+")} (median {seconds(summary.median_offset, "+")}), '
+              f'delay min {seconds(summary.min_delay)} median {seconds(summary.median_delay)}, '
+              f'jitter {seconds(summary.jitter)}')
+        if args.details:
+            for sample in server_samples:
+                print(f'    offset {seconds(sample.offset, "+")} delay {seconds(sample.delay)}')
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -1,130 +1,9 @@
-import socket
-import threading
-import sys
 import argparse
-import queue
-import struct
-import time
-import datetime
-
-
-TIME_DIFFERENCE = (datetime.date(1970, 1, 1) - datetime.date(1900, 1, 1)).days * 24 * 3600
-
-
-def format_time(time_):
-    return int(time_ * (2 ** 32))
-
-
-class SNTP:
-    _FORMAT = '!BBBb3I4Q'
-
-    def __init__(self, version: int = 3, mode: int = 3, transmit: int = 0, raw: bytes = b'',
-                 time_offset: int = 0, **kwargs):
-        self.raw = raw
-        self.time_offset = time_offset
-        self.leap_indicator = 0
-        self.version = version
-        self.mode = mode
-        self.stratum = 0
-        self.poll = 0
-        self.precision = 0
-        self.root_delay = 0
-        self.root_dispersion = 0
-        self.ref_id = 0
-        self.ref_time = 0
-        self.originate_time = 0
-        self.receive_time = 0
-        self.transmit_time = transmit
-
-        for key, value in kwargs.items():
-            setattr(self, key, value)
-
-    @classmethod
-    def request_from_bytes(cls, data: bytes):
-        if len(data) < 48:
-            print('incorrect')
-            return SNTP(correct=False)
-        version = (data[0] & 56) >> 3
-        mode = data[0] & 7
-        transmit = int.from_bytes(data[40:48], 'big')
-        if mode != 3:
-            return None
-        return SNTP(version, 4, originate_time=transmit, receive_time=time.time() + TIME_DIFFERENCE)
-
-    def __bytes__(self):
-        first = (self.leap_indicator << 6) | (self.version << 3) | self.mode
-        receive_time = format_time(self.receive_time + self.time_offset)
-        transmit_time = format_time(time.time() + TIME_DIFFERENCE + self.time_offset)
-        return struct.pack('>3Bb5I3Q', first, self.stratum, self.poll, self.precision, 0, 0, 0, 0, 0,
-                           self.originate_time, receive_time, transmit_time)
-
-    def __str__(self):
-        return repr(self)
-
-    def __repr__(self):
-        result = ['SNTP(', ", ".join(map(lambda x: f'{x[0]}={x[1]}', self.__dict__.items())), ')']
-        return ''.join(result)
-
-    def offset_answer(self, time_offset):
-        pass
-
-
-class UdpServer:
-    def __init__(self, server_port: int = 123, time_offset: int = 0, workers: int = 5, timeout: int = 2):
-        self.isWorking = True
-        self.server_port = server_port
-        self.time_offset = time_offset
-
-        self.to_send = queue.Queue()
-        self.received = queue.Queue()
-
-        socket.setdefaulttimeout(timeout)
-        self.server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.server.bind(('', server_port))
-
-        self.receiver = threading.Thread(target=self.receive)
-        self.workers = [threading.Thread(target=self.handle_received) for _ in range(workers)]
-
-    def start(self):
-        print('Server is starting...')
-        for w in self.workers:
-            w.setDaemon(True)
-            w.start()
-        self.receiver.setDaemon(True)
-        self.receiver.start()
-        print(f'Server has started. Listen on port {self.server_port}.\nTime offset: {self.time_offset}s\n')
-
-        while self.isWorking:
-            pass
-
-    def handle_received(self):
-        while self.isWorking:
-            try:
-                sntp, addr = self.received.get(block=False)
-            except queue.Empty:
-                time.sleep(0.5)
-            else:
-                if sntp:
-                    sntp.time_offset = self.time_offset
-                    self.server.sendto(bytes(sntp), addr)
-
-    def receive(self):
-        while self.isWorking:
-            try:
-                data, addr = self.server.recvfrom(1024)
-                self.received.put((SNTP.request_from_bytes(data), addr))
-                print(f'Request:\nIP: {addr[0]}\nPort: {addr[1]}\n')
-            except socket.error:
-                pass
+import os
+import sys
 
-    def stop(self):
-        print('Server is stopping...')
-        self.isWorking = False
-        self.receiver.join()
-        for w in self.workers:
-            w.join()
-        self.server.close()
-        print('Server has stopped')
+from server import UdpServer
+from supervisor import Supervisor
 
 
 def parse_args(args):
@@ -134,6 +13,40 @@ def parse_args(args):
                              'Can be position or negative number')
     parser.add_argument('-p', '--port', action='store', type=int, default=123, help='Server port. If port before 1024 '
                                                                                     'requires root user')
+    parser.add_argument('--batch', action='store', type=int, default=64,
+                        help='Max datagrams read from the socket at one wakeup')
+    parser.add_argument('--log-sample', action='store', type=int, default=0,
+                        help='Print every N-th request. By default requests are only counted')
+    parser.add_argument('--stats-interval', action='store', type=float, default=10,
+                        help='Print request counters every N seconds, 0 disables it')
+    parser.add_argument('--user-timestamps', action='store_true',
+                        help='Take receive time after the read instead of kernel timestamps (SO_TIMESTAMPNS)')
+    parser.add_argument('--no-sendmmsg', action='store_true',
+                        help='Send every answer with its own sendto right after its transmit time is taken, '
+                             'instead of one sendmmsg per batch')
+    parser.add_argument('-u', '--upstream', action='append', default=None, metavar='HOST[:PORT]',
+                        help='Synchronize with this NTP server, may be given several times. Offset is selected '
+                             'over all servers by majority and median.')
+    parser.add_argument('--sync-interval', action='store', type=float, default=64,
+                        help='Seconds between synchronizations with upstream servers')
+    parser.add_argument('--rate-limit', action='store', type=float, default=0, metavar='RATE',
+                        help='Requests per second allowed from one client ip, excess requests are dropped. '
+                             '0 disables the limit. With -P it holds per client on Linux, elsewhere per process')
+    parser.add_argument('--burst', action='store', type=float, default=None,
+                        help='Requests one client ip may send at once above the rate limit. RATE by default')
+    parser.add_argument('--kod', action='store_true',
+                        help="Answer limited clients with Kiss-o'-Death RATE instead of dropping requests")
+    parser.add_argument('--max-clients', action='store', type=int, default=65536,
+                        help='Client ips remembered by the rate limiter, the least recent are forgotten')
+    parser.add_argument('--receive-buffer', action='store', type=int, default=0, metavar='BYTES',
+                        help='Socket receive buffer size, bounds the queue of requests waiting to be read. '
+                             'System default if absent')
+    parser.add_argument('--metrics', action='store', default=None, metavar='HOST:PORT|PATH',
+                        help='Serve counters and answer time histogram in Prometheus text format over HTTP '
+                             'on this address, or on a UNIX socket if a path is given')
+    parser.add_argument('-P', '--processes', action='store', type=int, nargs='?', const=os.cpu_count(), default=1,
+                        help='Serve from N processes on the same port with SO_REUSEPORT (CPU count if N is '
+                             'omitted). Dead processes are restarted. Linux and BSD only.')
     args = parser.parse_args(args)
 
     if args.port < 1 or args.port > 65535:
@@ -145,11 +58,28 @@ def parse_args(args):
 
 def main(argv):
     args = parse_args(argv[1:])
-    server = UdpServer(args.port, args.time, workers=10)
+    options = dict(kernel_timestamps=not args.user_timestamps, send_batch=not args.no_sendmmsg,
+                   upstream_servers=args.upstream,
+                   sync_interval=args.sync_interval, rate_limit=args.rate_limit, burst=args.burst, kod=args.kod,
+                   max_clients=args.max_clients, receive_buffer=args.receive_buffer)
+    if args.processes > 1:
+        try:
+            server = Supervisor(args.port, args.time, args.processes, args.stats_interval, args.metrics,
+                                batch=args.batch, log_sample=args.log_sample, **options)
+        except OSError as e:
+            print(f'Can not start server: {e}', file=sys.stderr)
+            exit(2)
+    else:
+        server = UdpServer(args.port, args.time, args.batch, args.log_sample, args.stats_interval,
+                           metrics_address=args.metrics, **options)
     try:
         server.start()
     except KeyboardInterrupt:
         pass
+    except OSError as e:
+        # Например, путь --metrics занят обычным файлом
+        print(f'Server error: {e}', file=sys.stderr)
+        exit(2)
     finally:
         server.stop()
 
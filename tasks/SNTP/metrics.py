@@ -0,0 +1,98 @@
+import os
+import stat
+import threading
+import socketserver
+import http.server
+
+import clock
+
+# Границы корзин гистограммы времени от приема запроса до отправки ответа, наносекунды
+LATENCY_BOUNDS_NS = [bound * 1000 for bound in (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 25000, 100000)]
+
+DESCRIPTIONS = {
+    'received': 'Datagrams read from the socket',
+    'answered': 'Requests answered',
+    'ignored': 'Datagrams that are not client requests',
+    'batches': 'Wakeups of the server loop that read datagrams',
+    'limited': 'Requests over the rate limit of the client',
+    'kod': "Kiss-o'-Death RATE answers",
+    'overflow': 'Datagrams dropped by the kernel because the socket receive buffer was full',
+}
+
+
+def render(counters: dict, buckets, latency_sum_ns: int, gauges: dict = None) -> str:
+    """Prometheus text format. buckets are not cumulative counts per LATENCY_BOUNDS_NS plus the last one
+    for larger values, gauges are name -> (help, value)"""
+    lines = []
+    for name, value in counters.items():
+        lines += [f'# HELP sntp_{name}_total {DESCRIPTIONS.get(name, name)}', f'# TYPE sntp_{name}_total counter',
+                  f'sntp_{name}_total {value}']
+
+    lines += ['# HELP sntp_response_seconds Time from receiving a request to sending its answer',
+              '# TYPE sntp_response_seconds histogram']
+    total = 0
+    for bound, count in zip(LATENCY_BOUNDS_NS + [None], buckets):
+        total += count
+        le = '+Inf' if bound is None else f'{bound / clock.NS:g}'
+        lines.append(f'sntp_response_seconds_bucket{{le="{le}"}} {total}')
+    lines += [f'sntp_response_seconds_sum {latency_sum_ns / clock.NS:.9f}', f'sntp_response_seconds_count {total}']
+
+    for name, (description, value) in (gauges or {}).items():
+        lines += [f'# HELP sntp_{name} {description}', f'# TYPE sntp_{name} gauge', f'sntp_{name} {value}']
+    return '\n'.join(lines) + '\n'
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.server.collect().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _TcpServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class MetricsServer:
+    """HTTP endpoint with metrics in Prometheus text format, served from a background thread.
+    address is HOST:PORT or a path of a UNIX socket (curl --unix-socket PATH http://localhost/metrics).
+    collect returns the text; it only reads counters of the server, so the request path takes no locks."""
+
+    def __init__(self, address: str, collect):
+        self.address = address
+        if '/' in address:
+            if os.path.exists(address):
+                # Удаляем только сокет, оставшийся от прошлого запуска: опечатка в пути не должна стереть файл
+                if not stat.S_ISSOCK(os.stat(address).st_mode):
+                    raise OSError(f'{address} exists and is not a socket')
+                os.unlink(address)
+            self.server = _UnixServer(address, _Handler)
+        else:
+            host, _, port = address.rpartition(':')
+            self.server = _TcpServer((host or '127.0.0.1', int(port)), _Handler)
+        self.server.collect = collect
+        self._thread = threading.Thread(target=self.server.serve_forever, args=(0.5,))
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        if self._thread.is_alive():
+            self.server.shutdown()
+        self.server.server_close()
+        if isinstance(self.server, _UnixServer) and os.path.exists(self.address):
+            os.unlink(self.address)
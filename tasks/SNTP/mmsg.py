@@ -0,0 +1,111 @@
+"""sendmmsg(2) through ctypes: the answers of a batch leave in one system call instead of a sendto each.
+Python has no binding for it and it is Linux only, so BatchSender checks that libc has it and is used only
+then; without it the server sends every answer with sendto."""
+import sys
+import errno
+import socket
+import struct
+import ctypes
+import ctypes.util
+
+SOCKADDR_IN = struct.Struct('!H4s8x')
+SOCKADDR_SIZE = 16
+
+
+class _IoVec(ctypes.Structure):
+    _fields_ = [('iov_base', ctypes.c_void_p), ('iov_len', ctypes.c_size_t)]
+
+
+class _MsgHdr(ctypes.Structure):
+    _fields_ = [('msg_name', ctypes.c_void_p), ('msg_namelen', ctypes.c_uint32),
+                ('msg_iov', ctypes.POINTER(_IoVec)), ('msg_iovlen', ctypes.c_size_t),
+                ('msg_control', ctypes.c_void_p), ('msg_controllen', ctypes.c_size_t),
+                ('msg_flags', ctypes.c_int)]
+
+
+class _MMsgHdr(ctypes.Structure):
+    _fields_ = [('msg_hdr', _MsgHdr), ('msg_len', ctypes.c_uint)]
+
+
+def _load_sendmmsg():
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or None, use_errno=True)
+        function = libc.sendmmsg
+    except (OSError, AttributeError):
+        return None
+    function.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int]
+    function.restype = ctypes.c_int
+    return function
+
+
+_sendmmsg = _load_sendmmsg()
+
+
+def available() -> bool:
+    return _sendmmsg is not None
+
+
+class BatchSender:
+    """Datagrams from fixed buffers (the answer slots of the server) to IPv4 addresses. add puts the buffer
+    of a slot into the batch, flush sends the batch. The message headers point into the buffers once,
+    per datagram only the address is packed."""
+
+    def __init__(self, sock, buffers):
+        self.sock = sock
+        self.buffers = buffers
+        count = len(buffers)
+        self._names = ctypes.create_string_buffer(SOCKADDR_SIZE * count)
+        self._iovecs = (_IoVec * count)()
+        self._headers = (_MMsgHdr * count)()
+        # Буферы слотов не меняют размер, поэтому на них можно один раз взять указатели
+        self._views = [(ctypes.c_char * len(buffer)).from_buffer(buffer) for buffer in buffers]
+        for i, view in enumerate(self._views):
+            self._iovecs[i].iov_base = ctypes.addressof(view)
+            self._iovecs[i].iov_len = len(buffers[i])
+        # i-я датаграмма пачки берет адрес из i-го sockaddr_in
+        self._name_pointers = [ctypes.addressof(self._names) + i * SOCKADDR_SIZE for i in range(count)]
+        for header in self._headers:
+            header.msg_hdr.msg_namelen = SOCKADDR_SIZE
+            header.msg_hdr.msg_iovlen = 1
+        self._iov_pointers = [ctypes.pointer(iovec) for iovec in self._iovecs]
+        self._family = struct.pack('=H', socket.AF_INET)
+        self._slots = []
+
+    def add(self, slot: int, addr):
+        """Only IPv4 addresses: the server socket is AF_INET"""
+        position = len(self._slots)
+        offset = position * SOCKADDR_SIZE
+        self._names[offset:offset + SOCKADDR_SIZE] = self._family + SOCKADDR_IN.pack(addr[1],
+                                                                                     socket.inet_aton(addr[0]))
+        # _skip сдвигает заголовки вместе с указателями, поэтому оба указателя ставятся заново каждый раз
+        header = self._headers[position].msg_hdr
+        header.msg_name = self._name_pointers[position]
+        header.msg_iov = self._iov_pointers[slot]
+        self._slots.append(slot)
+
+    def flush(self) -> int:
+        """Sends the batch, returns how many datagrams left. The rest of a partially sent batch is sent
+        again; datagrams refused with an error are dropped, as a failed sendto"""
+        total, sent = len(self._slots), 0
+        fd, base, size = self.sock.fileno(), ctypes.addressof(self._headers), ctypes.sizeof(_MMsgHdr)
+        while sent < total:
+            result = _sendmmsg(fd, base + sent * size, total - sent, 0)
+            if result > 0:
+                sent += result
+                continue
+            # Ошибка относится к первой датаграмме оставшейся части: пропускаем ее и идем дальше
+            if ctypes.get_errno() == errno.EINTR:
+                continue
+            total -= 1
+            self._skip(sent)
+        self._slots.clear()
+        return sent
+
+    def _skip(self, index: int):
+        """Removes the header at index from the batch by moving the next ones down"""
+        size = ctypes.sizeof(_MMsgHdr)
+        base = ctypes.addressof(self._headers)
+        ctypes.memmove(base + index * size, base + (index + 1) * size, (len(self._slots) - index - 1) * size)
+        del self._slots[index]
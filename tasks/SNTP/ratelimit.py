@@ -0,0 +1,46 @@
+import collections
+
+from clock import NS
+
+
+class ClientLimiter:
+    """Token bucket per client ip. Buckets live in an LRU of max_clients entries, so a flood from many
+    addresses can not grow memory: the least recently seen client is forgotten and starts with a full bucket.
+    Also remembers when the client got the last Kiss-o'-Death, to send at most one per kod_interval."""
+
+    def __init__(self, rate: float, burst: float = None, max_clients: int = 65536, kod_interval: float = 1):
+        self.rate = rate
+        self.burst = burst if burst else max(1.0, rate)
+        self.max_clients = max_clients
+        self.kod_interval_ns = int(kod_interval * NS)
+        # ip -> [токены, время последнего пополнения, время последнего KoD]
+        self._clients = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._clients)
+
+    def allow(self, ip: str, now_ns: int) -> bool:
+        client = self._clients.get(ip)
+        if client is None:
+            if len(self._clients) >= self.max_clients:
+                self._clients.popitem(last=False)
+            self._clients[ip] = [self.burst - 1, now_ns, 0]
+            return True
+
+        self._clients.move_to_end(ip)
+        tokens = min(self.burst, client[0] + (now_ns - client[1]) * self.rate / NS)
+        client[1] = now_ns
+        if tokens >= 1:
+            client[0] = tokens - 1
+            return True
+        client[0] = tokens
+        return False
+
+    def kiss(self, ip: str, now_ns: int) -> bool:
+        """Whether the limited client should get Kiss-o'-Death now. KoD are limited too,
+        otherwise a spoofed flood would make the server reflect one answer per request"""
+        client = self._clients.get(ip)
+        if client is None or now_ns - client[2] < self.kod_interval_ns:
+            return False
+        client[2] = now_ns
+        return True
@@ -0,0 +1,275 @@
+import sys
+import time
+import socket
+import struct
+import bisect
+import selectors
+
+import math
+
+import clock
+import mmsg
+import metrics
+import upstream
+from ratelimit import ClientLimiter
+from sntp import Response
+
+
+# Python не экспортирует SO_RXQ_OVFL, 40 - значение из asm-generic/socket.h
+SO_RXQ_OVFL = getattr(socket, 'SO_RXQ_OVFL', 40 if sys.platform.startswith('linux') else None)
+DROPS = struct.Struct('@I')
+# Место под timespec из SO_TIMESTAMPNS и счетчик потерь из SO_RXQ_OVFL
+TIMESTAMP_SIZE = socket.CMSG_SPACE(clock.TIMESPEC.size) if hasattr(socket, 'CMSG_SPACE') else 0
+OVERFLOW_SIZE = socket.CMSG_SPACE(DROPS.size) if hasattr(socket, 'CMSG_SPACE') else 0
+
+
+def enable_overflow(sock) -> bool:
+    """Asks the kernel to attach to every datagram the count of datagrams dropped because
+    the receive buffer was full (SO_RXQ_OVFL). Returns False if the platform can not do it"""
+    if SO_RXQ_OVFL is None or not hasattr(sock, 'recvmsg_into'):
+        return False
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, SO_RXQ_OVFL, 1)
+    except OSError:
+        return False
+    return True
+
+
+def dropped(ancdata):
+    """Datagrams dropped by the socket since it was opened from recvmsg ancillary data or None"""
+    for level, kind, data in ancdata:
+        if level == socket.SOL_SOCKET and kind == SO_RXQ_OVFL and len(data) >= DROPS.size:
+            return DROPS.unpack_from(data)[0]
+    return None
+
+
+def render(snapshot, gauges: dict) -> str:
+    """Prometheus text of UdpServer.snapshot()"""
+    count = len(UdpServer.COUNTERS)
+    return metrics.render(dict(zip(UdpServer.COUNTERS, snapshot)), snapshot[count:-1], snapshot[-1], gauges)
+
+
+def describe(counters) -> str:
+    return ', '.join(f'{name}: {value}' for name, value in zip(UdpServer.COUNTERS[1:], counters[1:]))
+
+
+class UdpServer:
+    """Serves requests from one thread without queues: selector wakes the loop up when datagrams come,
+    all queued datagrams are read at once into preallocated buffers, then the answers are patched into
+    preallocated copies of the Response template and sent.
+    With upstream servers the clock is synchronized with them by Upstream in a background thread, answers carry
+    its stratum, reference id and dispersion; without them the local clock is served as stratum 1 (LOCL).
+    Receive time is stamped by the kernel (SO_TIMESTAMPNS) when the datagram arrives, or right after the read
+    where it is not supported. Both times come from Clock, integer ns. Answers of a batch are sent with one
+    sendmmsg where libc has it (send_batch), transmit time is then taken when the answer is packed, before
+    the flush; else every answer is sent with sendto right after its transmit time.
+    Excess requests of one client ip are limited by ClientLimiter: dropped, or answered with Kiss-o'-Death RATE
+    (at most one per second per client) with kod. There is no queue in userspace: the only ingress queue is
+    the socket receive buffer (its size is receive_buffer), datagrams that do not fit are dropped by the kernel
+    and counted as overflow.
+    Requests are not printed one by one: counters are printed every stats_interval seconds
+    and only every log_sample-th request is printed. Counters and the histogram of time from receiving a request
+    to sending its answer are plain attributes of the server, with metrics address they are served
+    in Prometheus text format by MetricsServer."""
+
+    COUNTERS = ('received', 'answered', 'ignored', 'batches', 'limited', 'kod', 'overflow')
+    # Счетчики, корзины гистограммы и сумма времени ответа
+    SNAPSHOT_SIZE = len(COUNTERS) + len(metrics.LATENCY_BOUNDS_NS) + 2
+
+    def __init__(self, server_port: int = 123, time_offset: int = 0, batch: int = 64, log_sample: int = 0,
+                 stats_interval: float = 10, reuse_port: bool = False, kernel_timestamps: bool = True,
+                 upstream_servers=None, sync_interval: float = 64, rate_limit: float = 0, burst: float = None,
+                 kod: bool = False, max_clients: int = 65536, receive_buffer: int = 0, metrics_address: str = None,
+                 send_batch: bool = True):
+        self.isWorking = True
+        self.server_port = server_port
+        self.time_offset = time_offset
+        self.log_sample = log_sample
+        self.stats_interval = stats_interval
+
+        self.received = 0
+        self.answered = 0
+        self.ignored = 0
+        self.batches = 0
+        self.limited = 0
+        self.kod = 0
+        self.overflow = 0
+        self.latency = [0] * (len(metrics.LATENCY_BOUNDS_NS) + 1)
+        self.latency_sum = 0
+        self.metrics_address = metrics_address
+
+        self.clock = clock.Clock(time_offset * clock.NS)
+        self.upstream = upstream.Upstream(upstream_servers, self.clock, sync_interval) if upstream_servers else None
+        self.poll = max(0, round(math.log2(sync_interval)))
+        self.precision = upstream.precision()
+        self.started_ns = self.clock.now_ns()
+
+        self._buffers = [memoryview(bytearray(1024)) for _ in range(batch)]
+        self._answers = [bytearray(Response().template) for _ in range(batch)]
+        self._batch = []
+        self.limiter = ClientLimiter(rate_limit, burst, max_clients) if rate_limit > 0 else None
+        self.send_kod = kod
+        self._kod = bytearray(Response(leap=3, poll=self.poll, precision=self.precision,
+                                      ref_id=int.from_bytes(b'RATE', 'big')).template)
+        self._reference = (None, 0)
+        self._refresh_response()
+
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if reuse_port:
+            # Несколько процессов на одном порту, ядро распределяет датаграммы между ними
+            self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        if receive_buffer:
+            self.server.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, receive_buffer)
+        self.server.bind(('', server_port))
+        self.server.setblocking(False)
+        self.kernel_timestamps = kernel_timestamps and clock.enable_timestamps(self.server)
+        self.count_overflow = enable_overflow(self.server)
+        self._ancillary = ((TIMESTAMP_SIZE if self.kernel_timestamps else 0)
+                           + (OVERFLOW_SIZE if self.count_overflow else 0))
+        self._sender = mmsg.BatchSender(self.server, self._answers) if send_batch and mmsg.available() else None
+
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.server, selectors.EVENT_READ, self.receive)
+
+    def start(self):
+        print('Server is starting...')
+        print(f'Server has started. Listen on port {self.server_port}.\nTime offset: {self.time_offset}s\n'
+              f'Receive timestamps: {"kernel" if self.kernel_timestamps else "user"}\n'
+              f'Send: {"sendmmsg per batch" if self._sender is not None else "sendto per answer"}\n')
+        self.serve()
+
+    def serve(self):
+        exporter = metrics.MetricsServer(self.metrics_address, self.prometheus) if self.metrics_address else None
+        if exporter:
+            exporter.start()
+        if self.upstream:
+            self.upstream.start()
+        try:
+            self._serve()
+        finally:
+            if self.upstream:
+                self.upstream.stop()
+            if exporter:
+                exporter.stop()
+
+    def _serve(self):
+        reported_at, reported = time.monotonic(), 0
+        while self.isWorking:
+            # Таймаут нужен чтобы заметить stop() из другого потока и напечатать счетчики
+            for key, _ in self.selector.select(0.5):
+                key.data(key.fileobj)
+
+            now = time.monotonic()
+            if self.upstream and (self.upstream.version != self._reference[0] or now - self._reference[1] >= 1):
+                self._refresh_response()
+            if self.stats_interval > 0 and now - reported_at >= self.stats_interval:
+                print(f'Requests: {self.received} ({(self.received - reported) / (now - reported_at):.0f}/s), '
+                      f'{describe(self.counters())}')
+                reported_at, reported = now, self.received
+
+    def receive(self, sock):
+        batch = self._batch
+        now_ns = self.clock.now_ns
+        kernel = self.kernel_timestamps
+        ancillary = self._ancillary
+        ancdata = None
+        for buffer in self._buffers:
+            try:
+                if ancillary:
+                    size, ancdata, _, addr = sock.recvmsg_into([buffer], ancillary)
+                    batch.append((buffer[:size], addr, clock.kernel_timestamp(ancdata) if kernel else now_ns()))
+                else:
+                    size, addr = sock.recvfrom_into(buffer)
+                    batch.append((buffer[:size], addr, now_ns()))
+            except (BlockingIOError, InterruptedError):
+                break
+            except socket.error:
+                continue
+        if not batch:
+            return
+
+        self.batches += 1
+        if ancdata and self.count_overflow:
+            # Счетчик ядра растет с открытия сокета, в последней датаграмме он самый свежий
+            self.overflow = dropped(ancdata) or self.overflow
+        limiter = self.limiter
+        latency = self.latency
+        bounds = metrics.LATENCY_BOUNDS_NS
+        # Метки ядра - системное время, переводим их в шкалу Clock одной поправкой на пачку
+        correction = self.clock.realtime_correction() if kernel else 0
+        sender = self._sender
+        flushed = []
+        for slot, ((data, addr, receive_ns), answer) in enumerate(zip(batch, self._answers)):
+            self.received += 1
+            if self.log_sample and self.received % self.log_sample == 0:
+                print(f'Request #{self.received}:\nIP: {addr[0]}\nPort: {addr[1]}\n')
+            if not Response.is_request(data):
+                self.ignored += 1
+                continue
+            receive_ns = receive_ns + correction if receive_ns is not None else now_ns()
+            if limiter is not None and not limiter.allow(addr[0], receive_ns):
+                self.limited += 1
+                if self.send_kod and limiter.kiss(addr[0], receive_ns):
+                    self._send_kod(sock, data, addr, receive_ns)
+                continue
+            transmit_ns = now_ns()
+            Response.pack_into(answer, data, clock.ntp_time(receive_ns), clock.ntp_time(transmit_ns))
+            if sender is not None:
+                sender.add(slot, addr)
+                flushed.append(receive_ns)
+                continue
+            try:
+                sock.sendto(answer, addr)
+            except socket.error:
+                continue
+            self.answered += 1
+            latency[bisect.bisect_left(bounds, transmit_ns - receive_ns)] += 1
+            self.latency_sum += transmit_ns - receive_ns
+        batch.clear()
+        if flushed:
+            self.answered += sender.flush()
+            # Время ответа - до отправки всей пачки
+            sent_ns = now_ns()
+            for receive_ns in flushed:
+                latency[bisect.bisect_left(bounds, sent_ns - receive_ns)] += 1
+                self.latency_sum += sent_ns - receive_ns
+
+    def _send_kod(self, sock, request, addr, receive_ns):
+        """Kiss-o'-Death RATE: the client should increase its poll interval or stop (RFC 4330)"""
+        Response.pack_into(self._kod, request, clock.ntp_time(receive_ns), clock.ntp_time(self.clock.now_ns()))
+        try:
+            sock.sendto(self._kod, addr)
+        except socket.error:
+            return
+        self.kod += 1
+
+    def _refresh_response(self):
+        """Packs reference fields into the template. With upstream it is done after every synchronization
+        and once a second, because root dispersion grows with time"""
+        if self.upstream:
+            self._reference = (self.upstream.version, time.monotonic())
+            fields = self.upstream.reference()
+        else:
+            fields = {'stratum': 1, 'ref_id': int.from_bytes(b'LOCL', 'big'),
+                      'ref_time': clock.ntp_time(self.started_ns)}
+        self.response = Response(poll=self.poll, precision=self.precision, **fields)
+        for answer in self._answers:
+            answer[:] = self.response.template
+
+    def counters(self):
+        return tuple(getattr(self, name) for name in self.COUNTERS)
+
+    def snapshot(self):
+        """Counters, histogram buckets and sum of answer times in one flat tuple, the form workers share them"""
+        return self.counters() + tuple(self.latency) + (self.latency_sum,)
+
+    def prometheus(self) -> str:
+        return render(self.snapshot(), {'uptime_seconds': ('Seconds since the server started',
+                                                           (self.clock.now_ns() - self.started_ns) / clock.NS)})
+
+    def stop(self):
+        print('Server is stopping...')
+        self.isWorking = False
+        self.selector.close()
+        self.server.close()
+        print(f'Server has stopped. Requests: {self.received}, {describe(self.counters())}')
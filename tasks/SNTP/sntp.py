@@ -0,0 +1,94 @@
+import struct
+import time
+import datetime
+
+
+TIME_DIFFERENCE = (datetime.date(1970, 1, 1) - datetime.date(1900, 1, 1)).days * 24 * 3600
+
+PACKET_SIZE = 48
+MODE_CLIENT = 3
+MODE_SERVER = 4
+
+# Формат разбирается один раз при импорте, а не при каждой упаковке
+HEADER = struct.Struct('!BBBb3I4Q')
+# receive и transmit time ответа, идут подряд с 32 байта
+TIMESTAMPS = struct.Struct('!2Q')
+
+
+def format_time(time_):
+    return int(time_ * (2 ** 32))
+
+
+class SNTP:
+    __slots__ = ('time_offset', 'leap_indicator', 'version', 'mode', 'stratum', 'poll', 'precision', 'root_delay',
+                 'root_dispersion', 'ref_id', 'ref_time', 'originate_time', 'receive_time', 'transmit_time')
+
+    def __init__(self, version: int = 3, mode: int = 3, transmit: int = 0, time_offset: int = 0,
+                 originate_time: int = 0, receive_time: float = 0):
+        self.time_offset = time_offset
+        self.leap_indicator = 0
+        self.version = version
+        self.mode = mode
+        self.stratum = 0
+        self.poll = 0
+        self.precision = 0
+        self.root_delay = 0
+        self.root_dispersion = 0
+        self.ref_id = 0
+        self.ref_time = 0
+        self.originate_time = originate_time
+        self.receive_time = receive_time
+        self.transmit_time = transmit
+
+    @classmethod
+    def request_from_bytes(cls, data: bytes, receive_time: float = None):
+        """receive_time in NTP era seconds, should be taken as soon as the datagram is read.
+        Returns None if data is not a client request"""
+        if receive_time is None:
+            receive_time = time.time() + TIME_DIFFERENCE
+        if len(data) < PACKET_SIZE or data[0] & 7 != MODE_CLIENT:
+            return None
+        version = (data[0] & 56) >> 3
+        transmit = int.from_bytes(data[40:48], 'big')
+        return SNTP(version, MODE_SERVER, originate_time=transmit, receive_time=receive_time)
+
+    def __bytes__(self):
+        first = (self.leap_indicator << 6) | (self.version << 3) | self.mode
+        receive_time = format_time(self.receive_time + self.time_offset)
+        transmit_time = format_time(time.time() + TIME_DIFFERENCE + self.time_offset)
+        return HEADER.pack(first, self.stratum, self.poll, self.precision, self.root_delay, self.root_dispersion,
+                           self.ref_id, self.ref_time, self.originate_time, receive_time, transmit_time)
+
+    def __str__(self):
+        return repr(self)
+
+    def __repr__(self):
+        result = ['SNTP(', ", ".join(f'{name}={getattr(self, name)}' for name in self.__slots__), ')']
+        return ''.join(result)
+
+
+class Response:
+    """Server answer without objects per request. Fields that are the same for every answer are packed once
+    into the template; answer buffers are copies of it, where only version, originate, receive and transmit
+    times are patched in place."""
+
+    def __init__(self, leap: int = 0, stratum: int = 0, poll: int = 0, precision: int = 0, root_delay: int = 0,
+                 root_dispersion: int = 0, ref_id: int = 0, ref_time: int = 0):
+        self.template = HEADER.pack((leap << 6) | MODE_SERVER, stratum, poll, precision, root_delay,
+                                    root_dispersion, ref_id, ref_time, 0, 0, 0)
+
+    def buffer(self) -> bytearray:
+        return bytearray(self.template)
+
+    @staticmethod
+    def is_request(data) -> bool:
+        return len(data) >= PACKET_SIZE and data[0] & 7 == MODE_CLIENT
+
+    @staticmethod
+    def pack_into(buffer: bytearray, request, receive_time: int, transmit_time: int):
+        """Makes buffer an answer to the request. Times are NTP timestamps (see format_time)"""
+        # Версия клиента, LI и режим из шаблона
+        buffer[0] = (buffer[0] & 0xc7) | (request[0] & 56)
+        # Originate time - байты transmit time запроса как есть
+        buffer[24:32] = request[40:48]
+        TIMESTAMPS.pack_into(buffer, 32, receive_time, transmit_time)
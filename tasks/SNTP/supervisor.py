@@ -0,0 +1,197 @@
+import os
+import sys
+import time
+import ctypes
+import socket
+import signal
+import struct
+import multiprocessing
+
+import metrics
+from server import UdpServer, describe, render
+
+RESTART_DELAY = 1
+# Сколько ждать воркер после SIGTERM, потом SIGKILL
+STOP_TIMEOUT = 5
+# Python не экспортирует SO_ATTACH_REUSEPORT_CBPF, 51 - значение из asm-generic/socket.h
+SO_ATTACH_REUSEPORT_CBPF = getattr(socket, 'SO_ATTACH_REUSEPORT_CBPF',
+                                   51 if sys.platform.startswith('linux') else None)
+# Классический BPF: A = ip источника (SKF_NET_OFF + 12), A %= processes, вернуть A - номер сокета группы
+BPF_INSTRUCTION = struct.Struct('=HBBI')
+BPF_LOAD_SOURCE = (0x20, 0, 0, (-0x100000 + 12) & 0xFFFFFFFF)
+BPF_MOD = 0x94
+BPF_RETURN_A = (0x16, 0, 0, 0)
+
+
+class _SockFprog(ctypes.Structure):
+    _fields_ = [('len', ctypes.c_ushort), ('filter', ctypes.c_void_p)]
+
+
+def steer_by_address(sock, processes: int) -> bool:
+    """Makes the kernel pick the socket of the SO_REUSEPORT group by the client ip alone, not by ip and port,
+    so all requests of a client reach one worker and its rate limit holds for the client as a whole.
+    Returns False where it is not supported (not Linux, older than 4.5)"""
+    if SO_ATTACH_REUSEPORT_CBPF is None:
+        return False
+    program = ctypes.create_string_buffer(b''.join(BPF_INSTRUCTION.pack(*instruction) for instruction in
+                                                   (BPF_LOAD_SOURCE, (BPF_MOD, 0, 0, processes), BPF_RETURN_A)))
+    fprog = _SockFprog(3, ctypes.addressof(program))
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_REUSEPORT_CBPF, bytes(fprog))
+    except OSError:
+        return False
+    return True
+
+
+class WorkerServer(UdpServer):
+    """Server of one worker process. After every batch it copies its counters and histogram into its slot
+    of the shared array: every slot has one writer, so no locks are needed"""
+
+    def __init__(self, counters, slot: int, processes: int, *args, **kwargs):
+        self.shared = counters
+        self.slot = slot * self.SNAPSHOT_SIZE
+        super().__init__(*args, stats_interval=0, reuse_port=True, **kwargs)
+        # Программа одна на всю группу, каждый воркер ставит ее заново: так она переживает перезапуски.
+        # Без ограничения частоты не ставим: нагрузка с одного адреса (bench_server.py) шла бы в один воркер
+        if self.limiter:
+            steer_by_address(self.server, processes)
+
+    def receive(self, sock):
+        super().receive(sock)
+        self.shared[self.slot:self.slot + self.SNAPSHOT_SIZE] = self.snapshot()
+
+
+def _serve(counters, slot, processes, server_port, time_offset, options):
+    # Обработчик SIGTERM супервизора унаследован при fork: до своего обработчика воркер должен от SIGTERM умирать
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    # Ctrl-C получает вся группа процессов, воркеры останавливает супервизор через SIGTERM
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    server = WorkerServer(counters, slot, processes, server_port, time_offset, **options)
+
+    def terminate(signum, frame):
+        server.isWorking = False
+    signal.signal(signal.SIGTERM, terminate)
+
+    server.serve()
+    server.selector.close()
+    server.server.close()
+
+
+class Supervisor:
+    """Runs processes copies of UdpServer on one port with SO_REUSEPORT, so the kernel balances datagrams
+    between them and every core serves requests. With rate_limit on Linux a client ip always reaches
+    the same worker (steer_by_address), so the rate limit of a worker is the limit of the client; elsewhere
+    the kernel balances by ip and port, and a client sending from several ports may get up to rate_limit
+    in every worker. Dead workers are restarted, counters of all workers are summed up and printed every
+    stats_interval seconds and served as metrics from metrics_address. Requires Linux or BSD."""
+
+    def __init__(self, server_port: int = 123, time_offset: int = 0, processes: int = None,
+                 stats_interval: float = 10, metrics_address: str = None, **options):
+        if not hasattr(socket, 'SO_REUSEPORT'):
+            raise OSError('SO_REUSEPORT is not supported on this platform')
+        self.isWorking = True
+        self.server_port = server_port
+        self.time_offset = time_offset
+        self.processes = processes or os.cpu_count() or 1
+        self.stats_interval = stats_interval
+        self.options = options
+        self.restarts = 0
+        self.started = time.monotonic()
+        self.exporter = metrics.MetricsServer(metrics_address, self.prometheus) if metrics_address else None
+
+        # Проверяем порт заранее, иначе воркеры будут падать и перезапускаться бесконечно
+        check = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            check.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            check.bind(('', server_port))
+            self.steered = options.get('rate_limit', 0) > 0 and steer_by_address(check, self.processes)
+        finally:
+            check.close()
+
+        self._counters = multiprocessing.Array('Q', self.processes * UdpServer.SNAPSHOT_SIZE, lock=False)
+        # Счетчики умерших воркеров, их слоты занимают перезапущенные
+        self._retired = [0] * UdpServer.SNAPSHOT_SIZE
+        self._workers = [None] * self.processes
+        self._started = [0] * self.processes
+
+    def start(self):
+        print('Server is starting...')
+
+        def terminate(signum, frame):
+            # kill супервизора останавливает и воркеры: start завершится, и вызывающий сделает stop()
+            self.isWorking = False
+        signal.signal(signal.SIGTERM, terminate)
+
+        for slot in range(self.processes):
+            self._spawn(slot)
+        if self.exporter:
+            self.exporter.start()
+        print(f'Server has started. Listen on port {self.server_port} in {self.processes} processes.\n'
+              f'Time offset: {self.time_offset}s\n'
+              f'Clients are spread over processes by {"ip" if self.steered else "ip and port"}\n')
+
+        reported_at, reported = time.monotonic(), 0
+        while self.isWorking:
+            time.sleep(0.5)
+            for slot, worker in enumerate(self._workers):
+                # SIGTERM всей группе (systemd, docker) завершает и воркеров: во время остановки не перезапускаем
+                if not self.isWorking:
+                    break
+                if worker.exitcode is not None and time.monotonic() - self._started[slot] >= RESTART_DELAY:
+                    print(f'Worker {slot} exited with code {worker.exitcode}, restarting', file=sys.stderr)
+                    self.restarts += 1
+                    self._spawn(slot)
+
+            now = time.monotonic()
+            if self.stats_interval > 0 and now - reported_at >= self.stats_interval:
+                totals = self.counters()
+                print(f'Requests: {totals[0]} ({(totals[0] - reported) / (now - reported_at):.0f}/s), '
+                      f'{describe(totals)}, restarts: {self.restarts}')
+                reported_at, reported = now, totals[0]
+
+    def snapshot(self):
+        """Sum of counters and histograms of all workers, dead ones included"""
+        count = UdpServer.SNAPSHOT_SIZE
+        return tuple(self._retired[i] + sum(self._counters[i::count]) for i in range(count))
+
+    def counters(self):
+        return self.snapshot()[:len(UdpServer.COUNTERS)]
+
+    def prometheus(self) -> str:
+        alive = sum(worker is not None and worker.is_alive() for worker in self._workers)
+        return render(self.snapshot(), {'uptime_seconds': ('Seconds since the server started',
+                                                           time.monotonic() - self.started),
+                                        'workers': ('Worker processes alive', alive),
+                                        'restarts': ('Worker processes restarted', self.restarts)})
+
+    def _spawn(self, slot):
+        count = UdpServer.SNAPSHOT_SIZE
+        if self._workers[slot] is not None:
+            for i in range(count):
+                self._retired[i] += self._counters[slot * count + i]
+            self._counters[slot * count:(slot + 1) * count] = [0] * count
+
+        worker = multiprocessing.Process(target=_serve, args=(self._counters, slot, self.processes, self.server_port,
+                                                              self.time_offset, self.options))
+        worker.daemon = True
+        worker.start()
+        self._workers[slot] = worker
+        self._started[slot] = time.monotonic()
+
+    def stop(self):
+        print('Server is stopping...')
+        self.isWorking = False
+        for worker in self._workers:
+            if worker is not None and worker.is_alive():
+                worker.terminate()
+        deadline = time.monotonic() + STOP_TIMEOUT
+        for worker in self._workers:
+            if worker is not None:
+                worker.join(max(0, deadline - time.monotonic()))
+                if worker.is_alive():
+                    worker.kill()
+                    worker.join()
+        if self.exporter:
+            self.exporter.stop()
+        totals = self.counters()
+        print(f'Server has stopped. Requests: {totals[0]}, {describe(totals)}, restarts: {self.restarts}')
@@ -0,0 +1,133 @@
+import sys
+import math
+import time
+import socket
+import statistics
+import threading
+
+import clock
+from client import LEAP_ALARM, Client, parse_server, resolve
+
+# Рост ошибки часов со временем после синхронизации, RFC 5905: 15 ppm
+PHI = 15e-6
+
+
+def short_time(ns: int) -> int:
+    """Nanoseconds to NTP short format (16.16 seconds), used for root delay and dispersion"""
+    return min(0xffffffff, max(0, (ns << 16) // clock.NS))
+
+
+def precision() -> int:
+    """log2 of the clock resolution in seconds, as in the precision field"""
+    return max(-30, math.floor(math.log2(time.get_clock_info('monotonic').resolution)))
+
+
+def select(samples):
+    """Clock select: finds the interval where most of servers agree (Marzullo's algorithm over
+    offset +- distance), servers whose interval contains its middle are truechimers.
+    Returns (offset as median of truechimers, truechimers) or None without majority"""
+    edges = []
+    for sample in samples:
+        edges.append((sample.offset - sample.distance, 0))
+        edges.append((sample.offset + sample.distance, 1))
+    # При равенстве начало интервала раньше конца: касающиеся интервалы пересекаются
+    edges.sort()
+
+    best, count, low, high = 0, 0, None, None
+    for i, (value, end) in enumerate(edges):
+        if end:
+            count -= 1
+            continue
+        count += 1
+        if count > best:
+            best, low, high = count, value, edges[i + 1][0]
+    if best <= len(samples) // 2:
+        return None
+
+    middle = (low + high) // 2
+    truechimers = [s for s in samples if s.offset - s.distance <= middle <= s.offset + s.distance]
+    return int(statistics.median(s.offset for s in truechimers)), truechimers
+
+
+class Upstream:
+    """Synchronizes the clock with upstream servers every interval seconds in its own thread.
+    All servers are asked at once from one socket (client.Client) in samples rounds, for every server
+    the exchange with the least delay is kept (clock filter), then the offset is selected over all servers and cached in the clock as a correction.
+    The request hot path only reads the clock and the reference fields of the last update."""
+
+    def __init__(self, servers, local_clock: clock.Clock, interval: float = 64, samples: int = 4,
+                 timeout: float = 1):
+        self.servers = [parse_server(server) if isinstance(server, str) else server for server in servers]
+        self.clock = local_clock
+        self.interval = interval
+        self.samples = samples
+        self.timeout = timeout
+
+        # (пир, jitter, время синхронизации) одним кортежем: поток сервера читает его в reference() без блокировок
+        # и не должен увидеть пира без времени
+        self.state = None
+        # Увеличивается при каждой синхронизации, сервер по нему обновляет шаблон ответа
+        self.version = 0
+
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+
+    @property
+    def synchronized(self):
+        return self.state is not None
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread.is_alive():
+            # Синхронизация может ждать ответа сервера, ее не дожидаемся дольше таймаута
+            self._thread.join(self.timeout)
+
+    def sync(self) -> bool:
+        """One synchronization. Servers that can not be resolved or reached (the request fails with OSError)
+        count as not answering in this round; False if there is no majority"""
+        addresses = [address for address in resolve(self.servers) if address is not None]
+        try:
+            with Client(self.clock) as client:
+                exchanges = client.rounds(addresses, self.samples, timeout=self.timeout)
+        except OSError as e:
+            print(f'Upstream: {e}', file=sys.stderr)
+            return False
+        filtered = [min(samples, key=lambda sample: sample.delay) for samples in exchanges if samples]
+        selected = select(filtered) if filtered else None
+        if selected is None:
+            print(f'Upstream: {len(filtered)} of {len(self.servers)} servers answered, no majority', file=sys.stderr)
+            return False
+
+        offset, truechimers = selected
+        jitter = int(statistics.pstdev(sample.offset for sample in truechimers))
+        self.clock.correct(offset)
+        # Системный пир - сервер с наименьшей ошибкой, от него берутся stratum и reference id
+        peer = min(truechimers, key=lambda sample: sample.distance)
+        self.state = (peer, jitter, self.clock.local_ns())
+        self.version += 1
+        return True
+
+    def reference(self) -> dict:
+        """Fields of the answer: stratum, reference id and time, root delay and dispersion"""
+        state = self.state
+        if state is None:
+            # Синхронизации еще не было: клиенты не должны нам верить
+            return {'leap': LEAP_ALARM, 'stratum': 0, 'ref_id': int.from_bytes(b'INIT', 'big')}
+        peer, jitter, updated_ns = state
+        elapsed = self.clock.local_ns() - updated_ns
+        dispersion = peer.root_dispersion + peer.delay // 2 + jitter + int(elapsed * PHI)
+        return {'stratum': peer.stratum + 1,
+                'ref_id': int.from_bytes(socket.inet_aton(peer.address), 'big'),
+                'ref_time': clock.ntp_time(updated_ns + self.clock.correction_ns + self.clock.offset_ns),
+                'root_delay': short_time(peer.root_delay + peer.delay),
+                'root_dispersion': short_time(dispersion)}
+
+    def _run(self):
+        while True:
+            self.sync()
+            if self._stopped.wait(self.interval):
+                return